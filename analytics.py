@@ -0,0 +1,347 @@
+"""In-memory column store of participant stats for percentile/average/distribution queries.
+
+Rows live in NumPy arrays (small ints for ids and counters, float32 for
+per-minute metrics, positions and patches dictionary-encoded). Matches are
+appended as they are saved in the process that started the engine and by a
+periodic refresh from the DB (for matches saved by standalone workers). Games
+that fall out of ANALYTICS_WINDOW_DAYS are dropped. Sorted values per
+(metric, champion, role, patch, queue) are cached, so a percentile lookup is a
+binary search.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from db import SessionLocal
+from models import Matches, MatchParticipant
+from match_parser import patch_from_version
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Only games newer than this are loaded at startup
+ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", "90"))
+# Seconds between refreshes from the DB (0 = only matches saved by this process)
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_INTERVAL", "300"))
+ANALYTICS_LOAD_BATCH = 50_000
+ANALYTICS_GROUP_CACHE_SIZE = 4096
+# Without refreshes (ANALYTICS_REFRESH_INTERVAL=0), games leaving the window are dropped this often
+EVICT_INTERVAL = 3600
+# A refresh looks this far behind the newest ingested_at it has seen, for rows
+# whose transaction committed after a later one
+REFRESH_OVERLAP = timedelta(minutes=10)
+
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+POSITIONS = ("", "TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY", "INVALID")
+_POSITION_CODE = {p: i for i, p in enumerate(POSITIONS)}
+
+# Stored columns and dtypes
+_COLUMNS = {
+    "champion_id": np.int16,
+    "position": np.uint8,  # index into POSITIONS
+    "patch": np.uint16,  # index into engine.patches
+    "queue_id": np.int16,
+    "game_start_ts": np.int64,
+    "win": np.bool_,
+    "kills": np.int16,
+    "deaths": np.int16,
+    "assists": np.int16,
+    "cs": np.int16,
+    "gold_earned": np.int32,
+    "damage": np.int32,
+    "vision_score": np.int16,
+    "kda": np.float32,
+    "cs_per_minute": np.float32,
+    "gold_per_minute": np.float32,
+    "damage_per_minute": np.float32,
+    "vision_per_minute": np.float32,
+    "kill_participation": np.float32,  # NaN when Riot didn't send it
+}
+METRICS = (
+    "kills", "deaths", "assists", "kda", "cs", "cs_per_minute", "gold_earned", "gold_per_minute",
+    "damage", "damage_per_minute", "vision_score", "vision_per_minute", "kill_participation",
+)
+
+# (match_id, champion_id, position, win, kills, deaths, assists, cs, gold, damage,
+#  vision, kill_participation, queue_id, game_version, duration_sec, game_start_ts)
+Row = tuple
+
+
+def _window_start() -> int:
+    """game_start_ts (ms) of the oldest game the engine keeps."""
+    return int((datetime.now(timezone.utc) - timedelta(days=ANALYTICS_WINDOW_DAYS)).timestamp() * 1000)
+
+
+class ColumnStore:
+    """Set of equally long NumPy columns, appended to (capacity doubles as it grows) and compacted by `keep`."""
+
+    def __init__(self, dtypes: dict):
+        self.dtypes = dtypes
+        self.size = 0
+        self._data = {name: np.empty(0, dtype) for name, dtype in dtypes.items()}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self._data[name][:self.size]
+
+    def append(self, columns: dict[str, np.ndarray]):
+        n = len(next(iter(columns.values())))
+        needed = self.size + n
+        capacity = len(self._data[next(iter(self.dtypes))])
+        if needed > capacity:
+            capacity = max(needed, capacity * 2, 1024)
+            for name, array in self._data.items():
+                grown = np.empty(capacity, self.dtypes[name])
+                grown[:self.size] = array[:self.size]
+                self._data[name] = grown
+        for name, values in columns.items():
+            self._data[name][self.size:needed] = values
+        self.size = needed
+
+    def keep(self, mask: np.ndarray):
+        """Drop the rows where `mask` is False, in place."""
+        kept = int(mask.sum())
+        for name, array in self._data.items():
+            array[:kept] = array[:self.size][mask]
+        self.size = kept
+
+
+class AnalyticsEngine:
+    def __init__(self):
+        self.store = ColumnStore(_COLUMNS)
+        self.patches: list[str] = []
+        self._patch_code: dict[str, int] = {}
+        # match_id -> game_start_ts, so the ids can be dropped with their rows
+        self._match_ids: dict[str, int] = {}
+        self._loading: dict[str, int] = {}  # added by the refresh in progress
+        # newest matches.ingested_at loaded by a refresh
+        self.ingested_until: datetime | None = None
+        self.ready = False
+        # only fed by add_matches in the process that started it (not in standalone workers)
+        self.started = False
+        # (champion_id, position) -> bumped on every append to that group
+        self._generation: dict[tuple[int, int], int] = {}
+        self._sorted = LRUCache(ANALYTICS_GROUP_CACHE_SIZE, name="analytics_groups")
+        self._task: asyncio.Task | None = None
+
+    # -----------------------------
+    # Loading
+    # -----------------------------
+    def _patch(self, game_version: str) -> int:
+        patch = patch_from_version(game_version)
+        code = self._patch_code.get(patch)
+        if code is None:
+            code = self._patch_code[patch] = len(self.patches)
+            self.patches.append(patch)
+        return code
+
+    def add_rows(self, rows: Iterable[Row], _refreshing: bool = False) -> int:
+        if _refreshing:
+            # a match's participants can span two batches: only skip what was known before the refresh
+            rows = [r for r in rows if r[0] not in self._match_ids]
+        else:
+            rows = [r for r in rows if r[0] not in self._match_ids and r[0] not in self._loading]
+        if not rows:
+            return 0
+        (match_ids, champion, position, win, kills, deaths, assists, cs, gold, damage,
+         vision, kp, queue, version, duration, start_ts) = zip(*rows)
+
+        minutes = np.maximum(np.array(duration, np.float32) / 60, 1 / 60)
+        kills = np.array(kills, np.int16)
+        deaths = np.array(deaths, np.int16)
+        assists = np.array(assists, np.int16)
+        cs = np.array(cs, np.int16)
+        gold = np.array(gold, np.int32)
+        damage = np.array(damage, np.int32)
+        vision = np.array(vision, np.int16)
+        columns = {
+            "champion_id": np.array(champion, np.int16),
+            "position": np.array([_POSITION_CODE.get(p or "", _POSITION_CODE["INVALID"]) for p in position], np.uint8),
+            "patch": np.array([self._patch(v) for v in version], np.uint16),
+            "queue_id": np.array(queue, np.int16),
+            "game_start_ts": np.array(start_ts, np.int64),
+            "win": np.array(win, np.bool_),
+            "kills": kills,
+            "deaths": deaths,
+            "assists": assists,
+            "cs": cs,
+            "gold_earned": gold,
+            "damage": damage,
+            "vision_score": vision,
+            "kda": (kills + assists.astype(np.float32)) / np.maximum(deaths, 1),
+            "cs_per_minute": cs / minutes,
+            "gold_per_minute": gold / minutes,
+            "damage_per_minute": damage / minutes,
+            "vision_per_minute": vision / minutes,
+            "kill_participation": np.array([np.nan if v is None else v for v in kp], np.float32),
+        }
+        self.store.append(columns)
+        (self._loading if _refreshing else self._match_ids).update(zip(match_ids, start_ts))
+        for key in set(zip(champion, columns["position"].tolist())):
+            self._generation[key] = self._generation.get(key, 0) + 1
+        return len(rows)
+
+    def add_matches(self, matches) -> int:
+        """Matches just saved by this process: (MatchCreate, teams, players) tuples."""
+        if not self.started:
+            return 0
+        since = _window_start()
+        return self.add_rows(
+            (m.match_id, p.champion_id, p.individual_position, p.win, p.kills, p.deaths, p.assists,
+             p.total_minions_killed + p.neutral_minions_killed, p.gold_earned, p.total_damage_dealt_to_champions,
+             p.vision_score, p.kill_participation, m.queue_id, m.game_version, m.duration_sec, m.game_start_ts)
+            for m, _, players in matches if m.game_start_ts >= since for p in players
+        )
+
+    async def refresh(self, db: AsyncSession) -> int:
+        """Load games of the window saved since the last refresh (all of them the first time)."""
+        since = _window_start()
+        self.evict(since)
+        mp = MatchParticipant
+        stmt = (
+            select(
+                mp.match_id, mp.champion_id, mp.individual_position, mp.win, mp.kills, mp.deaths, mp.assists,
+                mp.total_minions_killed + mp.neutral_minions_killed, mp.gold_earned, mp.total_damage_dealt_to_champions,
+                mp.vision_score, mp.kill_participation,
+                Matches.queue_id, Matches.game_version, Matches.duration_sec, Matches.game_start_ts,
+                Matches.ingested_at,
+            )
+            .join(Matches, (Matches.match_id == mp.match_id) & (Matches.game_start_ts == mp.game_start_ts))
+            .where(Matches.game_start_ts >= since, mp.game_start_ts >= since)  # both sides prune partitions
+        )
+        if self.ingested_until is not None:
+            # by insertion, not game start: a backfill saves games that started long ago
+            stmt = stmt.where(Matches.ingested_at >= self.ingested_until - REFRESH_OVERLAP)
+        added = 0
+        newest = self.ingested_until
+        try:
+            result = await db.stream(stmt.execution_options(yield_per=ANALYTICS_LOAD_BATCH))
+            async for rows in result.partitions(ANALYTICS_LOAD_BATCH):
+                batch_newest = max(r[-1] for r in rows)
+                newest = batch_newest if newest is None else max(newest, batch_newest)
+                added += self.add_rows((tuple(r)[:-1] for r in rows), _refreshing=True)
+            # only once everything up to it is loaded; rows don't stream in ingested_at order
+            self.ingested_until = newest
+        finally:
+            self._match_ids.update(self._loading)
+            self._loading = {}
+        return added
+
+    def evict(self, since: int) -> int:
+        """Drop games that started before `since` (ms), i.e. fell out of the window."""
+        mask = self.store["game_start_ts"] >= since
+        dropped = len(mask) - int(mask.sum())
+        if not dropped:
+            return 0
+        self.store.keep(mask)
+        self._match_ids = {m: ts for m, ts in self._match_ids.items() if ts >= since}
+        # every cached group may have lost rows; len(store) alone could repeat an old key
+        self._sorted.clear()
+        for key in self._generation:
+            self._generation[key] += 1
+        logger.info("analytics: evicted %s rows older than the window", dropped)
+        return dropped
+
+    async def _run(self, session_factory):
+        while True:
+            started = time.monotonic()
+            try:
+                async with session_factory() as db:
+                    added = await self.refresh(db)
+                if added:
+                    logger.info("analytics: +%s rows (%s total) in %.1fs", added, len(self.store), time.monotonic() - started)
+                self.ready = True
+            except Exception:
+                logger.exception("analytics refresh failed")
+            if ANALYTICS_REFRESH_INTERVAL <= 0 and self.ready:
+                break
+            await asyncio.sleep(ANALYTICS_REFRESH_INTERVAL or 30)
+        # no refreshes: still age games out of the window
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            self.evict(_window_start())
+
+    def start(self, session_factory=SessionLocal):
+        self.started = True
+        self._task = asyncio.create_task(self._run(session_factory))
+
+    async def stop(self):
+        self.started = False
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    def _mask(self, champion_id: Optional[int], position: Optional[str], patch: Optional[str], queue: Optional[int]) -> np.ndarray | None:
+        """Boolean row mask, or None when a filter value matches nothing."""
+        s = self.store
+        mask = np.ones(len(s), np.bool_)
+        if champion_id is not None:
+            mask &= s["champion_id"] == champion_id
+        if position is not None:
+            code = _POSITION_CODE.get(position.upper())
+            if code is None:
+                return None
+            mask &= s["position"] == code
+        if patch is not None:
+            code = self._patch_code.get(patch)
+            if code is None:
+                return None
+            mask &= s["patch"] == code
+        if queue is not None:
+            mask &= s["queue_id"] == queue
+        return mask
+
+    def sorted_values(self, metric: str, champion_id=None, position=None, patch=None, queue=None) -> np.ndarray:
+        if metric not in METRICS and metric != "win":
+            raise ValueError(f"unknown metric {metric!r}")
+        position = position.upper() if position else None
+        group = (champion_id, _POSITION_CODE.get(position) if position else None)
+        key = (metric, champion_id, position, patch, queue, len(self.store) if None in group else self._generation.get(group, 0))
+        values = self._sorted.get(key)
+        if values is None:
+            mask = self._mask(champion_id, position, patch, queue)
+            values = np.empty(0, np.float32) if mask is None else self.store[metric][mask].astype(np.float32)
+            values = np.sort(values[~np.isnan(values)])
+            self._sorted.set(key, values)
+        return values
+
+    def win_rate(self, champion_id=None, position=None, patch=None, queue=None) -> float | None:
+        wins = self.sorted_values("win", champion_id, position, patch, queue)
+        return float(wins.mean()) if len(wins) else None
+
+    def percentiles(self, metric: str, champion_id=None, position=None, patch=None, queue=None, value: float | None = None) -> dict:
+        values = self.sorted_values(metric, champion_id, position, patch, queue)
+        n = len(values)
+        out = {"games": n, "mean": None, "std": None, "percentiles": {}, "percentile_rank": None}
+        if n == 0:
+            return out
+        out["mean"] = float(values.mean())
+        out["std"] = float(values.std())
+        # values are sorted: quantiles by index, no partition step
+        out["percentiles"] = {f"p{q}": float(values[min(int(q / 100 * n), n - 1)]) for q in PERCENTILES}
+        if value is not None:
+            below = np.searchsorted(values, value, side="left")
+            upto = np.searchsorted(values, value, side="right")
+            out["percentile_rank"] = float((below + upto) / 2 / n * 100)
+        return out
+
+    def distribution(self, metric: str, champion_id=None, position=None, patch=None, queue=None, bins: int = 20) -> dict:
+        values = self.sorted_values(metric, champion_id, position, patch, queue)
+        if len(values) == 0:
+            return {"games": 0, "edges": [], "counts": []}
+        counts, edges = np.histogram(values, bins=bins)
+        return {"games": len(values), "edges": edges.tolist(), "counts": counts.tolist()}
+
+
+engine = AnalyticsEngine()
@@ -0,0 +1,410 @@
+"""Local stand-in for the Riot API, for load tests that shouldn't spend a real key.
+
+    python bench/fake_riot.py --port 8100 --latency-ms 40 --jitter-ms 20 --p429 0.01
+
+then start the API against it:
+
+    RIOT_API_BASE_URL='http://127.0.0.1:8100/{host}' RIOT_API_KEY=bench uvicorn main:app
+
+Serves account-v1 (by-riot-id, by-puuid, region), summoner-v4 by-puuid,
+match-v5 (ids and detail) and league-v4 entries for a synthetic population of
+`--players` players named `bench<i>#BENCH`. Match bodies are the recorded
+payload (`response_1769084017838.json`) with ids, timestamps, queue and
+participants rewritten, so the app parses real-sized matches. Every player has
+`--matches-per-player` games; game m is played by players m .. m+9 (mod players).
+
+Rate limits behave like Riot's: X-App-Rate-Limit / X-Method-Rate-Limit and
+their -Count headers are sent on every response, exceeding them gives a 429
+with Retry-After, and `--p429` injects extra 429s (`--p429-type` picks the
+X-Rate-Limit-Type; `--no-retry-after` drops the header like Riot's underlying
+service limits sometimes do).
+"""
+import argparse
+import asyncio
+import copy
+import hashlib
+import os
+import random
+import sys
+import time
+from collections import deque
+from functools import lru_cache
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORDED_MATCH = os.path.join(ROOT, "response_1769084017838.json")
+
+PLATFORM = "la1"
+TAG_LINE = "BENCH"
+QUEUES = (420, 420, 440, 450)  # solo queue twice as often
+GAME_INTERVAL_MS = 30 * 60 * 1000
+TIERS = ("IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", "DIAMOND")
+RANKS = ("IV", "III", "II", "I")
+BASE_TS = int(time.time() * 1000)
+
+
+class Config:
+    players = 10_000
+    matches_per_player = 100
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    p429 = 0.0
+    p429_type = "service"
+    retry_after = 1
+    send_retry_after = True
+    app_rate_limit = "20000:10,1200000:600"
+    method_rate_limit = "20000:10"
+
+
+config = Config()
+
+
+# -----------------------------
+# Synthetic population
+# -----------------------------
+def puuid_of(index: int) -> str:
+    # 78 chars like Riot's
+    return hashlib.sha512(f"bench-{index}".encode()).hexdigest()[:78]
+
+
+@lru_cache(maxsize=None)
+def _puuid_index() -> dict[str, int]:
+    return {puuid_of(i): i for i in range(config.players)}
+
+
+def player_index(puuid: str) -> int | None:
+    return _puuid_index().get(puuid)
+
+
+def game_name(index: int) -> str:
+    return f"bench{index}"
+
+
+def total_matches() -> int:
+    # each game has 10 players
+    return config.players * config.matches_per_player // 10
+
+
+def match_id(m: int) -> str:
+    return f"LA1_{9_000_000_000 + m}"
+
+
+def match_number(mid: str) -> int | None:
+    prefix, _, number = mid.partition("_")
+    if prefix.upper() != "LA1" or not number.isdigit():
+        return None
+    m = int(number) - 9_000_000_000
+    return m if 0 <= m < total_matches() else None
+
+
+def match_queue(m: int) -> int:
+    return QUEUES[m % len(QUEUES)]
+
+
+def match_start_ts(m: int) -> int:
+    # newest game = now-ish, so "recent matches" look recent
+    return BASE_TS - (total_matches() - m) * GAME_INTERVAL_MS
+
+
+def matches_of(index: int) -> list[int]:
+    """Game numbers of a player, newest first (player i plays games i-9 .. i, mod players)."""
+    n, total = config.players, total_matches()
+    games = []
+    for j in range(10):
+        m = (index - j) % n
+        while m < total:
+            games.append(m)
+            m += n
+    games.sort(reverse=True)
+    return games
+
+
+# -----------------------------
+# Payloads
+# -----------------------------
+@lru_cache(maxsize=1)
+def _template() -> dict:
+    with open(RECORDED_MATCH, "rb") as f:
+        return orjson.loads(f.read())
+
+
+@lru_cache(maxsize=20_000)
+def match_body(m: int) -> bytes:
+    raw = copy.deepcopy(_template())
+    start = match_start_ts(m)
+    players = [(m + j) % config.players for j in range(10)]
+    info = raw["info"]
+    raw["metadata"]["matchId"] = match_id(m)
+    raw["metadata"]["participants"] = [puuid_of(i) for i in players]
+    info["gameId"] = 9_000_000_000 + m
+    info["queueId"] = match_queue(m)
+    info["platformId"] = PLATFORM.upper()
+    info["gameCreation"] = start - 60_000
+    info["gameStartTimestamp"] = start
+    info["gameEndTimestamp"] = start + info["gameDuration"] * 1000
+    for participant, i in zip(info["participants"], players):
+        participant["puuid"] = puuid_of(i)
+        participant["riotIdGameName"] = game_name(i)
+        participant["riotIdTagline"] = TAG_LINE
+        participant["summonerName"] = game_name(i)
+    return orjson.dumps(raw)
+
+
+def account(index: int) -> dict:
+    return {"puuid": puuid_of(index), "gameName": game_name(index), "tagLine": TAG_LINE}
+
+
+def summoner(index: int) -> dict:
+    return {
+        "puuid": puuid_of(index),
+        "profileIconId": index % 5000,
+        "revisionDate": BASE_TS,
+        "summonerLevel": 30 + index % 500,
+    }
+
+
+def league_entries(index: int) -> list[dict]:
+    rng = random.Random(index)
+    wins, losses = rng.randint(10, 300), rng.randint(10, 300)
+    return [{
+        "leagueId": hashlib.md5(f"league-{index % 97}".encode()).hexdigest(),
+        "queueType": "RANKED_SOLO_5x5",
+        "tier": rng.choice(TIERS),
+        "rank": rng.choice(RANKS),
+        "puuid": puuid_of(index),
+        "leaguePoints": rng.randint(0, 99),
+        "wins": wins,
+        "losses": losses,
+        "veteran": False,
+        "inactive": False,
+        "freshBlood": False,
+        "hotStreak": rng.random() < 0.1,
+    }]
+
+
+# -----------------------------
+# Rate limits
+# -----------------------------
+def parse_limits(header: str) -> list[tuple[int, int]]:
+    return [tuple(int(x) for x in part.split(":")) for part in header.split(",") if part]
+
+
+class Window:
+    """Requests in the last `seconds`, counted from the first one like Riot does."""
+
+    def __init__(self, limit: int, seconds: int):
+        self.limit = limit
+        self.seconds = seconds
+        self.hits: deque[float] = deque()
+
+    def count(self, now: float) -> int:
+        while self.hits and self.hits[0] <= now - self.seconds:
+            self.hits.popleft()
+        return len(self.hits)
+
+    def retry_after(self, now: float) -> float:
+        return self.hits[len(self.hits) - self.limit] + self.seconds - now
+
+
+class Limits:
+    def __init__(self, header: str):
+        self.header = header
+        self.windows = [Window(limit, seconds) for limit, seconds in parse_limits(header)]
+
+    def exceeded(self, now: float) -> float | None:
+        waits = [w.retry_after(now) for w in self.windows if w.count(now) >= w.limit]
+        return max(waits) if waits else None
+
+    def take(self, now: float):
+        for w in self.windows:
+            w.hits.append(now)
+
+    def count_header(self, now: float) -> str:
+        return ",".join(f"{w.count(now)}:{w.seconds}" for w in self.windows)
+
+
+_app_limits: dict[str, Limits] = {}
+_method_limits: dict[tuple[str, str], Limits] = {}
+
+
+def limits_for(host: str, method: str) -> tuple[Limits, Limits]:
+    app_limits = _app_limits.get(host)
+    if app_limits is None:
+        app_limits = _app_limits[host] = Limits(config.app_rate_limit)
+    method_limits = _method_limits.get((host, method))
+    if method_limits is None:
+        method_limits = _method_limits[(host, method)] = Limits(config.method_rate_limit)
+    return app_limits, method_limits
+
+
+# -----------------------------
+# App
+# -----------------------------
+app = FastAPI(title="fake riot")
+stats = {"requests": 0, "429": 0, "404": 0}
+
+
+async def reply(request: Request, host: str, method: str, produce) -> Response:
+    stats["requests"] += 1
+    if config.latency_ms or config.jitter_ms:
+        delay = max(0.0, random.gauss(config.latency_ms, config.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+    now = time.monotonic()
+    app_limits, method_limits = limits_for(host.lower(), method)
+    headers = {
+        "X-App-Rate-Limit": app_limits.header,
+        "X-Method-Rate-Limit": method_limits.header,
+    }
+    limit_type, wait = None, None
+    app_wait, method_wait = app_limits.exceeded(now), method_limits.exceeded(now)
+    if app_wait is not None:
+        limit_type, wait = "application", app_wait
+    elif method_wait is not None:
+        limit_type, wait = "method", method_wait
+    elif config.p429 and random.random() < config.p429:
+        limit_type, wait = config.p429_type, config.retry_after
+    else:
+        app_limits.take(now)
+        method_limits.take(now)
+    headers["X-App-Rate-Limit-Count"] = app_limits.count_header(now)
+    headers["X-Method-Rate-Limit-Count"] = method_limits.count_header(now)
+
+    if limit_type is not None:
+        stats["429"] += 1
+        headers["X-Rate-Limit-Type"] = limit_type
+        if config.send_retry_after or limit_type != "service":
+            headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+        return Response(b'{"status":{"message":"Rate limit exceeded","status_code":429}}', 429, headers, "application/json")
+
+    body = produce()
+    if body is None:
+        stats["404"] += 1
+        return Response(b'{"status":{"message":"Data not found","status_code":404}}', 404, headers, "application/json")
+    if not isinstance(body, bytes):
+        body = orjson.dumps(body)
+    return Response(body, 200, headers, "application/json")
+
+
+def _by_name(name: str, tag: str) -> int | None:
+    if tag.upper() != TAG_LINE or not name.lower().startswith("bench"):
+        return None
+    number = name[5:]
+    if not number.isdigit() or int(number) >= config.players:
+        return None
+    return int(number)
+
+
+@app.get("/{host}/riot/account/v1/accounts/by-riot-id/{name}/{tag}")
+async def account_by_riot_id(host: str, name: str, tag: str, request: Request):
+    def produce():
+        index = _by_name(name, tag)
+        return None if index is None else account(index)
+    return await reply(request, host, "account-v1.by-riot-id", produce)
+
+
+@app.get("/{host}/riot/account/v1/accounts/by-puuid/{puuid}")
+async def account_by_puuid(host: str, puuid: str, request: Request):
+    def produce():
+        index = player_index(puuid)
+        return None if index is None else account(index)
+    return await reply(request, host, "account-v1.by-puuid", produce)
+
+
+@app.get("/{host}/riot/account/v1/region/by-game/lol/by-puuid/{puuid}")
+async def region_by_puuid(host: str, puuid: str, request: Request):
+    def produce():
+        index = player_index(puuid)
+        return None if index is None else {"puuid": puuid, "game": "lol", "region": PLATFORM}
+    return await reply(request, host, "account-v1.region-by-puuid", produce)
+
+
+@app.get("/{host}/lol/summoner/v4/summoners/by-puuid/{puuid}")
+async def summoner_by_puuid(host: str, puuid: str, request: Request):
+    def produce():
+        index = player_index(puuid)
+        return None if index is None or host.lower() != PLATFORM else summoner(index)
+    return await reply(request, host, "summoner-v4.by-puuid", produce)
+
+
+@app.get("/{host}/lol/match/v5/matches/by-puuid/{puuid}/ids")
+async def match_ids(
+    host: str,
+    puuid: str,
+    request: Request,
+    start: int = 0,
+    count: int = 20,
+    queue: int | None = None,
+    startTime: int | None = None,
+):
+    def produce():
+        index = player_index(puuid)
+        if index is None:
+            return []
+        games = matches_of(index)
+        if queue is not None:
+            games = [m for m in games if match_queue(m) == queue]
+        if startTime is not None:
+            games = [m for m in games if match_start_ts(m) >= startTime * 1000]
+        return [match_id(m) for m in games[start:start + min(count, 100)]]
+    return await reply(request, host, "match-v5.ids-by-puuid", produce)
+
+
+@app.get("/{host}/lol/match/v5/matches/{mid}")
+async def match_detail(host: str, mid: str, request: Request):
+    def produce():
+        m = match_number(mid)
+        return None if m is None else match_body(m)
+    return await reply(request, host, "match-v5.match", produce)
+
+
+@app.get("/{host}/lol/league/v4/entries/by-puuid/{puuid}")
+async def league_by_puuid(host: str, puuid: str, request: Request):
+    def produce():
+        index = player_index(puuid)
+        return None if index is None else league_entries(index)
+    return await reply(request, host, "league-v4.entries-by-puuid", produce)
+
+
+@app.get("/_stats")
+async def fake_stats():
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--players", type=int, default=Config.players)
+    parser.add_argument("--matches-per-player", type=int, default=Config.matches_per_player)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean added latency per response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="standard deviation of the added latency")
+    parser.add_argument("--p429", type=float, default=0.0, help="probability of an injected 429")
+    parser.add_argument("--p429-type", choices=("application", "method", "service"), default="service")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of injected 429s (seconds)")
+    parser.add_argument("--no-retry-after", action="store_true", help="send injected service 429s without Retry-After")
+    parser.add_argument("--app-rate-limit", default=Config.app_rate_limit, help="e.g. 20:1,100:120 for a development key")
+    parser.add_argument("--method-rate-limit", default=Config.method_rate_limit)
+    args = parser.parse_args()
+
+    if not os.path.exists(RECORDED_MATCH):
+        sys.exit(f"recorded match not found: {RECORDED_MATCH}")
+    config.players = args.players
+    config.matches_per_player = args.matches_per_player
+    config.latency_ms = args.latency_ms
+    config.jitter_ms = args.jitter_ms
+    config.p429 = args.p429
+    config.p429_type = args.p429_type
+    config.retry_after = args.retry_after
+    config.send_retry_after = not args.no_retry_after
+    config.app_rate_limit = args.app_rate_limit
+    config.method_rate_limit = args.method_rate_limit
+    _puuid_index()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Open-loop load test of the API, reporting latency percentiles and throughput per endpoint.
+
+    python bench/loadtest.py --base-url http://127.0.0.1:8000 --rps 200 --duration 60
+
+Run it against an API started on bench/fake_riot.py and a local Postgres (see
+README, "Benchmarks"). Requests are started on a fixed schedule whatever the
+response times, and latency is measured from the scheduled start, so a stall
+shows up in the percentiles instead of silently lowering the load.
+
+Traffic mix (`--mix`, weights): POST /summoners/, GET /summoners/{puuid}/matches,
+GET /matches/{matchId} and GET /summoners/ranked, for players drawn from the
+fake server's population (`bench<i>#BENCH`). A fraction `--hot` of requests go
+to a small set of popular players, the rest are spread over `--players`.
+
+`--out results.json` saves the run; `--baseline results.json` compares against
+an earlier one and exits 1 when p95 latency grows or throughput drops by more
+than `--max-regression` (default 20%).
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+import httpx
+
+ENDPOINTS = ("summoner", "matches", "match", "ranked")
+DEFAULT_MIX = "summoner=2,matches=3,match=4,ranked=2"
+PERCENTILES = (50, 95, 99)
+ROUTING_REGION = "americas"
+PLATFORM = "la1"
+TAG_LINE = "BENCH"
+HOT_PLAYERS = 50
+
+
+def percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q / 100 * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Population:
+    """Players known to the test; puuids and match ids are learnt from responses."""
+
+    def __init__(self, players: int, hot: float):
+        self.players = players
+        self.hot = hot
+        self.puuids: dict[int, str] = {}
+        self.match_ids: list[str] = []
+        self._seen_matches: set[str] = set()
+
+    def pick(self) -> int:
+        if random.random() < self.hot:
+            return random.randrange(min(HOT_PLAYERS, self.players))
+        return random.randrange(self.players)
+
+    def pick_known(self) -> tuple[int, str] | None:
+        if not self.puuids:
+            return None
+        index = self.pick()
+        puuid = self.puuids.get(index)
+        if puuid is None:
+            index, puuid = random.choice(list(self.puuids.items()))
+        return index, puuid
+
+    def add_matches(self, ids: list[str]):
+        for mid in ids:
+            if mid not in self._seen_matches:
+                self._seen_matches.add(mid)
+                self.match_ids.append(mid)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.skipped = 0  # nothing to request yet (no known puuid/match)
+        self.dropped = 0  # --max-inflight reached
+
+    def record(self, endpoint: str, status: str, seconds: float):
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        out = {"elapsed": elapsed, "skipped": self.skipped, "dropped": self.dropped, "endpoints": {}}
+        all_latencies = []
+        for endpoint in ENDPOINTS:
+            values = sorted(self.latencies.get(endpoint, []))
+            if not values:
+                continue
+            all_latencies.extend(values)
+            ok = sum(n for status, n in self.statuses[endpoint].items() if status.startswith(("2", "3")))
+            out["endpoints"][endpoint] = {
+                "requests": len(values),
+                "ok": ok,
+                "rps": len(values) / elapsed,
+                "ok_rps": ok / elapsed,
+                "statuses": dict(self.statuses[endpoint]),
+                **{f"p{q}_ms": percentile(values, q) * 1000 for q in PERCENTILES},
+                "max_ms": values[-1] * 1000,
+            }
+        all_latencies.sort()
+        total_ok = sum(e["ok"] for e in out["endpoints"].values())
+        out["total"] = {
+            "requests": len(all_latencies),
+            "ok": total_ok,
+            "rps": len(all_latencies) / elapsed,
+            "ok_rps": total_ok / elapsed,
+            **{f"p{q}_ms": (percentile(all_latencies, q) or 0) * 1000 for q in PERCENTILES},
+        }
+        return out
+
+
+async def call(client: httpx.AsyncClient, endpoint: str, population: Population) -> tuple[str, int] | None:
+    """One request; None when there is nothing to ask for yet."""
+    if endpoint == "summoner":
+        index = population.pick()
+        r = await client.post("/summoners/", params={"gameName": f"bench{index}", "tagLine": TAG_LINE, "region": ROUTING_REGION})
+        if r.status_code == 200:
+            population.puuids[index] = r.json()["puuid"]
+        return endpoint, r.status_code
+
+    known = population.pick_known()
+    if known is None:
+        return None
+    _, puuid = known
+    if endpoint == "matches":
+        r = await client.get(f"/summoners/{puuid}/matches", params={"region": ROUTING_REGION, "num_matches": 20})
+        if r.status_code == 200:
+            population.add_matches(r.json())
+    elif endpoint == "match":
+        if not population.match_ids:
+            return None
+        # recent matches are the popular ones
+        ids = population.match_ids
+        mid = ids[-1 - min(int(random.expovariate(1 / 200)), len(ids) - 1)]
+        r = await client.get(f"/matches/{mid}", params={"routingRegion": ROUTING_REGION})
+    else:
+        r = await client.get("/summoners/ranked", params={"puuid": puuid, "region": PLATFORM})
+    return endpoint, r.status_code
+
+
+async def warm_up(client: httpx.AsyncClient, population: Population, players: int, concurrency: int = 20):
+    """Create the hot players and load their match ids, so every endpoint has targets from t=0."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index: int):
+        async with semaphore:
+            r = await client.post("/summoners/", params={"gameName": f"bench{index}", "tagLine": TAG_LINE, "region": ROUTING_REGION})
+            if r.status_code != 200:
+                return
+            puuid = population.puuids[index] = r.json()["puuid"]
+            r = await client.get(f"/summoners/{puuid}/matches", params={"region": ROUTING_REGION, "num_matches": 20})
+            if r.status_code == 200:
+                population.add_matches(r.json())
+
+    await asyncio.gather(*(one(i) for i in range(min(players, population.players))))
+
+
+async def run(args) -> dict:
+    weights = {}
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint {name!r} in --mix (expected {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    names, cum_weights = list(weights), []
+    for w in weights.values():
+        cum_weights.append((cum_weights[-1] if cum_weights else 0) + w)
+
+    population = Population(args.players, args.hot)
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        if args.warmup_players:
+            started = time.perf_counter()
+            await warm_up(client, population, args.warmup_players)
+            print(f"warm-up: {len(population.puuids)} players, {len(population.match_ids)} match ids in {time.perf_counter() - started:.1f}s")
+
+        inflight: set[asyncio.Task] = set()
+
+        async def timed(endpoint: str, scheduled: float):
+            try:
+                result = await call(client, endpoint, population)
+            except httpx.HTTPError as e:
+                result = endpoint, type(e).__name__
+            if result is None:
+                recorder.skipped += 1
+            else:
+                recorder.record(result[0], str(result[1]), time.perf_counter() - scheduled)
+
+        total = int(args.rps * args.duration)
+        start = time.perf_counter()
+        for i in range(total):
+            scheduled = start + i / args.rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(inflight) >= args.max_inflight:
+                recorder.dropped += 1
+                continue
+            endpoint = random.choices(names, cum_weights=cum_weights)[0]
+            task = asyncio.create_task(timed(endpoint, scheduled))
+            inflight.add(task)
+            task.add_done_callback(inflight.discard)
+        if inflight:
+            await asyncio.gather(*inflight)
+        elapsed = time.perf_counter() - start
+    return recorder.summary(elapsed)
+
+
+def print_report(result: dict):
+    header = f"{'endpoint':<10} {'reqs':>7} {'ok/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses"
+    print(header)
+    print("-" * len(header))
+    for name, e in result["endpoints"].items():
+        statuses = " ".join(f"{s}:{n}" for s, n in sorted(e["statuses"].items()))
+        print(f"{name:<10} {e['requests']:>7} {e['ok_rps']:>8.1f} {e['p50_ms']:>8.1f} {e['p95_ms']:>8.1f} "
+              f"{e['p99_ms']:>8.1f} {e['max_ms']:>8.1f}  {statuses}")
+    t = result["total"]
+    print(f"{'total':<10} {t['requests']:>7} {t['ok_rps']:>8.1f} {t['p50_ms']:>8.1f} {t['p95_ms']:>8.1f} {t['p99_ms']:>8.1f}")
+    if result["dropped"] or result["skipped"]:
+        print(f"dropped (max in-flight reached): {result['dropped']}, skipped (no target yet): {result['skipped']}")
+
+
+def regressions(result: dict, baseline: dict, max_regression: float) -> list[str]:
+    found = []
+    for name, e in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        if before["p95_ms"] and e["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            found.append(f"{name}: p95 {before['p95_ms']:.1f} -> {e['p95_ms']:.1f} ms")
+        if before["ok_rps"] and e["ok_rps"] < before["ok_rps"] * (1 - max_regression):
+            found.append(f"{name}: ok/s {before['ok_rps']:.1f} -> {e['ok_rps']:.1f}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=100, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"endpoint weights (default {DEFAULT_MIX})")
+    parser.add_argument("--players", type=int, default=10_000, help="must not exceed fake_riot.py --players")
+    parser.add_argument("--hot", type=float, default=0.8, help=f"share of requests for the {HOT_PLAYERS} popular players")
+    parser.add_argument("--warmup-players", type=int, default=HOT_PLAYERS)
+    parser.add_argument("--max-inflight", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    result = asyncio.run(run(args))
+    result["config"] = {k: v for k, v in vars(args).items() if k not in ("out", "baseline")}
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(result, json.load(f), args.max_regression)
+        if found:
+            print("Regressions against the baseline:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""Caches: a bounded in-process LRU, and namespaced caches on a pluggable backend.
+
+`Cache` is what the profile, match-id, ranked and response caches use. Its
+backend is chosen by CACHE_URL:
+
+- `local://` (default): objects kept in this process, as before. Every
+  gunicorn worker has its own copy.
+- `redis://host:6379/0` (or `rediss://`, `unix://`): one store shared by all
+  workers and nodes (Redis, Valkey, or anything speaking its protocol). Values
+  are JSON encoded by pydantic-core. Needs `pip install redis`.
+- `memory://`: in this process, but values are encoded like for Redis. A
+  stand-in for tests and local runs, so a value that doesn't round-trip fails
+  without a Redis server.
+
+A backend error is logged and counted, and the lookup is treated as a miss.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Protocol
+import orjson
+from pydantic import TypeAdapter
+from metrics import cache_counters, CACHE_BACKEND_ERRORS
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional: only CACHE_URL=redis://... needs it
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_URL = os.getenv("CACHE_URL", "local://")
+# Shared stores: every key is "<prefix><namespace>:<key>"
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "elo-braker:")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded in-process cache with optional per-entry TTL (seconds).
+
+    Least recently used entries are evicted once `maxsize` is reached. Caches
+    given a `name` report hits and misses to /metrics.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None, name: str | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._hits, self._misses = cache_counters(name) if name else (None, None)
+        self._data: OrderedDict[Hashable, tuple[Any, float | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            if self._misses is not None:
+                self._misses.inc()
+            return default
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            if self._misses is not None:
+                self._misses.inc()
+            return default
+        self._data.move_to_end(key)
+        if self._hits is not None:
+            self._hits.inc()
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+
+# -----------------------------
+# Codecs
+# -----------------------------
+class Codec(Protocol):
+    def encode(self, value: Any) -> bytes: ...
+    def decode(self, raw: bytes) -> Any: ...
+
+
+class TypedCodec:
+    """JSON through pydantic-core, for anything a TypeAdapter takes (models, dataclasses, tuples)."""
+
+    def __init__(self, tp: Any):
+        self.adapter = TypeAdapter(tp)
+
+    def encode(self, value: Any) -> bytes:
+        return self.adapter.dump_json(value, by_alias=True)
+
+    def decode(self, raw: bytes) -> Any:
+        return self.adapter.validate_json(raw)
+
+
+# -----------------------------
+# Backends
+# -----------------------------
+# namespace -> max entries, for backends that bound each namespace themselves
+_namespace_sizes: dict[str, int] = {}
+
+
+class CacheBackend:
+    """Key-value store behind `Cache`. Keys are strings, unique within a namespace.
+
+    `shared` backends keep values outside the process, so `Cache` hands them
+    encoded bytes; the others get the objects themselves.
+    """
+
+    shared = True
+
+    async def get_many(self, namespace: str, keys: list[str]) -> list[Any]:
+        """Values in key order, None for a miss."""
+        raise NotImplementedError
+
+    async def set_many(self, namespace: str, items: dict[str, Any], ttl: float | None):
+        raise NotImplementedError
+
+    async def delete_many(self, namespace: str, keys: list[str]):
+        raise NotImplementedError
+
+    async def clear(self, namespace: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """One LRUCache per namespace, in this process (`local://`, or `memory://` with `shared=True`)."""
+
+    def __init__(self, shared: bool = False, default_size: int = 10_000):
+        self.shared = shared
+        self.default_size = default_size
+        self._stores: dict[str, LRUCache] = {}
+
+    def _store(self, namespace: str) -> LRUCache:
+        store = self._stores.get(namespace)
+        if store is None:
+            store = self._stores[namespace] = LRUCache(_namespace_sizes.get(namespace, self.default_size))
+        return store
+
+    async def get_many(self, namespace: str, keys: list[str]) -> list[Any]:
+        store = self._store(namespace)
+        return [store.get(key) for key in keys]
+
+    async def set_many(self, namespace: str, items: dict[str, Any], ttl: float | None):
+        store = self._store(namespace)
+        for key, value in items.items():
+            store.set(key, value, ttl=ttl)
+
+    async def delete_many(self, namespace: str, keys: list[str]):
+        store = self._store(namespace)
+        for key in keys:
+            store.pop(key)
+
+    async def clear(self, namespace: str):
+        self._store(namespace).clear()
+
+
+class RedisBackend(CacheBackend):
+    """Redis-protocol store shared by every worker and node.
+
+    Entries aren't bounded per namespace: size the server with `maxmemory` and
+    an `allkeys-lru` eviction policy.
+    """
+
+    CLEAR_BATCH = 500
+
+    def __init__(self, url: str, prefix: str = CACHE_KEY_PREFIX):
+        if aioredis is None:
+            raise RuntimeError("CACHE_URL=redis://... needs the redis package: pip install redis")
+        self.prefix = prefix
+        self._client = aioredis.from_url(url)
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    async def get_many(self, namespace: str, keys: list[str]) -> list[Any]:
+        return await self._client.mget([self._key(namespace, key) for key in keys])
+
+    async def set_many(self, namespace: str, items: dict[str, Any], ttl: float | None):
+        px = None if ttl is None else max(1, int(ttl * 1000))
+        if len(items) == 1:
+            (key, value), = items.items()
+            await self._client.set(self._key(namespace, key), value, px=px)
+            return
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(self._key(namespace, key), value, px=px)
+            await pipe.execute()
+
+    async def delete_many(self, namespace: str, keys: list[str]):
+        await self._client.unlink(*(self._key(namespace, key) for key in keys))
+
+    async def clear(self, namespace: str):
+        # SCAN doesn't block the server like KEYS would
+        batch = []
+        async for key in self._client.scan_iter(match=self._key(namespace, "*"), count=1000):
+            batch.append(key)
+            if len(batch) >= self.CLEAR_BATCH:
+                await self._client.unlink(*batch)
+                batch = []
+        if batch:
+            await self._client.unlink(*batch)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def backend_from_url(url: str) -> CacheBackend:
+    scheme = url.partition("://")[0].lower()
+    if scheme == "local":
+        return MemoryBackend()
+    if scheme == "memory":
+        return MemoryBackend(shared=True)
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL scheme: {url!r}")
+
+
+_backend: CacheBackend | None = None
+
+
+def get_backend() -> CacheBackend:
+    global _backend
+    if _backend is None:
+        _backend = backend_from_url(CACHE_URL)
+    return _backend
+
+
+def set_backend(backend: CacheBackend):
+    """Swap the process-wide backend (tests, or a backend configured in code)."""
+    global _backend
+    _backend = backend
+
+
+async def close_backend():
+    if _backend is not None:
+        await _backend.close()
+
+
+# -----------------------------
+# Namespaced cache
+# -----------------------------
+def _key_str(key: Hashable) -> str:
+    if isinstance(key, str):
+        return key
+    # tuples keep their structure: ("a:b", "c") and ("a", "b:c") stay apart
+    return orjson.dumps(key).decode()
+
+
+class Cache:
+    """A namespace on the process-wide backend, with async batch get/set, TTLs and invalidation.
+
+    `maxsize` bounds the namespace on in-process backends. Hits and misses are
+    reported to /metrics under the namespace name.
+    """
+
+    def __init__(self, namespace: str, codec: Codec, maxsize: int, ttl: float | None = None):
+        self.namespace = namespace
+        self.codec = codec
+        self.ttl = ttl
+        _namespace_sizes[namespace] = maxsize
+        self._hits, self._misses = cache_counters(namespace)
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        found = await self.get_many([key])
+        return found.get(key, default)
+
+    async def get_many(self, keys: Iterable[Hashable]) -> dict[Hashable, Any]:
+        """Cached values by key; misses are left out."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        backend = get_backend()
+        try:
+            values = await backend.get_many(self.namespace, [_key_str(k) for k in keys])
+        except Exception as e:
+            self._backend_error("get", e)
+            values = [None] * len(keys)
+
+        found, undecodable = {}, []
+        for key, value in zip(keys, values):
+            if value is not None and backend.shared:
+                try:
+                    value = self.codec.decode(value)
+                except ValueError:
+                    # written by an older version of the value's type
+                    undecodable.append(key)
+                    value = None
+            if value is None:
+                self._misses.inc()
+            else:
+                self._hits.inc()
+                found[key] = value
+        if undecodable:
+            await self.delete_many(undecodable)
+        return found
+
+    async def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        await self.set_many({key: value}, ttl)
+
+    async def set_many(self, items: dict[Hashable, Any], ttl: float | None = None):
+        """Store every item with the same TTL (`ttl=None`: the cache's default)."""
+        if not items:
+            return
+        backend = get_backend()
+        encode = self.codec.encode if backend.shared else None
+        payload = {_key_str(k): encode(v) if encode else v for k, v in items.items()}
+        try:
+            await backend.set_many(self.namespace, payload, self.ttl if ttl is None else ttl)
+        except Exception as e:
+            self._backend_error("set", e)
+
+    async def pop(self, key: Hashable, default: Any = None) -> Any:
+        value = await self.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        await self.delete(key)
+        return value
+
+    async def delete(self, key: Hashable):
+        await self.delete_many([key])
+
+    async def delete_many(self, keys: Iterable[Hashable]):
+        keys = [_key_str(k) for k in keys]
+        if not keys:
+            return
+        try:
+            await get_backend().delete_many(self.namespace, keys)
+        except Exception as e:
+            self._backend_error("delete", e)
+
+    async def invalidate(self):
+        """Drop every entry of the namespace, in every process sharing the backend."""
+        try:
+            await get_backend().clear(self.namespace)
+        except Exception as e:
+            self._backend_error("clear", e)
+
+    def _backend_error(self, operation: str, error: Exception):
+        CACHE_BACKEND_ERRORS.labels(self.namespace, operation).inc()
+        logger.warning("Cache %s %s failed: %r", self.namespace, operation, error)
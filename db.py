@@ -1,27 +1,149 @@
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.ext.asyncio import create_async_engine,async_sessionmaker
 from dotenv import load_dotenv
+from metrics import DB_REPLICA_HEALTHY, DB_REPLICA_LAG, TimedQueuePool, instrument_engine
+import asyncio
+import itertools
+import logging
 import os
 import ssl
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 ssl_ctx = ssl.create_default_context()
 
 DATABASE_URL = os.getenv("POSTGRESQL_URL")
+# Replicas for read-only endpoints, comma separated; none = reads go to the primary
+READ_URLS = [url.strip() for url in os.getenv("POSTGRESQL_READ_URLS", "").split(",") if url.strip()]
+# 0 for a local Postgres without TLS (postgres-docker, benchmarks)
+POSTGRESQL_SSL = os.getenv("POSTGRESQL_SSL", "1").lower() not in ("0", "false", "no")
+# Writer pool (ingestion, jobs, refreshes); each replica gets its own reader pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "5"))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "5"))
+# A replica further behind than this (seconds) is skipped until it catches up
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
 
-print("Creating Database Engine ⚙️")
-engine = create_async_engine(
-    DATABASE_URL,
-    connect_args={"ssl": ssl_ctx},
-    pool_pre_ping=True,
-    pool_size=5,
-    max_overflow=5,
-)
+
+def _create_engine(url: str, pool_size: int, max_overflow: int, name: str):
+    new_engine = create_async_engine(
+        url,
+        connect_args={"ssl": ssl_ctx} if POSTGRESQL_SSL else {},
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        poolclass=TimedQueuePool,
+    )
+    instrument_engine(new_engine, name)
+    return new_engine
+
+
+def _sessionmaker(bind):
+    return async_sessionmaker(autoflush=False,bind=bind,expire_on_commit=False,)
+
+
+logger.info("Creating Database Engine ⚙️")
+engine = _create_engine(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, "primary")
 #Session Maker help perfom actions in database
-SessionLocal = async_sessionmaker(autoflush=False,bind=engine,expire_on_commit=False,)
+SessionLocal = _sessionmaker(engine)
 #Base will help us create tables that we are gonna use in code
 Base = declarative_base()
 
+
+# -----------------------------
+# Read replicas
+# -----------------------------
+# 0 on the primary (or a replica that has replayed everything it received), else seconds since
+# the last replayed transaction. A replica with nothing to replay is current however old that is.
+_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity') END"
+)
+
+
+class Replica:
+    def __init__(self, url: str):
+        parsed = make_url(url)
+        self.name = f"{parsed.host or 'local'}:{parsed.port or 5432}"
+        self.engine = _create_engine(url, DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW, self.name)
+        self.sessionmaker = _sessionmaker(self.engine)
+        # unusable until the first lag check passes
+        self.healthy = False
+        self.checked = False
+        self.lag: float | None = None
+
+    async def _lag(self) -> float:
+        async with self.engine.connect() as conn:
+            return float((await conn.execute(_LAG_SQL)).scalar_one())
+
+    async def check(self):
+        try:
+            lag = await asyncio.wait_for(self._lag(), DB_REPLICA_CHECK_INTERVAL)
+        except Exception as e:
+            if self.healthy or not self.checked:
+                logger.warning("Replica %s unreachable, reading from the primary: %r", self.name, e)
+            self.healthy, self.lag = False, None
+        else:
+            healthy = lag <= DB_REPLICA_MAX_LAG
+            if healthy != self.healthy or not self.checked:
+                logger.info("Replica %s %s (lag %.1fs)", self.name, "in use" if healthy else "skipped", lag)
+            self.healthy, self.lag = healthy, lag
+        self.checked = True
+        DB_REPLICA_HEALTHY.labels(self.name).set(1 if self.healthy else 0)
+        DB_REPLICA_LAG.labels(self.name).set(self.lag if self.lag is not None else float("nan"))
+
+
+class ReplicaRouter:
+    """Round-robin over the replicas whose last lag check passed; the primary when none did."""
+
+    def __init__(self, urls: list[str]):
+        self.replicas = [Replica(url) for url in urls]
+        self._next = itertools.count()
+        self._task: asyncio.Task | None = None
+
+    def sessionmaker(self) -> async_sessionmaker:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return SessionLocal
+        return healthy[next(self._next) % len(healthy)].sessionmaker
+
+    async def check(self):
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+            await self.check()
+
+    async def start(self):
+        if not self.replicas:
+            return
+        # first check before serving, so reads use the replicas right away
+        await self.check()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+replicas = ReplicaRouter(READ_URLS)
+
+
+def ReadSessionLocal():
+    """Session for read-only work: a current replica, or the primary."""
+    return replicas.sessionmaker()()
+
+
 async def get_db():
     db = SessionLocal()
     try:
@@ -29,7 +151,19 @@ async def get_db():
     finally:
         await db.close()
 
+async def get_read_db():
+    """For endpoints that only read; data may trail the primary by up to DB_REPLICA_MAX_LAG."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
+
 async def create_table():
+    from partitions import maintain  # imports the models, which import this module
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-        print("Successful")
\ No newline at end of file
+    # matches/match_participants are partitioned: their months are separate tables
+    await maintain(engine)
+    print("Successful")
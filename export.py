@@ -0,0 +1,229 @@
+"""Export matches, match_teams and match_participants to Parquet (or Arrow IPC) files.
+
+    python export.py --out exports/            # new matches since the last run
+    python export.py --out exports-full/ --full  # everything, ignoring the saved watermark
+
+Files are partitioned Hive-style by patch and queue:
+
+    exports/match_participants/patch=16.1/queue=420/part-<run>.parquet
+
+Rows are streamed with a server-side cursor and written in row groups, so memory
+stays flat whatever the table size. Each run exports the matches whose
+`ingested_at` is in (last watermark, now - EXPORT_SAFETY_LAG] and records the new
+watermark in `_export_state.json` once every file is written. Games arrive in
+any game-start order (long games, late polls, backfills), so the watermark is on
+insertion time. The lag leaves out rows whose transaction may not have committed
+yet; it must be longer than any ingestion transaction.
+
+Needs pyarrow (`pip install pyarrow`), which the API itself doesn't.
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select, func, inspect, BigInteger, Integer, SmallInteger, Boolean, Float, String, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from db import engine
+from models import Matches, MatchTeam, MatchParticipant
+from match_parser import patch_from_version
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only this command needs it
+    pa = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "50000"))
+STATE_FILE = "_export_state.json"
+# Rows ingested this recently wait for the next run (see the module docstring)
+EXPORT_SAFETY_LAG = timedelta(seconds=int(os.getenv("EXPORT_SAFETY_LAG", "300")))
+EXPORTED_MODELS = (Matches, MatchTeam, MatchParticipant)
+
+
+# -----------------------------
+# Arrow schema from the models
+# -----------------------------
+def arrow_type(column):
+    t = column.type
+    if isinstance(t, BigInteger):
+        return pa.int64()
+    if isinstance(t, SmallInteger):
+        return pa.int16()
+    if isinstance(t, Integer):
+        return pa.int32()
+    if isinstance(t, Boolean):
+        return pa.bool_()
+    if isinstance(t, Float):
+        return pa.float64()
+    if isinstance(t, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(t, (String, JSONB)):
+        return pa.string()  # JSONB (bans) as JSON text
+    raise TypeError(f"no Arrow type for {column.table.name}.{column.name} ({t!r})")
+
+
+def arrow_schema(model):
+    return pa.schema([
+        pa.field(attr.key, arrow_type(attr.columns[0]), nullable=attr.columns[0].nullable)
+        for attr in inspect(model).column_attrs
+    ])
+
+
+def export_query(model, low: Optional[datetime], high: datetime, low_ts: Optional[int] = None):
+    """Every column of `model` (attribute names) plus game_version for the partition.
+
+    Matches ingested in (low, high]; `low_ts` additionally skips games up to a
+    game_start_ts watermark (state files written before ingested_at existed)."""
+    columns = [getattr(model, attr.key).label(attr.key) for attr in inspect(model).column_attrs]
+    stmt = select(*columns)
+    if model is Matches:
+        stmt = stmt.add_columns(Matches.game_version.label("_game_version"))
+    else:
+        stmt = stmt.add_columns(Matches.game_version.label("_game_version"), Matches.queue_id.label("_queue_id"))
+        on = Matches.match_id == model.match_id
+        if model is MatchParticipant:
+            on &= Matches.game_start_ts == model.game_start_ts
+            if low_ts is not None:
+                stmt = stmt.where(model.game_start_ts > low_ts)  # prunes the participant partitions too
+        stmt = stmt.join(Matches, on)
+    # no ORDER BY: the window is fixed, and a sort would defeat streaming
+    stmt = stmt.where(Matches.ingested_at <= high)
+    if low is not None:
+        stmt = stmt.where(Matches.ingested_at > low)
+    if low_ts is not None:
+        stmt = stmt.where(Matches.game_start_ts > low_ts)
+    return stmt
+
+
+# -----------------------------
+# Writers
+# -----------------------------
+class PartitionedWriter:
+    """One open file per (patch, queue); each batch becomes a row group."""
+
+    def __init__(self, root: str, name: str, schema, fmt: str, run_id: str):
+        self.root = os.path.join(root, name)
+        self.schema = schema
+        self.fmt = fmt
+        self.run_id = run_id
+        self.rows = 0
+        self._writers: dict[tuple[str, int], tuple[object, str, str]] = {}
+
+    def _writer(self, patch: str, queue: int):
+        key = (patch, queue)
+        if key not in self._writers:
+            directory = os.path.join(self.root, f"patch={patch}", f"queue={queue}")
+            os.makedirs(directory, exist_ok=True)
+            ext = "parquet" if self.fmt == "parquet" else "arrow"
+            path = os.path.join(directory, f"part-{self.run_id}.{ext}")
+            tmp = path + ".tmp"
+            if self.fmt == "parquet":
+                writer = pq.ParquetWriter(tmp, self.schema, compression="zstd")
+            else:
+                writer = pa.ipc.new_file(tmp, self.schema)
+            self._writers[key] = (writer, tmp, path)
+        return self._writers[key][0]
+
+    def write(self, rows: list[dict]):
+        groups: dict[tuple[str, int], list[dict]] = {}
+        for row in rows:
+            queue = row.pop("_queue_id") if "_queue_id" in row else row["queue_id"]
+            key = (patch_from_version(row.pop("_game_version")), queue)
+            bans = row.get("bans")
+            if bans is not None and not isinstance(bans, str):
+                row["bans"] = json.dumps(bans)
+            groups.setdefault(key, []).append(row)
+        for (patch, queue), group in groups.items():
+            self._writer(patch, queue).write_table(pa.Table.from_pylist(group, schema=self.schema))
+            self.rows += len(group)
+
+    def close(self):
+        # files only appear under their final name once complete
+        for writer, tmp, path in self._writers.values():
+            writer.close()
+            os.replace(tmp, path)
+        self._writers = {}
+
+    def abort(self):
+        for writer, tmp, _ in self._writers.values():
+            writer.close()
+            os.remove(tmp)
+        self._writers = {}
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def load_state(root: str) -> dict:
+    try:
+        with open(os.path.join(root, STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(root: str, state: dict):
+    path = os.path.join(root, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+async def export(root: str, fmt: str = "parquet", full: bool = False, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    if pa is None:
+        raise SystemExit("pyarrow is required for exports: pip install pyarrow")
+    os.makedirs(root, exist_ok=True)
+    state = {} if full else load_state(root)
+    low = datetime.fromisoformat(state["ingested_at"]) if "ingested_at" in state else None
+    # a state from before ingested_at: one last run on its game_start_ts watermark
+    low_ts = state.get("game_start_ts") if low is None else None
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+
+    async with engine.connect() as conn:
+        # the DB's clock, the one ingested_at is written with
+        high = (await conn.execute(select(func.now() - EXPORT_SAFETY_LAG))).scalar()
+        newest = (await conn.execute(select(func.max(Matches.ingested_at)).where(Matches.ingested_at <= high))).scalar()
+        if newest is None or (low is not None and newest <= low):
+            print("Nothing new to export")
+            return state
+
+        writers = [PartitionedWriter(root, m.__tablename__, arrow_schema(m), fmt, run_id) for m in EXPORTED_MODELS]
+        try:
+            for model, writer in zip(EXPORTED_MODELS, writers):
+                result = await conn.stream(export_query(model, low, high, low_ts), execution_options={"yield_per": batch_size})
+                async for rows in result.mappings().partitions(batch_size):
+                    writer.write([dict(row) for row in rows])
+                print(f"{model.__tablename__}: {writer.rows} rows")
+        except BaseException:
+            # all or nothing, so a re-run doesn't duplicate the tables that did finish
+            for writer in writers:
+                writer.abort()
+            raise
+        for writer in writers:
+            writer.close()
+        counts = {m.__tablename__: w.rows for m, w in zip(EXPORTED_MODELS, writers)}
+
+    state = {
+        "ingested_at": high.isoformat(),
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "run": run_id,
+        "rows": counts,
+    }
+    save_state(root, state)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--out", default="exports", help="output directory (default: exports)")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    parser.add_argument("--full", action="store_true", help="ignore the saved watermark and export everything")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(export(args.out, args.format, args.full, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
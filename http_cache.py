@@ -0,0 +1,119 @@
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Hashable
+import orjson
+from fastapi import Request, Response
+from pydantic import BaseModel, TypeAdapter
+from cache import Cache
+from metrics import RESPONSE_ENCODE
+
+# Serialized bodies kept in memory (a match detail is ~15 KB)
+HTTP_CACHE_SIZE = int(os.getenv("HTTP_CACHE_SIZE", "2000"))
+
+# Cache-Control values
+IMMUTABLE = "public, max-age=31536000, immutable"  # finished matches never change
+SHORT_TTL = 60  # seconds; ranked entries, match-id lists
+
+
+def max_age(seconds: float) -> str:
+    return f"public, max-age={int(seconds)}"
+
+
+@dataclass
+class CachedBody:
+    body: bytes
+    etag: str
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class CachedBodyCodec:
+    """Headers as a JSON line, then the body as it is (no re-encoding of the JSON inside)."""
+
+    def encode(self, cached: CachedBody) -> bytes:
+        return orjson.dumps({"etag": cached.etag, "headers": cached.headers}) + b"\n" + cached.body
+
+    def decode(self, raw: bytes) -> CachedBody:
+        meta, _, body = raw.partition(b"\n")
+        meta = orjson.loads(meta)
+        return CachedBody(body=body, etag=meta["etag"], headers=meta["headers"])
+
+
+_bodies = Cache("http_bodies", CachedBodyCodec(), HTTP_CACHE_SIZE)
+
+
+@lru_cache(maxsize=None)
+def adapter(tp: Any) -> TypeAdapter:
+    return TypeAdapter(tp)
+
+
+def _default(obj: Any):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", by_alias=True)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def encode_json(content: Any, tp: Any = None) -> bytes:
+    """JSON bytes, field aliases applied (same keys as FastAPI's response_model output).
+
+    Models and `tp`-typed values are serialized by pydantic-core straight to
+    bytes; anything else goes through orjson.
+    """
+    if isinstance(content, BaseModel):
+        return content.__pydantic_serializer__.to_json(content, by_alias=True)
+    if tp is not None:
+        return adapter(tp).dump_json(content, by_alias=True)
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def make_etag(body: bytes) -> str:
+    # Strong validator: any byte change gives a new tag
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def json_body(content: Any, headers: dict[str, str] | None = None, tp: Any = None) -> CachedBody:
+    start = time.perf_counter()
+    body = encode_json(content, tp)
+    RESPONSE_ENCODE.observe(time.perf_counter() - start)
+    return CachedBody(body=body, etag=make_etag(body), headers=headers or {})
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as RFC 9110 requires for If-None-Match
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def respond(request: Request, cached: CachedBody, cache_control: str) -> Response:
+    headers = {"ETag": cached.etag, "Cache-Control": cache_control, **cached.headers}
+    if etag_matches(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+
+async def cached_response(
+    request: Request,
+    key: Hashable,
+    produce: Callable[[], Awaitable[CachedBody]],
+    cache_control: str,
+    ttl: float | None = None,
+) -> Response:
+    """Serve `key` from the body store, or build it with `produce()` and keep it.
+
+    `ttl=None` keeps the body until it is evicted (immutable resources).
+    """
+    cached = await _bodies.get(key)
+    if cached is None:
+        cached = await produce()
+        await _bodies.set(key, cached, ttl=ttl)
+    return respond(request, cached, cache_control)
+
+
+async def invalidate(key: Hashable):
+    await _bodies.delete(key)
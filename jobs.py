@@ -0,0 +1,133 @@
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import select, update, text, case
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+from models import BackgroundJob
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_DEAD = "dead"
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = timedelta(seconds=10)
+JOB_BACKOFF_MAX = timedelta(hours=1)
+# A running job not finished within the lease is presumed lost (worker crashed)
+JOB_LEASE = timedelta(minutes=10)
+
+_ACTIVE_WHERE = text("status IN ('pending', 'running')")
+
+
+async def enqueue(
+    db: AsyncSession,
+    kind: str,
+    payload: dict,
+    dedupe_key: Optional[str] = None,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    run_at: Optional[datetime] = None,
+) -> int:
+    """Queue a job and commit. If `dedupe_key` is already pending/running, that job's id is returned."""
+    values = {
+        "kind": kind,
+        "payload": payload,
+        "dedupe_key": dedupe_key,
+        "status": JOB_PENDING,
+        "max_attempts": max_attempts,
+        "run_at": run_at or datetime.now(timezone.utc),
+    }
+    stmt = insert(BackgroundJob).values(values)
+    if dedupe_key is not None:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["dedupe_key"], index_where=_ACTIVE_WHERE)
+    job_id = (await db.execute(stmt.returning(BackgroundJob.id))).scalar_one_or_none()
+    if job_id is None:
+        job_id = (await db.execute(
+            select(BackgroundJob.id).where(BackgroundJob.dedupe_key == dedupe_key, _ACTIVE_WHERE)
+        )).scalar_one_or_none()
+    await db.commit()
+    return job_id
+
+
+async def get_job(db: AsyncSession, job_id: int) -> BackgroundJob | None:
+    result = await db.execute(select(BackgroundJob).where(BackgroundJob.id == job_id))
+    return result.scalar_one_or_none()
+
+
+async def claim_job(db: AsyncSession, worker_id: str) -> BackgroundJob | None:
+    # SKIP LOCKED: workers in any process never block on (or double-claim) the same row
+    now = datetime.now(timezone.utc)
+    result = await db.execute(
+        select(BackgroundJob)
+        .where(BackgroundJob.status == JOB_PENDING, BackgroundJob.run_at <= now)
+        .order_by(BackgroundJob.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    job = result.scalar_one_or_none()
+    if job is None:
+        await db.rollback()
+        return None
+    job.status = JOB_RUNNING
+    job.attempts += 1
+    job.locked_at = now
+    job.locked_by = worker_id
+    await db.commit()
+    return job
+
+
+def _owned(job: BackgroundJob) -> tuple:
+    # Still this claim's lease: requeue_expired may have handed the job to another worker
+    return (
+        BackgroundJob.id == job.id,
+        BackgroundJob.status == JOB_RUNNING,
+        BackgroundJob.locked_by == job.locked_by,
+        BackgroundJob.attempts == job.attempts,
+    )
+
+
+async def complete_job(db: AsyncSession, job: BackgroundJob, result: Optional[dict] = None) -> bool:
+    """Mark the job done. Returns False, writing nothing, if this worker no longer owns it."""
+    updated = await db.execute(
+        update(BackgroundJob)
+        .where(*_owned(job))
+        .values(status=JOB_DONE, result=result, last_error=None, locked_at=None)
+    )
+    await db.commit()
+    return updated.rowcount == 1
+
+
+def backoff(attempts: int) -> timedelta:
+    delay = min(JOB_BACKOFF_BASE * (2 ** (attempts - 1)), JOB_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def fail_job(db: AsyncSession, job: BackgroundJob, error: str) -> bool:
+    """Retry later with exponential backoff, or dead-letter after max_attempts.
+    Returns False, writing nothing, if this worker no longer owns the job."""
+    values = {"last_error": error[:2000], "locked_at": None}
+    if job.attempts >= job.max_attempts:
+        values["status"] = JOB_DEAD
+    else:
+        values["status"] = JOB_PENDING
+        values["run_at"] = datetime.now(timezone.utc) + backoff(job.attempts)
+    updated = await db.execute(update(BackgroundJob).where(*_owned(job)).values(**values))
+    await db.commit()
+    return updated.rowcount == 1
+
+
+async def requeue_expired(db: AsyncSession) -> int:
+    cutoff = datetime.now(timezone.utc) - JOB_LEASE
+    result = await db.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.status == JOB_RUNNING, BackgroundJob.locked_at < cutoff)
+        .values(
+            status=case((BackgroundJob.attempts >= BackgroundJob.max_attempts, JOB_DEAD), else_=JOB_PENDING),
+            locked_at=None,
+            locked_by=None,
+            last_error="lease expired",
+        )
+    )
+    await db.commit()
+    return result.rowcount
@@ -1,13 +1,47 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from datetime import datetime, timezone
-from typing import Optional
-import services, schemas
-from db import get_db
+from typing import Optional, Union
+from contextlib import asynccontextmanager
+from email.utils import format_datetime
+from datetime import timezone
+import logging
+import os
+# before services/db are imported, so their startup logs show
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+import services, schemas, jobs, http_cache, analytics, metrics, cache, partitions, tracker
+from db import get_db, get_read_db, replicas, ReadSessionLocal
+from riot_client import riot_clients
+from worker import JobWorker, WORKER_CONCURRENCY
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await partitions.require_partitioned()
+    await replicas.start()
+    await riot_clients.open()
+    worker = JobWorker(concurrency=WORKER_CONCURRENCY)
+    if WORKER_CONCURRENCY > 0:
+        await worker.start()
+    # the full reload and periodic refreshes are large scans, so they read from a replica
+    analytics.engine.start(ReadSessionLocal)
+    if tracker.TRACKER_ENABLED:
+        await tracker.tracker.start()
+    try:
+        yield
+    finally:
+        await tracker.tracker.stop()
+        await analytics.engine.stop()
+        await worker.stop()
+        await riot_clients.aclose()
+        await cache.close_backend()
+        await replicas.stop()
+
+
+# orjson for every response; response_model endpoints are serialized by pydantic-core first
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
 CORSMiddleware,
@@ -16,12 +50,22 @@ allow_credentials=False,
 allow_methods=["*"],
 allow_headers=["*"],
 )
+# outermost, so the timings include CORS and every other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body, content_type = metrics.metrics_body()
+    return Response(body, media_type=content_type)
 
 @app.get("/health")
 async def health_check(db: AsyncSession = Depends(get_db)):
     try:
         await db.execute(text("SELECT 1"))
-        return {"status": "ok", "database": "connected"}
+        health = {"status": "ok", "database": "connected"}
+        if replicas.replicas:
+            health["replicas"] = {r.name: {"healthy": r.healthy, "lag": r.lag} for r in replicas.replicas}
+        return health
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
@@ -30,47 +74,197 @@ async def create_summoner(
     gameName: str,
     tagLine: str,
     region: str = "americas",
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
 ):
-    
-    profile = await services.getSummoner_by_name(db, gameName, tagLine)
-    if profile and  not services.is_stale(profile):
-            return profile
-    riot_data = await services.fetch_summoner_from_riot(gameName, tagLine, region)
+    return await services.get_or_refresh_summoner(db, gameName, tagLine, region, read_db=read_db)
 
-    profile_data = schemas.RiotUserProfileCreate(
-        puuid=riot_data["puuid"],
-        gameName=riot_data["gameName"],
-        tagLine=riot_data["tagLine"],
-        region=riot_data["region"],
-        summonerLevel=riot_data["summonerLevel"],
-        profileIcon=riot_data["profileIcon"],
-        last_updated=datetime.now(timezone.utc)
-    )
+@app.post("/summoners/bulk", response_model=list[schemas.SummonerBulkItem])
+async def bulk_summoners(
+    body: schemas.SummonerBulkRequest,
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+):
+    return await services.get_summoners_bulk(db, body.players, body.region, read_db=read_db)
 
-    return await services.create_or_update_summoner(db, profile_data)
+@app.post("/summoners/refresh", response_model=schemas.JobRef, status_code=202)
+async def enqueue_summoner_refresh(
+    gameName: str,
+    tagLine: str,
+    region: str = "americas",
+    db: AsyncSession = Depends(get_db)
+):
+    riot_id = f"{gameName.strip().casefold()}#{tagLine.strip().casefold()}"
+    job_id = await jobs.enqueue(
+        db,
+        "refresh_summoner",
+        {"gameName": gameName, "tagLine": tagLine, "region": region},
+        dedupe_key=f"refresh_summoner:{region.lower()}:{riot_id}",
+    )
+    return schemas.JobRef(job_id=job_id, status=jobs.JOB_PENDING)
 
-@app.get("/summoners/{puuid}/matches")
+@app.get("/summoners/{puuid}/matches", response_model=list[str])
 async def matches_check(
     puuid: str,
     region: str,
+    request: Request,
     num_matches: int = 20,
     queue: Optional[int] = None,
 ):
-    return await services.fetch_get_matches(
+    async def produce():
+        return http_cache.json_body(await services.fetch_get_matches(
+            puuid=puuid,
+            region=region,
+            num_matches=num_matches,
+            queue=queue,
+        ), tp=list[str])
+    key = ("match_ids", puuid, queue, num_matches)
+    return await http_cache.cached_response(
+        request, key, produce, http_cache.max_age(http_cache.SHORT_TTL), ttl=http_cache.SHORT_TTL
+    )
+@app.get("/summoners/{puuid}/stats", response_model=list[schemas.PlayerChampionStats])
+async def player_stats(
+    puuid: str,
+    queue: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await services.get_player_champion_stats(db, puuid, queue)
+@app.get("/summoners/{puuid}/history", response_model=schemas.MatchHistoryPage)
+async def match_history(
+    puuid: str,
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    queue: Optional[int] = None,
+    champion: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await services.get_match_history(db, puuid, limit=limit, cursor=cursor, queue=queue, champion=champion)
+@app.post("/summoners/{puuid}/matches/ingest", response_model=Union[schemas.MatchIngestResult, schemas.JobRef])
+async def ingest_matches(
+    puuid: str,
+    region: str,
+    body: schemas.MatchIngestRequest,
+    response: Response,
+    background: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    if background:
+        job_id = await jobs.enqueue(
+            db,
+            "ingest_matches",
+            {"puuid": puuid, "region": region, **body.model_dump()},
+            dedupe_key=None if body.match_ids else f"ingest_matches:{puuid}:{body.queue}:{body.count}",
+        )
+        response.status_code = 202
+        return schemas.JobRef(job_id=job_id, status=jobs.JOB_PENDING)
+    return await services.ingest_matches(
+        db,
         puuid=puuid,
-        region=region,
-        num_matches=num_matches,
-        queue=queue,
+        routingRegion=region,
+        match_ids=body.match_ids,
+        count=body.count,
+        queue=body.queue,
     )
-@app.get("/matches/{matchId}")
-async def match_data(matchId:str,routingRegion:str,db: AsyncSession = Depends(get_db)
+@app.get("/matches/{matchId}", response_model=schemas.MatchDetail)
+async def match_data(matchId:str,routingRegion:str,request: Request,db: AsyncSession = Depends(get_db)
+):
+    # A finished match never changes: cache the body for good
+    async def produce():
+        detail = await services.get_match_data(
+            matchId=matchId,
+            routingRegion=routingRegion,
+            db=db
+        )
+        return http_cache.json_body(schemas.MatchDetail.model_construct(**detail))
+    key = ("match", matchId.strip().upper())
+    return await http_cache.cached_response(request, key, produce, http_cache.IMMUTABLE)
+@app.get("/analytics/champions", response_model=list[schemas.ChampionAnalytics])
+async def champion_analytics(
+    patch: Optional[str] = None,
+    queue: Optional[int] = None,
+    role: Optional[str] = None,
+    min_games: int = 1,
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await services.get_champion_analytics(db, patch=patch, queue=queue, role=role, min_games=min_games)
+def _analytics_engine():
+    if not analytics.engine.ready:
+        raise HTTPException(status_code=503, detail="Analytics are still loading", headers={"Retry-After": "30"})
+    return analytics.engine
+@app.get("/analytics/percentiles", response_model=schemas.MetricPercentiles)
+async def metric_percentiles(
+    metric: str,
+    champion_id: Optional[int] = None,
+    role: Optional[str] = None,
+    patch: Optional[str] = None,
+    queue: Optional[int] = None,
+    value: Optional[float] = None,
 ):
-    return await services.get_match_data(
-        matchId=matchId,
-        routingRegion=routingRegion,
-        db=db
+    engine = _analytics_engine()
+    if metric not in analytics.METRICS:
+        raise HTTPException(status_code=422, detail=f"metric must be one of {list(analytics.METRICS)}")
+    scope = {"champion_id": champion_id, "position": role, "patch": patch, "queue": queue}
+    return schemas.MetricPercentiles(
+        champion_id=champion_id, role=role, patch=patch, queue=queue, metric=metric, value=value,
+        win_rate=engine.win_rate(**scope),
+        **engine.percentiles(metric, value=value, **scope),
     )
-@app.get("/summoners/ranked")
-async def rank_data(puuid: str, region: str = "la1"):
-    return await services.get_summoner_entries(puuid=puuid, region=region)
+@app.get("/analytics/distribution", response_model=schemas.MetricDistribution)
+async def metric_distribution(
+    metric: str,
+    champion_id: Optional[int] = None,
+    role: Optional[str] = None,
+    patch: Optional[str] = None,
+    queue: Optional[int] = None,
+    bins: int = Query(default=20, ge=1, le=200),
+):
+    engine = _analytics_engine()
+    if metric not in analytics.METRICS:
+        raise HTTPException(status_code=422, detail=f"metric must be one of {list(analytics.METRICS)}")
+    return schemas.MetricDistribution(
+        champion_id=champion_id, role=role, patch=patch, queue=queue, metric=metric,
+        **engine.distribution(metric, champion_id, role, patch, queue, bins=bins),
+    )
+@app.get("/jobs/{job_id}", response_model=schemas.Job)
+async def job_status(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await jobs.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+@app.get("/summoners/ranked", response_model=list[schemas.RankedEntry])
+async def rank_data(
+    puuid: str,
+    request: Request,
+    region: str = "la1",
+    db: AsyncSession = Depends(get_db)
+):
+    async def produce():
+        synced_at, entries = await services.get_ranked_entries(db, puuid=puuid, region=region)
+        last_modified = format_datetime(synced_at.astimezone(timezone.utc), usegmt=True)
+        return http_cache.json_body(entries, {"Last-Modified": last_modified}, tp=list[schemas.RankedEntry])
+    key = ("ranked", puuid, region.lower())
+    return await http_cache.cached_response(
+        request, key, produce, http_cache.max_age(http_cache.SHORT_TTL), ttl=http_cache.SHORT_TTL
+    )
+@app.get("/summoners/{puuid}/ranked/history", response_model=list[schemas.RankedSnapshot])
+async def rank_history(
+    puuid: str,
+    queue_type: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await services.get_ranked_history(db, puuid, queue_type=queue_type, limit=limit)
+@app.post("/tracker/players", response_model=list[schemas.TrackedPlayer])
+async def track_players(body: schemas.TrackRequest, db: AsyncSession = Depends(get_db)):
+    return await tracker.track_players(db, body.puuids, body.region)
+@app.get("/tracker/players/{puuid}", response_model=schemas.TrackedPlayer)
+async def tracked_player(puuid: str, db: AsyncSession = Depends(get_db)):
+    player = await tracker.get_tracked_player(db, puuid)
+    if player is None:
+        raise HTTPException(status_code=404, detail="Player is not tracked")
+    return player
+@app.delete("/tracker/players/{puuid}", status_code=204)
+async def untrack_player(puuid: str, db: AsyncSession = Depends(get_db)):
+    if not await tracker.untrack_player(db, puuid):
+        raise HTTPException(status_code=404, detail="Player is not tracked")
+    return Response(status_code=204)
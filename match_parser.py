@@ -0,0 +1,264 @@
+from typing_extensions import NotRequired, TypedDict
+from pydantic import TypeAdapter
+from schemas import MatchCreate, MatchTeamCreate, MatchParticipantCreate
+
+# -----------------------------
+# Raw match-v5 shape (only the fields we keep)
+# -----------------------------
+# Decoding bytes straight into these TypedDicts parses and validates in one
+# pass inside pydantic-core; every other key of the ~3.7k-line payload is
+# skipped instead of becoming Python objects.
+
+
+class RiotObjective(TypedDict):
+    kills: int
+
+
+class RiotObjectives(TypedDict):
+    baron: RiotObjective
+    dragon: RiotObjective
+    riftHerald: RiotObjective
+    tower: RiotObjective
+    inhibitor: RiotObjective
+
+
+class RiotBan(TypedDict):
+    championId: int
+    pickTurn: int
+
+
+class RiotTeam(TypedDict):
+    teamId: int
+    win: NotRequired[bool]
+    objectives: RiotObjectives
+    bans: NotRequired[list[RiotBan]]
+
+
+class RiotChallenges(TypedDict, total=False):
+    killParticipation: float
+
+
+class RiotParticipant(TypedDict):
+    puuid: str
+    riotIdGameName: str
+    riotIdTagline: str
+    participantId: int
+    teamId: int
+    win: bool
+    championId: int
+    champLevel: int
+    individualPosition: NotRequired[str | None]
+    teamPosition: NotRequired[str | None]
+    kills: int
+    deaths: int
+    assists: int
+    killingSprees: int
+    doubleKills: int
+    tripleKills: int
+    quadraKills: int
+    pentaKills: int
+    goldEarned: int
+    goldSpent: int
+    totalMinionsKilled: int
+    neutralMinionsKilled: int
+    totalDamageDealtToChampions: int
+    physicalDamageDealtToChampions: int
+    magicDamageDealtToChampions: int
+    trueDamageDealtToChampions: int
+    totalDamageTaken: int
+    damageSelfMitigated: int
+    damageDealtToObjectives: int
+    damageDealtToTurrets: int
+    turretTakedowns: int
+    inhibitorTakedowns: int
+    dragonKills: int
+    baronKills: int
+    visionScore: int
+    wardsPlaced: int
+    wardsKilled: int
+    detectorWardsPlaced: int
+    item0: int
+    item1: int
+    item2: int
+    item3: int
+    item4: int
+    item5: int
+    item6: int
+    summoner1Id: int
+    summoner2Id: int
+    challenges: NotRequired[RiotChallenges]
+
+
+class RiotMatchInfo(TypedDict):
+    platformId: str
+    queueId: int
+    gameMode: str
+    gameVersion: str
+    gameStartTimestamp: int
+    gameDuration: int
+    participants: list[RiotParticipant]
+    teams: list[RiotTeam]
+
+
+class RiotMatchMetadata(TypedDict):
+    matchId: str
+
+
+class RiotMatch(TypedDict):
+    metadata: RiotMatchMetadata
+    info: RiotMatchInfo
+
+
+riot_match_adapter = TypeAdapter(RiotMatch)
+
+
+def decode_match(content: bytes | str) -> RiotMatch:
+    """Parse + validate a match-v5 body. Raises pydantic.ValidationError on a bad payload."""
+    return riot_match_adapter.validate_json(content)
+
+
+# -----------------------------
+# Projection into our column names
+# -----------------------------
+# match_participants column -> Riot key (copied as-is)
+_PARTICIPANT_COLUMNS = (
+    ("puuid", "puuid"),
+    ("riot_id_name", "riotIdGameName"),
+    ("riot_id_tagline", "riotIdTagline"),
+    ("participant_id", "participantId"),
+    ("team_id", "teamId"),
+    ("win", "win"),
+    ("champion_id", "championId"),
+    ("champ_level", "champLevel"),
+    ("kills", "kills"),
+    ("deaths", "deaths"),
+    ("assists", "assists"),
+    ("killing_sprees", "killingSprees"),
+    ("double_kills", "doubleKills"),
+    ("triple_kills", "tripleKills"),
+    ("quadra_kills", "quadraKills"),
+    ("penta_kills", "pentaKills"),
+    ("gold_earned", "goldEarned"),
+    ("gold_spent", "goldSpent"),
+    ("total_minions_killed", "totalMinionsKilled"),
+    ("neutral_minions_killed", "neutralMinionsKilled"),
+    ("total_damage_dealt_to_champions", "totalDamageDealtToChampions"),
+    ("physical_damage_dealt_to_champions", "physicalDamageDealtToChampions"),
+    ("magic_damage_dealt_to_champions", "magicDamageDealtToChampions"),
+    ("true_damage_dealt_to_champions", "trueDamageDealtToChampions"),
+    ("total_damage_taken", "totalDamageTaken"),
+    ("damage_self_mitigated", "damageSelfMitigated"),
+    ("damage_dealt_to_objectives", "damageDealtToObjectives"),
+    ("damage_dealt_to_turrets", "damageDealtToTurrets"),
+    ("turret_takedowns", "turretTakedowns"),
+    ("inhibitor_takedowns", "inhibitorTakedowns"),
+    ("dragon_kills", "dragonKills"),
+    ("baron_kills", "baronKills"),
+    ("vision_score", "visionScore"),
+    ("wards_placed", "wardsPlaced"),
+    ("wards_killed", "wardsKilled"),
+    ("detector_wards_placed", "detectorWardsPlaced"),
+    ("item0", "item0"),
+    ("item1", "item1"),
+    ("item2", "item2"),
+    ("item3", "item3"),
+    ("item4", "item4"),
+    ("item5", "item5"),
+    ("item6", "item6"),
+    ("summoner1_id", "summoner1Id"),
+    ("summoner2_id", "summoner2Id"),
+)
+
+_ALLOWED_POSITIONS = {"TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY", "INVALID", ""}
+
+# Optional participant columns we never fill from the payload
+_PARTICIPANT_DEFAULTS = {
+    "rift_herald_takedowns": None,
+    "damage_per_minute": None,
+    "gold_per_minute": None,
+    "team_damage_percentage": None,
+    "vision_score_per_minute": None,
+    "lane_minions_first_10_minutes": None,
+    "solo_kills": None,
+}
+
+
+def patch_from_version(game_version: str) -> str:
+    # "16.1.737.4870" -> "16.1"
+    return ".".join(game_version.split(".")[:2])
+
+
+def _position(value: str | None) -> str:
+    pos = (value or "").upper()
+    return pos if pos in _ALLOWED_POSITIONS else "INVALID"
+
+
+def match_row(raw: RiotMatch) -> dict:
+    info = raw["info"]
+    return {
+        "match_id": raw["metadata"]["matchId"],
+        "platform_id": info["platformId"],
+        "queue_id": info["queueId"],
+        "game_mode": info["gameMode"],
+        "game_version": info["gameVersion"],
+        "game_start_ts": info["gameStartTimestamp"],
+        "duration_sec": info["gameDuration"],
+    }
+
+
+def team_rows(raw: RiotMatch) -> list[dict]:
+    match_id = raw["metadata"]["matchId"]
+    info = raw["info"]
+
+    # KDA por team desde participants
+    acc: dict[int, list[int]] = {}
+    for p in info["participants"]:
+        kda = acc.setdefault(p["teamId"], [0, 0, 0])
+        kda[0] += p["kills"]
+        kda[1] += p["deaths"]
+        kda[2] += p["assists"]
+
+    rows = []
+    for t in info["teams"]:
+        obj = t["objectives"]
+        kills, deaths, assists = acc.get(t["teamId"], (0, 0, 0))
+        rows.append({
+            "match_id": match_id,
+            "team_id": t["teamId"],
+            "win": bool(t.get("win", False)),
+            "kills": kills,
+            "deaths": deaths,
+            "assists": assists,
+            "baron_kills": obj["baron"]["kills"],
+            "dragon_kills": obj["dragon"]["kills"],
+            "herald_kills": obj["riftHerald"]["kills"],
+            "tower_kills": obj["tower"]["kills"],
+            "inhib_kills": obj["inhibitor"]["kills"],
+            "first_blood": False,
+            "first_tower": False,
+            "bans": t.get("bans", []),
+        })
+    return rows
+
+
+def participant_rows(raw: RiotMatch) -> list[dict]:
+    match_id = raw["metadata"]["matchId"]
+    rows = []
+    for p in raw["info"]["participants"]:
+        row = {"match_id": match_id}
+        row.update({column: p[key] for column, key in _PARTICIPANT_COLUMNS})
+        row["individual_position"] = _position(p.get("individualPosition"))
+        row["team_position"] = (p.get("teamPosition") or "").upper()
+        row["kill_participation"] = p.get("challenges", {}).get("killParticipation", 0) * 100
+        row.update(_PARTICIPANT_DEFAULTS)
+        rows.append(row)
+    return rows
+
+
+def parse_match(raw: RiotMatch) -> tuple[MatchCreate, list[MatchTeamCreate], list[MatchParticipantCreate]]:
+    """Build the schema objects from an already validated payload (no second validation)."""
+    return (
+        MatchCreate.model_construct(**match_row(raw)),
+        [MatchTeamCreate.model_construct(**row) for row in team_rows(raw)],
+        [MatchParticipantCreate.model_construct(**row) for row in participant_rows(raw)],
+    )
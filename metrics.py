@@ -0,0 +1,183 @@
+"""Prometheus metrics, served at GET /metrics.
+
+Where a request's time goes: the endpoint itself (`http_request_duration_seconds`),
+Riot (`riot_request_duration_seconds`, `riot_rate_limit_wait_seconds`), the DB
+pool (`db_pool_checkout_seconds`, `db_pool_connections`), single queries
+(`db_query_duration_seconds`) and response encoding
+(`response_encode_seconds`). Caches report hits and misses by name, the
+tracker its polls and how far behind schedule they run.
+
+Every metric lives in the default registry, one set per process: with several
+gunicorn workers each one is scraped on its own.
+"""
+import re
+import time
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Most endpoints answer from memory (<5ms) or wait on Riot/DB (100ms-seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+HTTP_REQUESTS = Histogram(
+    "http_request_duration_seconds", "API request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "API requests being served")
+
+RIOT_REQUESTS = Histogram(
+    "riot_request_duration_seconds", "Riot API call latency (without rate-limit wait)",
+    ["method", "host", "status"], buckets=LATENCY_BUCKETS,
+)
+RIOT_RATE_LIMIT_WAIT = Histogram(
+    "riot_rate_limit_wait_seconds", "Time spent queued in the Riot rate limiter",
+    ["host", "priority"], buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120),
+)
+RIOT_RATE_LIMITED = Counter(
+    "riot_rate_limited_total", "Interactive calls turned away with a 503 by the rate limiter", ["host"],
+)
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+CACHE_BACKEND_ERRORS = Counter(
+    "cache_backend_errors_total", "Failed calls to the shared cache backend", ["cache", "operation"],
+)
+
+DB_POOL_CHECKOUT = Histogram(
+    "db_pool_checkout_seconds", "Wait for a pooled DB connection (includes opening a new one)",
+    ["pool"], buckets=FAST_BUCKETS + (2.5, 5, 10, 30),
+)
+DB_POOL_CONNECTIONS = Gauge("db_pool_connections", "DB pool connections", ["pool", "state"])
+DB_REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replay lag at the last check (NaN when unreachable)", ["replica"])
+DB_REPLICA_HEALTHY = Gauge("db_replica_healthy", "1 while a replica takes reads", ["replica"])
+DB_QUERIES = Histogram(
+    "db_query_duration_seconds", "DB statement time by operation and main table",
+    ["operation", "table"], buckets=FAST_BUCKETS + (2.5, 5, 10),
+)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "DB statements that raised", ["operation", "table"])
+
+RESPONSE_ENCODE = Histogram(
+    "response_encode_seconds", "JSON encoding of cached response bodies", buckets=FAST_BUCKETS,
+)
+
+TRACKER_POLLS = Counter("tracker_polls_total", "Tracked-player polls by outcome (new/idle/error)", ["region", "result"])
+TRACKER_PLAYERS = Gauge("tracker_players", "Players scheduled by this process", ["region"])
+# how far behind schedule polls start; grows when the rate share can't keep up
+TRACKER_POLL_DELAY = Histogram(
+    "tracker_poll_delay_seconds", "Time between a poll being due and starting",
+    ["region"], buckets=(0.1, 1, 5, 15, 60, 300, 900, 3600),
+)
+
+
+# -----------------------------
+# HTTP
+# -----------------------------
+class MetricsMiddleware:
+    """ASGI middleware timing every request, labelled by route template
+    (`/matches/{matchId}`, not the concrete path) to keep label counts bounded."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            if path != "/metrics":
+                HTTP_REQUESTS.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
+
+
+def metrics_body() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# -----------------------------
+# Caches
+# -----------------------------
+def cache_counters(name: str):
+    """(hit, miss) counters for one cache, resolved once instead of per lookup."""
+    return CACHE_REQUESTS.labels(name, "hit"), CACHE_REQUESTS.labels(name, "miss")
+
+
+# -----------------------------
+# Database
+# -----------------------------
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Default async pool, timing how long a checkout waits for a free connection."""
+
+    # labelled child, set by instrument_engine
+    checkout_seconds = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.checkout_seconds is not None:
+                self.checkout_seconds.observe(time.perf_counter() - start)
+
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def _statement_labels(statement: str) -> tuple[str, str]:
+    head = statement.lstrip()
+    operation = head[:head.find(" ")].upper() if " " in head else head.upper()
+    match = _TABLE_RE.search(statement)
+    return operation or "OTHER", match.group(1) if match else ""
+
+
+def instrument_engine(engine, name: str = "primary"):
+    """Query timings via cursor events and pool gauges (labelled `name`) read at scrape time."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    labels_cache: dict[str, tuple[str, str]] = {}
+
+    def labels(statement: str) -> tuple[str, str]:
+        # statements are compiled once and reused, so this is a dict hit after warm-up
+        result = labels_cache.get(statement)
+        if result is None:
+            if len(labels_cache) > 10_000:
+                labels_cache.clear()
+            result = labels_cache[statement] = _statement_labels(statement)
+        return result
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("query_start", None)
+        if start is not None:
+            DB_QUERIES.labels(*labels(statement)).observe(time.perf_counter() - start)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        if context.connection is not None:
+            context.connection.info.pop("query_start", None)
+        if context.statement:
+            DB_QUERY_ERRORS.labels(*labels(context.statement)).inc()
+
+    pool = sync_engine.pool
+    if isinstance(pool, TimedQueuePool):
+        pool.checkout_seconds = DB_POOL_CHECKOUT.labels(name)
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CONNECTIONS.labels(name, "in_use").set_function(pool.checkedout)
+        DB_POOL_CONNECTIONS.labels(name, "idle").set_function(pool.checkedin)
+        DB_POOL_CONNECTIONS.labels(name, "overflow").set_function(lambda: max(pool.overflow(), 0))
+        DB_POOL_CONNECTIONS.labels(name, "size").set_function(pool.size)
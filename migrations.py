@@ -0,0 +1,102 @@
+"""Idempotent schema changes for databases created before a model changed.
+
+`create_table` only creates missing tables; run `python migrations.py` after
+pulling a change that adds columns or indexes to an existing table. Every step
+can be re-run safely.
+"""
+import asyncio
+from sqlalchemy import text
+from db import engine
+from partitions import is_partitioned
+
+BACKFILL_BATCH = 10_000
+
+# (name, statements) run in order, each statement in its own autocommit transaction
+# so CREATE/DROP INDEX CONCURRENTLY don't block writes.
+MIGRATIONS: list[tuple[str, list[str]]] = [
+    ("match_participants history columns", [
+        "ALTER TABLE match_participants ADD COLUMN IF NOT EXISTS game_start_ts BIGINT",
+        "ALTER TABLE match_participants ADD COLUMN IF NOT EXISTS queue_id INTEGER",
+    ]),
+    ("match_participants history index", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_mp_puuid_history "
+        "ON match_participants (puuid, game_start_ts DESC, match_id DESC)",
+        # (puuid, ...) lookups are served by ix_mp_puuid_history now
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_mp_puuid_match",
+    ]),
+    ("match_teams unused index", [
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_match_teams_win",
+    ]),
+    # now() is stable, so existing rows get the migration time without a table rewrite
+    ("matches ingested_at column", [
+        "ALTER TABLE matches ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+    ]),
+]
+# (name, table, index, column) created after MIGRATIONS; see create_index
+INDEXES: list[tuple[str, str, str, str]] = [
+    ("matches ingested_at index", "matches", "ix_matches_ingested_at", "ingested_at"),
+]
+# Only for the unpartitioned layout: `python partitions.py migrate` builds the
+# partitioned tables from the models, with these columns and indexes already
+LEGACY_LAYOUT_ONLY = {"match_participants history columns", "match_participants history index"}
+
+# Copies game_start_ts/queue_id from matches in small batches (short row locks)
+BACKFILL_HISTORY_COLUMNS = text("""
+    WITH batch AS (
+        SELECT mp.match_id, mp.puuid
+        FROM match_participants mp
+        WHERE mp.game_start_ts IS NULL
+        LIMIT :batch
+    )
+    UPDATE match_participants mp
+    SET game_start_ts = m.game_start_ts, queue_id = m.queue_id
+    FROM batch, matches m
+    WHERE mp.match_id = batch.match_id AND mp.puuid = batch.puuid AND m."matchId" = mp.match_id
+""")
+
+
+async def create_index(conn, table: str, index: str, column: str, partitioned: bool):
+    """CREATE INDEX CONCURRENTLY, which a partitioned table doesn't support: there the
+    parent index is created ON ONLY the parent (invalid, no data), each partition's
+    concurrently, and attaching the last one makes the parent valid."""
+    if not partitioned:
+        await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} ({column})"))
+        return
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON ONLY {table} ({column})"))
+    children = (await conn.execute(
+        text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table)"),
+        {"table": table},
+    )).scalars().all()
+    for child in children:
+        # Postgres' own name for it, so partitions created later line up
+        child_index = f"{child}_{column}_idx"[:63]
+        await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_index} ON {child} ({column})"))
+        await conn.execute(text(f"ALTER INDEX {index} ATTACH PARTITION {child_index}"))
+
+
+async def run_migrations():
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        partitioned = await is_partitioned(conn, "match_participants")
+        for name, statements in MIGRATIONS:
+            if partitioned and name in LEGACY_LAYOUT_ONLY:
+                continue
+            print(f"Migration: {name}")
+            for statement in statements:
+                await conn.execute(text(statement))
+        for name, table, index, column in INDEXES:
+            print(f"Migration: {name}")
+            await create_index(conn, table, index, column, partitioned)
+
+        if not partitioned:
+            print("Backfilling match_participants.game_start_ts / queue_id")
+            while True:
+                result = await conn.execute(BACKFILL_HISTORY_COLUMNS, {"batch": BACKFILL_BATCH})
+                if result.rowcount == 0:
+                    break
+                print(f"  {result.rowcount} rows")
+    print("Successful")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_migrations())
@@ -7,7 +7,9 @@ from sqlalchemy import (
     SmallInteger,
     Index,
     DateTime,
-    BigInteger
+    BigInteger,
+    func,
+    text
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from db import Base
@@ -34,27 +36,53 @@ class RiotUserProfile(Base):
     match_participants = relationship("MatchParticipant", back_populates="player", cascade="all, delete-orphan")
 
 
+# `matches` and `match_participants` are range-partitioned by game_start_ts, one
+# partition per month (partitions.py). Primary keys must include the partition
+# key, so match_id alone isn't unique at the DB level and nothing can reference
+# it with a FOREIGN KEY: matches, teams and participants are written together
+# in one transaction instead. A lookup by match_id alone (GET /matches/{id},
+# the "already stored?" checks of ingestion) probes the primary key of every
+# partition, ~30 cheap index probes; /matches/{id} bodies are cached in front.
+PARTITION_BY_GAME_START = {"postgresql_partition_by": "RANGE (game_start_ts)"}
+
+
 class Matches(Base):
     __tablename__ = "matches"
 
-    match_id: Mapped[str] = mapped_column(
-        "matchId", primary_key=True, index=True
+    match_id: Mapped[str] = mapped_column("matchId", primary_key=True)
+    platform_id: Mapped[str] = mapped_column()
+    queue_id: Mapped[int] = mapped_column()
+    game_mode: Mapped[str] = mapped_column()
+    game_version: Mapped[str] = mapped_column()
+    # time windows (analytics refresh, exports) within a partition
+    game_start_ts: Mapped[int] = mapped_column(BigInteger, primary_key=True, index=True)
+    duration_sec: Mapped[int] = mapped_column()
+    # when the row was written: backfills insert old game_start_ts values, so the
+    # analytics refresh finds new rows by this instead
+    ingested_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now(), index=True)
+    participants = relationship(
+        "MatchParticipant",
+        primaryjoin="and_(Matches.match_id == foreign(MatchParticipant.match_id), "
+                    "Matches.game_start_ts == foreign(MatchParticipant.game_start_ts))",
+        back_populates="match",
+        cascade="all, delete-orphan",
+    )
+    teams = relationship(
+        "MatchTeam",
+        primaryjoin="Matches.match_id == foreign(MatchTeam.match_id)",
+        back_populates="match",
+        cascade="all, delete-orphan",
     )
-    platform_id: Mapped[str] = mapped_column(index=True)
-    queue_id: Mapped[int] = mapped_column(index=True)
-    game_mode: Mapped[str] = mapped_column(index=True)
-    game_version: Mapped[str] = mapped_column(index=True)
-    game_start_ts: Mapped[int] = mapped_column(BigInteger, index=True)
-    duration_sec: Mapped[int] = mapped_column(index=True)
-    participants = relationship("MatchParticipant", back_populates="match", cascade="all, delete-orphan")
+
+    __table_args__ = (PARTITION_BY_GAME_START,)
 
 class MatchTeam(Base):
     __tablename__ = "match_teams"
 
-    match_id: Mapped[str] = mapped_column(ForeignKey("matches.matchId"), primary_key=True)
+    match_id: Mapped[str] = mapped_column(primary_key=True)
     team_id: Mapped[int] = mapped_column(primary_key=True)  # 100 / 200
 
-    win: Mapped[bool] = mapped_column(Boolean, index=True)
+    win: Mapped[bool] = mapped_column(Boolean)
 
     # Team totals (calculados con participants)
     kills: Mapped[int] = mapped_column(Integer)
@@ -75,39 +103,40 @@ class MatchTeam(Base):
     # (opcional) bans como texto/JSON 
     bans: Mapped[list] = mapped_column(JSONB, default=list)
 
+    match = relationship("Matches", primaryjoin="Matches.match_id == foreign(MatchTeam.match_id)", back_populates="teams")
+
 
 class MatchParticipant(Base):
     __tablename__ = "match_participants"
 
-    # ----- Keys (PK compuesta) -----
-    match_id: Mapped[str] = mapped_column(
-        String(32),
-        ForeignKey("matches.matchId", ondelete="CASCADE"),
-        primary_key=True,
-    )
+    # ----- Keys (PK compuesta; the PK also serves lookups by match_id) -----
+    match_id: Mapped[str] = mapped_column(String(32), primary_key=True)
 
     puuid: Mapped[str] = mapped_column(
         String(100),
         ForeignKey("riot_user_profiles.puuid", ondelete="CASCADE"),
         primary_key=True,
-        index=True,
     )
 
+    # ----- Copied from matches (partition key; player history is read from this table alone) -----
+    game_start_ts: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    queue_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
     # ----- Identity / team -----
-    riot_id_name:Mapped[str | None] = mapped_column(String, nullable=True, index=True)
-    riot_id_tagline:Mapped[str | None] = mapped_column(String, nullable=True, index=True)
+    riot_id_name:Mapped[str | None] = mapped_column(String, nullable=True)
+    riot_id_tagline:Mapped[str | None] = mapped_column(String, nullable=True)
 
-    participant_id: Mapped[int] = mapped_column(SmallInteger, index=True)
-    team_id: Mapped[int] = mapped_column(SmallInteger, index=True)
-    win: Mapped[bool] = mapped_column(Boolean, index=True)
+    participant_id: Mapped[int] = mapped_column(SmallInteger)
+    team_id: Mapped[int] = mapped_column(SmallInteger)
+    win: Mapped[bool] = mapped_column(Boolean)
 
     # ----- Champion / role -----
-    champion_id: Mapped[int] = mapped_column(Integer, index=True)
+    champion_id: Mapped[int] = mapped_column(Integer)
     champ_level: Mapped[int] = mapped_column(SmallInteger)
 
     # Strings: TOP/JUNGLE/.../UTILITY
-    individual_position: Mapped[str | None] = mapped_column(String(16), index=True)
-    team_position: Mapped[str | None] = mapped_column(String(16), index=True)
+    individual_position: Mapped[str | None] = mapped_column(String(16))
+    team_position: Mapped[str | None] = mapped_column(String(16))
 
     # ----- Core performance -----
     kills: Mapped[int] = mapped_column(SmallInteger)
@@ -172,11 +201,190 @@ class MatchParticipant(Base):
     solo_kills: Mapped[int | None] = mapped_column(SmallInteger, nullable=True)
 
     # ----- Optional relationships -----
-    match = relationship("Matches", back_populates="participants")
+    match = relationship(
+        "Matches",
+        primaryjoin="and_(Matches.match_id == foreign(MatchParticipant.match_id), "
+                    "Matches.game_start_ts == foreign(MatchParticipant.game_start_ts))",
+        back_populates="participants",
+    )
     player = relationship("RiotUserProfile", back_populates="match_participants")
 
+    # Every index is maintained on each of the ~10 inserts per match: only the
+    # ones queries use. Lookups by match_id use the primary key.
     __table_args__ = (
-        Index("ix_mp_match_team", "match_id", "team_id"),
-        Index("ix_mp_puuid_match", "puuid", "match_id"),
-        Index("ix_mp_champion_role", "champion_id", "individual_position"),
-    )
\ No newline at end of file
+        # keyset pagination of a player's history: (game_start_ts, match_id) newest first
+        Index("ix_mp_puuid_history", "puuid", text("game_start_ts DESC"), text("match_id DESC")),
+        PARTITION_BY_GAME_START,
+    )
+
+
+class PlayerChampionStats(Base):
+    """Running totals per player/queue/champion/role, updated when a match is saved."""
+    __tablename__ = "player_champion_stats"
+
+    puuid: Mapped[str] = mapped_column(String(100), primary_key=True)
+    queue_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    champion_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    individual_position: Mapped[str] = mapped_column(String(16), primary_key=True)  # "" si no hay
+
+    games: Mapped[int] = mapped_column(Integer, default=0)
+    wins: Mapped[int] = mapped_column(Integer, default=0)
+    kills: Mapped[int] = mapped_column(Integer, default=0)
+    deaths: Mapped[int] = mapped_column(Integer, default=0)
+    assists: Mapped[int] = mapped_column(Integer, default=0)
+    gold_earned: Mapped[int] = mapped_column(BigInteger, default=0)
+    total_damage_dealt_to_champions: Mapped[int] = mapped_column(BigInteger, default=0)
+    vision_score: Mapped[int] = mapped_column(Integer, default=0)
+    total_cs: Mapped[int] = mapped_column(Integer, default=0)  # minions + neutral
+    duration_sec: Mapped[int] = mapped_column(BigInteger, default=0)
+    last_game_ts: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+# ----- Global champion aggregates (tier lists), updated when a match is saved -----
+class ChampionRoleStats(Base):
+    __tablename__ = "champion_role_stats"
+
+    patch: Mapped[str] = mapped_column(String(16), primary_key=True)  # "16.1" de game_version
+    queue_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    champion_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    individual_position: Mapped[str] = mapped_column(String(16), primary_key=True)
+
+    games: Mapped[int] = mapped_column(Integer, default=0)
+    wins: Mapped[int] = mapped_column(Integer, default=0)
+    kills: Mapped[int] = mapped_column(BigInteger, default=0)
+    deaths: Mapped[int] = mapped_column(BigInteger, default=0)
+    assists: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
+class ChampionBanStats(Base):
+    __tablename__ = "champion_ban_stats"
+
+    patch: Mapped[str] = mapped_column(String(16), primary_key=True)
+    queue_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    champion_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    bans: Mapped[int] = mapped_column(Integer, default=0)
+
+
+class PatchQueueTotals(Base):
+    __tablename__ = "patch_queue_totals"
+
+    patch: Mapped[str] = mapped_column(String(16), primary_key=True)
+    queue_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    matches: Mapped[int] = mapped_column(Integer, default=0)
+
+
+# ----- Ranked (league-v4) -----
+class RankedEntry(Base):
+    """Current league entry per player and queue (RANKED_SOLO_5x5, RANKED_FLEX_SR, ...)."""
+    __tablename__ = "ranked_entries"
+
+    puuid: Mapped[str] = mapped_column(String(100), primary_key=True)
+    queue_type: Mapped[str] = mapped_column(String(32), primary_key=True)
+
+    league_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    tier: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    rank: Mapped[str | None] = mapped_column(String(4), nullable=True)
+    league_points: Mapped[int] = mapped_column(Integer, default=0)
+    wins: Mapped[int] = mapped_column(Integer, default=0)
+    losses: Mapped[int] = mapped_column(Integer, default=0)
+    hot_streak: Mapped[bool] = mapped_column(Boolean, default=False)
+    veteran: Mapped[bool] = mapped_column(Boolean, default=False)
+    fresh_blood: Mapped[bool] = mapped_column(Boolean, default=False)
+    inactive: Mapped[bool] = mapped_column(Boolean, default=False)
+    mini_series: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+
+    last_updated: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+
+class RankedSnapshot(Base):
+    """Append-only LP history: one row each time a player's standing in a queue changes."""
+    __tablename__ = "ranked_snapshots"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    puuid: Mapped[str] = mapped_column(String(100))
+    queue_type: Mapped[str] = mapped_column(String(32))
+
+    tier: Mapped[str | None] = mapped_column(String(16), nullable=True)
+    rank: Mapped[str | None] = mapped_column(String(4), nullable=True)
+    league_points: Mapped[int] = mapped_column(Integer)
+    wins: Mapped[int] = mapped_column(Integer)
+    losses: Mapped[int] = mapped_column(Integer)
+
+    captured_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        Index("ix_ranked_snapshots_puuid_queue_time", "puuid", "queue_type", "captured_at"),
+    )
+
+
+class RankedSync(Base):
+    """When a player's league entries were last fetched (also covers unranked players with no entries)."""
+    __tablename__ = "ranked_sync"
+
+    puuid: Mapped[str] = mapped_column(String(100), primary_key=True)
+    platform: Mapped[str] = mapped_column(String(8))
+    synced_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+
+class BackgroundJob(Base):
+    __tablename__ = "background_jobs"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(64))
+    payload: Mapped[dict] = mapped_column(JSONB, default=dict)
+    # Same key can't be pending/running twice (e.g. "refresh_summoner:<riot id>")
+    dedupe_key: Mapped[str | None] = mapped_column(String, nullable=True)
+
+    # pending -> running -> done | pending (retry with backoff) | dead
+    status: Mapped[str] = mapped_column(String(16), default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=5)
+    run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    locked_by: Mapped[str | None] = mapped_column(String, nullable=True)
+
+    last_error: Mapped[str | None] = mapped_column(String, nullable=True)
+    result: Mapped[dict | None] = mapped_column(JSONB, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (
+        # claim query: status = 'pending' AND run_at <= now() ORDER BY run_at
+        Index("ix_jobs_pending_run_at", "run_at", postgresql_where=text("status = 'pending'")),
+        Index("ix_jobs_running_locked_at", "locked_at", postgresql_where=text("status = 'running'")),
+        Index(
+            "uq_jobs_active_dedupe_key",
+            "dedupe_key",
+            unique=True,
+            postgresql_where=text("status IN ('pending', 'running')"),
+        ),
+    )
+
+
+class TrackedPlayer(Base):
+    """A player whose new matches are polled and ingested by tracker.py."""
+    __tablename__ = "tracked_players"
+
+    puuid: Mapped[str] = mapped_column(String(100), primary_key=True)
+    # routing value (americas, europe, asia, sea) the match-v5 calls go to
+    region: Mapped[str] = mapped_column(String(16))
+
+    # seconds between polls: TRACKER_MIN_INTERVAL after a new match, growing while idle
+    poll_interval: Mapped[int] = mapped_column(Integer)
+    next_poll_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    last_polled_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_match_id: Mapped[str | None] = mapped_column(String, nullable=True)
+    last_match_seen_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
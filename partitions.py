@@ -0,0 +1,346 @@
+"""Monthly range partitions of `matches` and `match_participants` on game_start_ts.
+
+    python partitions.py status                  # partitions and estimated rows
+    python partitions.py maintain                # create upcoming months, detach expired ones
+    python partitions.py migrate [--drop-legacy] # convert tables created before partitioning
+
+Partitions are named `<table>_pYYYY_MM` and cover one UTC month of
+game_start_ts (ms). They are created from PARTITION_MONTHS_BACK months ago
+(Riot keeps about two years of match history) to PARTITION_MONTHS_AHEAD months
+from now; anything outside lands in `<table>_default` and is moved out when its
+month's partition is created. With PARTITION_RETENTION_MONTHS set, older months
+are detached (and dropped with PARTITION_DROP_DETACHED=1). The job worker runs
+`maintain` every PARTITION_MAINTENANCE_INTERVAL seconds; DDL is serialized
+across processes by an advisory lock.
+
+`migrate` renames the old tables to `<table>_legacy`, creates the partitioned
+ones from the models and copies matches (with their participants) in batches
+of `--batch`, oldest first. It can be interrupted and re-run. Stop the API and
+workers while it runs: a match ingested before its old row is copied would be
+counted twice in the rollups (or run `rebuild_player_champion_stats` and
+`rebuild_champion_aggregates` afterwards).
+"""
+import argparse
+import asyncio
+import os
+import re
+from datetime import datetime, timezone
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from db import Base, engine
+from models import Matches, MatchParticipant
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_MONTHS_BACK = int(os.getenv("PARTITION_MONTHS_BACK", "24"))
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))  # 0 = keep everything
+PARTITION_DROP_DETACHED = os.getenv("PARTITION_DROP_DETACHED", "0").lower() in ("1", "true", "yes")
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+# Partition DDL locks the parent table: give up (and retry next round) rather
+# than queue behind a long query and block every insert behind us
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+MIGRATE_BATCH = 2_000  # matches per transaction (~10 participants each)
+
+PARTITIONED_TABLES = {t.name: t for t in (Matches.__table__, MatchParticipant.__table__)}
+# pg_advisory_xact_lock key shared by every process doing partition DDL
+_DDL_LOCK = 7_304_911
+
+Month = tuple[int, int]  # (year, month)
+_PARTITION_NAME = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+# -----------------------------
+# Months
+# -----------------------------
+def month_of(ts_ms: int) -> Month:
+    dt = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+    return dt.year, dt.month
+
+
+def add_months(month: Month, n: int) -> Month:
+    index = month[0] * 12 + month[1] - 1 + n
+    return index // 12, index % 12 + 1
+
+
+def month_start_ms(month: Month) -> int:
+    return int(datetime(month[0], month[1], 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def current_month() -> Month:
+    now = datetime.now(timezone.utc)
+    return now.year, now.month
+
+
+def partition_name(table: str, month: Month) -> str:
+    return f"{table}_p{month[0]:04d}_{month[1]:02d}"
+
+
+def _columns(table: str, prefix: str = "") -> str:
+    return ", ".join(f'{prefix}"{c.name}"' for c in PARTITIONED_TABLES[table].columns)
+
+
+# -----------------------------
+# Catalog
+# -----------------------------
+async def is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    result = await conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    )
+    return bool(result.scalar())
+
+
+async def list_partitions(conn: AsyncConnection, table: str) -> dict[Month, str]:
+    """Monthly partitions attached to `table` (the default one excluded)."""
+    result = await conn.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:table)
+    """), {"table": table})
+    partitions = {}
+    for name in result.scalars():
+        match = _PARTITION_NAME.search(name)
+        if match:
+            partitions[(int(match[1]), int(match[2]))] = name
+    return partitions
+
+
+# -----------------------------
+# DDL
+# -----------------------------
+async def _lock(conn: AsyncConnection):
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _DDL_LOCK})
+    await conn.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {"timeout": PARTITION_LOCK_TIMEOUT})
+
+
+async def create_partition(db_engine: AsyncEngine, table: str, month: Month) -> bool:
+    """Create one month's partition; False if it already exists.
+
+    Rows of that month sitting in the default partition are moved into it in
+    the same transaction (Postgres refuses to create it otherwise).
+    """
+    name, default = partition_name(table, month), f"{table}_default"
+    bounds = {"low": month_start_ms(month), "high": month_start_ms(add_months(month, 1))}
+    in_range = "game_start_ts >= :low AND game_start_ts < :high"
+    async with db_engine.begin() as conn:
+        await _lock(conn)
+        if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+            return False
+        create = f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ({bounds['low']}) TO ({bounds['high']})"
+        has_default = (await conn.execute(text("SELECT to_regclass(:name)"), {"name": default})).scalar() is not None
+        stranded = has_default and (await conn.execute(
+            text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_range})"), bounds
+        )).scalar()
+        if not stranded:
+            await conn.execute(text(create))
+            return True
+        await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+        await conn.execute(text(create))
+        columns = _columns(table)
+        await conn.execute(text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {default} WHERE {in_range}"), bounds)
+        await conn.execute(text(f"DELETE FROM {default} WHERE {in_range}"), bounds)
+        await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    return True
+
+
+async def ensure_partitions(db_engine: AsyncEngine, since: Month | None = None) -> list[str]:
+    """Default partitions plus every month from `since` (or PARTITION_MONTHS_BACK ago) to PARTITION_MONTHS_AHEAD."""
+    now = current_month()
+    first = since or add_months(now, -PARTITION_MONTHS_BACK)
+    if PARTITION_RETENTION_MONTHS > 0:
+        first = max(first, add_months(now, -PARTITION_RETENTION_MONTHS))
+    last = add_months(now, PARTITION_MONTHS_AHEAD)
+
+    created = []
+    for table in PARTITIONED_TABLES:
+        async with db_engine.begin() as conn:
+            await _lock(conn)
+            await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
+            existing = await list_partitions(conn, table)
+        month = first
+        while month <= last:
+            if month not in existing and await create_partition(db_engine, table, month):
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+    return created
+
+
+async def detach_expired(db_engine: AsyncEngine) -> list[str]:
+    """Detach (or drop) partitions older than PARTITION_RETENTION_MONTHS."""
+    if PARTITION_RETENTION_MONTHS <= 0:
+        return []
+    cutoff = add_months(current_month(), -PARTITION_RETENTION_MONTHS)
+    detached = []
+    for table in PARTITIONED_TABLES:
+        async with db_engine.connect() as conn:
+            expired = [name for month, name in sorted((await list_partitions(conn, table)).items()) if month < cutoff]
+        for name in expired:
+            # DETACH ... CONCURRENTLY isn't allowed next to a default partition; a
+            # plain detach is a quick catalog change under PARTITION_LOCK_TIMEOUT
+            async with db_engine.begin() as conn:
+                await _lock(conn)
+                await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                if PARTITION_DROP_DETACHED:
+                    await conn.execute(text(f"DROP TABLE {name}"))
+            detached.append(name)
+    return detached
+
+
+async def require_partitioned(db_engine: AsyncEngine = engine):
+    """Refuse to run on tables created before partitioning (their keys don't fit the queries)."""
+    async with db_engine.connect() as conn:
+        for table in PARTITIONED_TABLES:
+            exists = (await conn.execute(text("SELECT to_regclass(:table)"), {"table": table})).scalar() is not None
+            if exists and not await is_partitioned(conn, table):
+                raise RuntimeError(f"{table} isn't partitioned yet: run `python partitions.py migrate` first")
+
+
+async def maintain(db_engine: AsyncEngine = engine) -> dict[str, list[str]]:
+    """Create missing partitions and detach expired ones; nothing before `migrate` has run."""
+    async with db_engine.connect() as conn:
+        if not await is_partitioned(conn, "matches"):
+            return {"created": [], "detached": []}
+    return {"created": await ensure_partitions(db_engine), "detached": await detach_expired(db_engine)}
+
+
+# -----------------------------
+# Migration from unpartitioned tables
+# -----------------------------
+CURSOR_TABLE = "partition_migration_cursor"
+
+
+async def _rename_legacy(conn: AsyncConnection):
+    # nothing can reference a partitioned table's match_id alone
+    await conn.execute(text("ALTER TABLE match_teams DROP CONSTRAINT IF EXISTS match_teams_match_id_fkey"))
+    for table in PARTITIONED_TABLES:
+        indexes = (await conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table"),
+            {"table": table},
+        )).scalars().all()
+        await conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_legacy"))
+        # index names are global: free them for the new tables
+        for index in indexes:
+            await conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index[:56]}_legacy"'))
+
+
+def _copy_batch_sql() -> str:
+    players = [c.name for c in MatchParticipant.__table__.columns]
+    # ingested_at is newer than the legacy layout: the new rows get its default
+    matches = ", ".join(f'"{c.name}"' for c in Matches.__table__.columns if c.name != "ingested_at")
+    # game_start_ts/queue_id from the match: the copies may be missing on old rows
+    from_match = {"game_start_ts": 'b.game_start_ts', "queue_id": 'b.queue_id'}
+    select_players = ", ".join(from_match.get(c, f'mp."{c}"') for c in players)
+    return f"""
+        WITH batch AS (
+            SELECT * FROM matches_legacy
+            WHERE game_start_ts >= :ts AND (game_start_ts > :ts OR "matchId" > :match_id)
+            ORDER BY game_start_ts, "matchId"
+            LIMIT :batch
+        ), copied AS (
+            INSERT INTO matches ({matches})
+            SELECT {matches} FROM batch
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        ), players AS (
+            INSERT INTO match_participants ({_columns("match_participants")})
+            SELECT {select_players}
+            FROM match_participants_legacy mp JOIN batch b ON b."matchId" = mp.match_id
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        ), last AS (
+            SELECT game_start_ts, "matchId" FROM batch ORDER BY game_start_ts DESC, "matchId" DESC LIMIT 1
+        )
+        SELECT (SELECT count(*) FROM batch), (SELECT count(*) FROM copied), (SELECT count(*) FROM players),
+               (SELECT game_start_ts FROM last), (SELECT "matchId" FROM last)
+    """
+
+
+async def migrate(batch: int = MIGRATE_BATCH, drop_legacy: bool = False):
+    async with engine.begin() as conn:
+        if not await is_partitioned(conn, "matches"):
+            print("Renaming matches/match_participants to *_legacy and creating partitioned tables")
+            await _rename_legacy(conn)
+            await conn.run_sync(lambda sync_conn: Base.metadata.create_all(sync_conn, tables=list(PARTITIONED_TABLES.values())))
+            await conn.execute(text(
+                f"CREATE TABLE {CURSOR_TABLE} (id INTEGER PRIMARY KEY, game_start_ts BIGINT NOT NULL, match_id TEXT NOT NULL)"
+            ))
+            await conn.execute(text(f"INSERT INTO {CURSOR_TABLE} VALUES (1, -1, '')"))
+        elif (await conn.execute(text("SELECT to_regclass('matches_legacy')"))).scalar() is None:
+            print("Already partitioned, nothing to migrate")
+            return
+        oldest = (await conn.execute(text("SELECT min(game_start_ts) FROM matches_legacy"))).scalar()
+
+    created = await ensure_partitions(engine, since=month_of(oldest) if oldest is not None else None)
+    print(f"Created {len(created)} partitions")
+
+    copy_batch = text(_copy_batch_sql())
+    total_matches = total_players = 0
+    while True:
+        async with engine.begin() as conn:
+            ts, match_id = (await conn.execute(text(f"SELECT game_start_ts, match_id FROM {CURSOR_TABLE}"))).one()
+            seen, matches, players, last_ts, last_id = (await conn.execute(
+                copy_batch, {"ts": ts, "match_id": match_id, "batch": batch}
+            )).one()
+            if not seen:
+                break
+            await conn.execute(
+                text(f"UPDATE {CURSOR_TABLE} SET game_start_ts = :ts, match_id = :match_id"),
+                {"ts": last_ts, "match_id": last_id},
+            )
+        total_matches += matches
+        total_players += players
+        print(f"  {total_matches} matches, {total_players} participants (up to {datetime.fromtimestamp(last_ts / 1000, tz=timezone.utc):%Y-%m-%d})")
+
+    async with engine.begin() as conn:
+        legacy = (await conn.execute(text("SELECT count(*) FROM matches_legacy"))).scalar()
+        stored = (await conn.execute(text("SELECT count(*) FROM matches"))).scalar()
+        print(f"matches_legacy: {legacy} rows, matches: {stored} rows")
+        if drop_legacy:
+            await conn.execute(text(f"DROP TABLE match_participants_legacy, matches_legacy, {CURSOR_TABLE}"))
+            print("Dropped the legacy tables")
+        else:
+            print("Check the copy, then re-run with --drop-legacy to drop matches_legacy/match_participants_legacy")
+    print("Successful")
+
+
+async def status():
+    async with engine.connect() as conn:
+        for table in PARTITIONED_TABLES:
+            if not await is_partitioned(conn, table):
+                print(f"{table}: not partitioned (run `python partitions.py migrate`)")
+                continue
+            result = await conn.execute(text("""
+                SELECT child.relname, greatest(child.reltuples, 0)::bigint
+                FROM pg_inherits i JOIN pg_class child ON child.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(:table)
+                ORDER BY child.relname
+            """), {"table": table})
+            print(table)
+            for name, rows in result.all():
+                print(f"  {name:<32} ~{rows} rows")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    commands.add_parser("maintain")
+    migrate_parser = commands.add_parser("migrate")
+    migrate_parser.add_argument("--batch", type=int, default=MIGRATE_BATCH, help="matches copied per transaction")
+    migrate_parser.add_argument("--drop-legacy", action="store_true", help="drop the *_legacy tables once copied")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "status":
+            await status()
+        elif args.command == "maintain":
+            result = await maintain()
+            print(f"Created: {', '.join(result['created']) or '-'}")
+            print(f"Detached: {', '.join(result['detached']) or '-'}")
+        else:
+            await migrate(args.batch, args.drop_legacy)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,203 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+
+import httpx
+
+# Interactive (endpoint) calls always go before background (ingestion/refresh) ones
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Starting app limit until Riot tells us the real one (development key default)
+RIOT_APP_RATE_LIMIT = os.getenv("RIOT_APP_RATE_LIMIT", "20:1,100:120")
+# Fallback when a 429 comes without Retry-After
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RiotRateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Riot rate limit reached, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def parse_limits(header: str | None) -> list[tuple[int, int]]:
+    """'20:1,100:120' -> [(20, 1), (100, 120)]"""
+    if not header:
+        return []
+    limits = []
+    for part in header.split(","):
+        count, _, seconds = part.strip().partition(":")
+        if count and seconds:
+            limits.append((int(count), int(seconds)))
+    return limits
+
+
+class TokenBucket:
+    """`limit` tokens per `window` seconds. A spent token comes back exactly
+    `window` seconds later, so no window of that length ever sees more than
+    `limit` requests (Riot counts windows from the first request)."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._spent: deque[float] = deque()
+
+    def _expire(self, now: float):
+        while self._spent and self._spent[0] <= now - self.window:
+            self._spent.popleft()
+
+    def delay(self, now: float) -> float:
+        self._expire(now)
+        if len(self._spent) < self.limit:
+            return 0.0
+        return self._spent[len(self._spent) - self.limit] + self.window - now
+
+    def take(self, now: float):
+        self._spent.append(now)
+
+    def sync(self, count: int, now: float):
+        # Riot's count also includes other processes using the same key
+        self._expire(now)
+        for _ in range(count - len(self._spent)):
+            self._spent.append(now)
+
+
+class BucketSet:
+    def __init__(self, limits: list[tuple[int, int]]):
+        self.limits = limits
+        self.buckets = [TokenBucket(count, seconds) for count, seconds in limits]
+
+    def delay(self, now: float) -> float:
+        return max((b.delay(now) for b in self.buckets), default=0.0)
+
+    def take(self, now: float):
+        for b in self.buckets:
+            b.take(now)
+
+    def update(self, limits_header: str | None, count_header: str | None, now: float):
+        limits = parse_limits(limits_header)
+        if limits and limits != self.limits:
+            old = {b.window: b for b in self.buckets}
+            self.limits = limits
+            self.buckets = [TokenBucket(count, seconds) for count, seconds in limits]
+            for b in self.buckets:
+                if b.window in old:
+                    b._spent = old[b.window]._spent
+        counts = dict((seconds, count) for count, seconds in parse_limits(count_header))
+        for b in self.buckets:
+            if b.window in counts:
+                b.sync(counts[b.window], now)
+
+
+class RateLimitLane:
+    """Scheduler for one Riot host (routing value like `americas` or platform like `la1`).
+
+    Waiters are served by priority, then arrival order. A waiter held back only by
+    its own method limit does not block others that are calling a different method.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.app = BucketSet(parse_limits(RIOT_APP_RATE_LIMIT))
+        self.methods: dict[str, BucketSet] = {}
+        self.blocked_until = 0.0
+        self.method_blocked_until: dict[str, float] = {}
+        self._waiters: list[tuple[int, int, str]] = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+
+    def _method(self, method: str) -> BucketSet:
+        bucket = self.methods.get(method)
+        if bucket is None:
+            # Method limits are unknown until the first response for that method
+            bucket = self.methods[method] = BucketSet([])
+        return bucket
+
+    def _method_delay(self, method: str, now: float) -> float:
+        return max(self._method(method).delay(now), self.method_blocked_until.get(method, 0.0) - now)
+
+    def _next(self, now: float) -> tuple[tuple | None, float]:
+        app_delay = max(self.app.delay(now), self.blocked_until - now)
+        soonest = math.inf
+        for entry in sorted(self._waiters):
+            method_delay = self._method_delay(entry[2], now)
+            if method_delay <= 0:
+                return entry, app_delay
+            soonest = min(soonest, method_delay)
+        return None, soonest
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, method: str, priority: int = PRIORITY_INTERACTIVE, max_wait: float | None = None) -> float:
+        """Wait for a slot and spend it. Returns the seconds spent waiting."""
+        start = time.monotonic()
+        deadline = None if max_wait is None else start + max_wait
+        entry = (priority, next(self._seq), method)
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    chosen, delay = self._next(now)
+                    if chosen is entry and delay <= 0:
+                        self._waiters.remove(entry)
+                        heapq.heapify(self._waiters)
+                        self.app.take(now)
+                        self._method(method).take(now)
+                        self._cond.notify_all()
+                        return now - start
+                    if deadline is not None and now + max(delay, 0.0) > deadline:
+                        raise RiotRateLimited(max(delay, 0.0))
+                    timeout = delay if delay > 0 and delay != math.inf else None
+                    if deadline is not None:
+                        timeout = min(timeout or math.inf, deadline - now)
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    async def record(self, method: str, response: httpx.Response):
+        """Sync buckets with Riot's headers and apply Retry-After on a 429."""
+        now = time.monotonic()
+        headers = response.headers
+        self.app.update(headers.get("X-App-Rate-Limit"), headers.get("X-App-Rate-Limit-Count"), now)
+        self._method(method).update(headers.get("X-Method-Rate-Limit"), headers.get("X-Method-Rate-Limit-Count"), now)
+        if response.status_code == 429:
+            try:
+                retry_after = float(headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+            except ValueError:
+                retry_after = DEFAULT_RETRY_AFTER
+            if headers.get("X-Rate-Limit-Type") == "application":
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            else:
+                # "method", or "service" (Riot's backend is overloaded) -> only hold this method
+                self.method_blocked_until[method] = max(self.method_blocked_until.get(method, 0.0), now + retry_after)
+        async with self._cond:
+            self._cond.notify_all()
+
+
+class RiotRateLimiter:
+    def __init__(self):
+        self._lanes: dict[str, RateLimitLane] = {}
+
+    def lane(self, host: str) -> RateLimitLane:
+        host = host.lower()
+        lane = self._lanes.get(host)
+        if lane is None:
+            lane = self._lanes[host] = RateLimitLane(host)
+        return lane
+
+
+rate_limiter = RiotRateLimiter()
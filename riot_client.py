@@ -0,0 +1,122 @@
+import logging
+import os
+import math
+import time
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from constants.Regions import RegionEq
+from rate_limiter import rate_limiter, RiotRateLimited, PRIORITY_INTERACTIVE
+from metrics import RIOT_REQUESTS, RIOT_RATE_LIMIT_WAIT, RIOT_RATE_LIMITED
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+RIOT_API_KEY = os.getenv("RIOT_API_KEY")
+# `{host}` is the routing/platform value; point it elsewhere for load tests (bench/fake_riot.py)
+RIOT_API_BASE_URL = os.getenv("RIOT_API_BASE_URL", "https://{host}.api.riotgames.com")
+
+# Pool tuning (por host de Riot: americas, europe, la1, euw1, ...)
+RIOT_HTTP_TIMEOUT = float(os.getenv("RIOT_HTTP_TIMEOUT", "20"))
+RIOT_HTTP_MAX_CONNECTIONS = int(os.getenv("RIOT_HTTP_MAX_CONNECTIONS", "20"))
+RIOT_HTTP_MAX_KEEPALIVE = int(os.getenv("RIOT_HTTP_MAX_KEEPALIVE", "10"))
+RIOT_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("RIOT_HTTP_KEEPALIVE_EXPIRY", "30"))
+RIOT_HTTP2 = os.getenv("RIOT_HTTP2", "0").lower() in ("1", "true", "yes")
+
+# 429 handling
+RIOT_MAX_RETRIES = int(os.getenv("RIOT_MAX_RETRIES", "3"))
+# Interactive callers give up (503 + Retry-After) instead of queueing longer than this
+RIOT_INTERACTIVE_MAX_WAIT = float(os.getenv("RIOT_INTERACTIVE_MAX_WAIT", "10"))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class RiotClientPool:
+    """One keep-alive httpx.AsyncClient per Riot host, shared by every request."""
+
+    def __init__(self):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._http2 = RIOT_HTTP2 and _http2_available()
+        if RIOT_HTTP2 and not self._http2:
+            logger.warning("RIOT_HTTP2 is set but the 'h2' package is not installed, using HTTP/1.1")
+
+    def _build(self, host: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=RIOT_API_BASE_URL.format(host=host),
+            headers={"X-Riot-Token": RIOT_API_KEY or ""},
+            timeout=RIOT_HTTP_TIMEOUT,
+            http2=self._http2,
+            limits=httpx.Limits(
+                max_connections=RIOT_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=RIOT_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=RIOT_HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+
+    async def open(self):
+        # routing hosts are known up front; platform hosts (la1, euw1...) open on first use
+        for routing in {r.value for r in RegionEq}:
+            self.get(routing)
+
+    def get(self, host: str) -> httpx.AsyncClient:
+        host = host.lower()
+        client = self._clients.get(host)
+        if client is None or client.is_closed:
+            client = self._build(host)
+            self._clients[host] = client
+        return client
+
+    async def aclose(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+riot_clients = RiotClientPool()
+
+
+async def riot_get(
+    host: str,
+    path: str,
+    *,
+    method: str,
+    params: dict | None = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> httpx.Response:
+    """GET against a Riot host through the rate limiter.
+
+    `method` names the Riot method bucket (e.g. "match-v5.match"). 429s are
+    retried after Retry-After; the last response is returned as-is so callers
+    keep their own status handling.
+    """
+    lane = rate_limiter.lane(host)
+    max_wait = RIOT_INTERACTIVE_MAX_WAIT if priority == PRIORITY_INTERACTIVE else None
+    for _ in range(RIOT_MAX_RETRIES + 1):
+        try:
+            waited = await lane.acquire(method, priority, max_wait=max_wait)
+        except RiotRateLimited as e:
+            RIOT_RATE_LIMITED.labels(lane.host).inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Riot API rate limit reached, retry later",
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+        RIOT_RATE_LIMIT_WAIT.labels(lane.host, str(priority)).observe(waited)
+        start = time.perf_counter()
+        try:
+            response = await riot_clients.get(host).get(path, params=params)
+        except httpx.HTTPError as e:
+            RIOT_REQUESTS.labels(method, lane.host, type(e).__name__).observe(time.perf_counter() - start)
+            raise
+        RIOT_REQUESTS.labels(method, lane.host, str(response.status_code)).observe(time.perf_counter() - start)
+        await lane.record(method, response)
+        if response.status_code != 429:
+            return response
+    return response
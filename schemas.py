@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, computed_field, model_validator
 from typing import Optional, Literal
 from datetime import datetime
 
@@ -22,6 +22,35 @@ class RiotUserProfileCreate(RiotUserProfileBase):
 class RiotUserProfile(RiotUserProfileBase):
     pass
 
+# Max players per POST /summoners/bulk
+SUMMONER_BULK_MAX = 20
+
+
+class SummonerLookup(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    # A puuid, or a Riot ID (gameName + tagLine)
+    puuid: Optional[str] = None
+    game_name: Optional[str] = Field(default=None, alias="gameName")
+    tag_line: Optional[str] = Field(default=None, alias="tagLine")
+
+    @model_validator(mode="after")
+    def check_identifier(self):
+        if not self.puuid and not (self.game_name and self.tag_line):
+            raise ValueError("either puuid or gameName + tagLine is required")
+        return self
+
+
+class SummonerBulkRequest(BaseModel):
+    players: list[SummonerLookup] = Field(min_length=1, max_length=SUMMONER_BULK_MAX)
+    region: str = "americas"
+
+
+class SummonerBulkItem(BaseModel):
+    # Same position as in the request; profile is None when it couldn't be resolved
+    profile: Optional[RiotUserProfile] = None
+    error: Optional[str] = None
+
 class MatchBase(BaseModel):
     model_config = ConfigDict(
         from_attributes=True,
@@ -162,4 +191,218 @@ class MatchParticipant(MatchParticipantBase):
 
 
 class MatchParticipantCreate(MatchParticipantBase):
-    pass
\ No newline at end of file
+    pass
+
+class MatchHistoryRow(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    match_id: str
+    game_start_ts: int
+    queue_id: int
+    game_mode: str
+    duration_sec: int
+
+    champion_id: int
+    champ_level: int
+    individual_position: Optional[str] = None
+    win: bool
+    kills: int
+    deaths: int
+    assists: int
+    cs: int
+    gold_earned: int
+    total_damage_dealt_to_champions: int
+    vision_score: int
+    kill_participation: Optional[float] = None
+
+    item0: int
+    item1: int
+    item2: int
+    item3: int
+    item4: int
+    item5: int
+    item6: int
+    summoner1_id: int
+    summoner2_id: int
+
+
+class MatchHistoryPage(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    items: list[MatchHistoryRow]
+    # Pass back as `cursor` for the next (older) page; None on the last page
+    next_cursor: Optional[str] = Field(default=None, alias="nextCursor")
+
+
+class MatchDetail(BaseModel):
+    # GET /matches/{matchId}
+    match: MatchCreate
+    teams: list[MatchTeamCreate]
+    players: list[MatchParticipantCreate]
+
+
+class MatchIngestRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    # Explicit ids, or the player's latest `count` matches (optionally by queue)
+    match_ids: Optional[list[str]] = Field(default=None, alias="matchIds", max_length=100)
+    count: int = Field(default=20, ge=1, le=100)
+    queue: Optional[int] = None
+
+
+class MatchIngestResult(BaseModel):
+    requested: int
+    skipped: list[str]
+    ingested: list[str]
+    failed: dict[str, str]
+
+
+# Max puuids per POST /tracker/players
+TRACK_BULK_MAX = 1000
+
+
+class TrackRequest(BaseModel):
+    puuids: list[str] = Field(min_length=1, max_length=TRACK_BULK_MAX)
+    # routing value: americas, europe, asia or sea
+    region: str = "americas"
+
+
+class TrackedPlayer(BaseModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    puuid: str
+    region: str
+    poll_interval: int = Field(alias="pollInterval")
+    next_poll_at: datetime = Field(alias="nextPollAt")
+    last_polled_at: Optional[datetime] = Field(default=None, alias="lastPolledAt")
+    last_match_id: Optional[str] = Field(default=None, alias="lastMatchId")
+    last_match_seen_at: Optional[datetime] = Field(default=None, alias="lastMatchSeenAt")
+
+
+class JobRef(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    job_id: int = Field(alias="jobId")
+    status: str
+
+
+class Job(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    max_attempts: int
+    run_at: datetime
+    last_error: Optional[str] = None
+    result: Optional[dict] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class PlayerChampionStats(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    queue_id: int
+    champion_id: int
+    individual_position: str
+
+    games: int
+    wins: int
+    kills: int
+    deaths: int
+    assists: int
+    gold_earned: int
+    total_damage_dealt_to_champions: int
+    vision_score: int
+    total_cs: int
+    duration_sec: int
+    last_game_ts: int
+
+    @computed_field
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.games if self.games else 0.0
+
+    @computed_field
+    @property
+    def kda(self) -> float:
+        return (self.kills + self.assists) / max(self.deaths, 1)
+
+    @computed_field
+    @property
+    def cs_per_minute(self) -> float:
+        return self.total_cs * 60 / self.duration_sec if self.duration_sec else 0.0
+
+
+class ChampionAnalytics(BaseModel):
+    champion_id: int
+    role: str
+    games: int
+    win_rate: float
+    pick_rate: float
+    ban_rate: float
+    avg_kills: float
+    avg_deaths: float
+    avg_assists: float
+    kda: float
+
+
+class RankedEntry(BaseModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    # Same keys as Riot's league-v4 entries, plus lastUpdated
+    puuid: str
+    queue_type: str = Field(alias="queueType")
+    league_id: Optional[str] = Field(default=None, alias="leagueId")
+    tier: Optional[str] = None
+    rank: Optional[str] = None
+    league_points: int = Field(default=0, alias="leaguePoints")
+    wins: int = 0
+    losses: int = 0
+    hot_streak: bool = Field(default=False, alias="hotStreak")
+    veteran: bool = False
+    fresh_blood: bool = Field(default=False, alias="freshBlood")
+    inactive: bool = False
+    mini_series: Optional[dict] = Field(default=None, alias="miniSeries")
+    last_updated: Optional[datetime] = Field(default=None, alias="lastUpdated")
+
+
+class RankedSnapshot(BaseModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    queue_type: str = Field(alias="queueType")
+    tier: Optional[str] = None
+    rank: Optional[str] = None
+    league_points: int = Field(alias="leaguePoints")
+    wins: int
+    losses: int
+    captured_at: datetime = Field(alias="capturedAt")
+
+
+class MetricPercentiles(BaseModel):
+    champion_id: Optional[int] = None
+    role: Optional[str] = None
+    patch: Optional[str] = None
+    queue: Optional[int] = None
+    metric: str
+    games: int
+    mean: Optional[float] = None
+    std: Optional[float] = None
+    percentiles: dict[str, float]
+    # Where `value` falls among these games (0-100), when given
+    value: Optional[float] = None
+    percentile_rank: Optional[float] = None
+    win_rate: Optional[float] = None
+
+
+class MetricDistribution(BaseModel):
+    champion_id: Optional[int] = None
+    role: Optional[str] = None
+    patch: Optional[str] = None
+    queue: Optional[int] = None
+    metric: str
+    games: int
+    edges: list[float]
+    counts: list[int]
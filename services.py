@@ -1,21 +1,67 @@
-from collections import defaultdict
-import os
-import httpx
+import asyncio
+import base64
 from datetime import datetime, timedelta, timezone
 from typing import Optional
+from dataclasses import dataclass
 import json
-from sqlalchemy import select
+import logging
+from sqlalchemy import select, func, delete, literal_column, text, tuple_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from models import Matches, MatchTeam, MatchParticipant
 from sqlalchemy.dialects.postgresql import insert
-from models import RiotUserProfile,Matches
+from models import RiotUserProfile,Matches,PlayerChampionStats,ChampionRoleStats,ChampionBanStats,PatchQueueTotals
+from models import RankedEntry, RankedSnapshot, RankedSync
 from schemas import RiotUserProfileCreate,MatchCreate,MatchTeamCreate,MatchParticipantCreate
+import schemas
+import jobs
+from db import SessionLocal
 from fastapi import HTTPException
-RIOT_API_KEY = os.getenv("RIOT_API_KEY")
+from riot_client import riot_get
+from rate_limiter import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from singleflight import SingleFlight
+from cache import Cache, LRUCache, TypedCodec
+import analytics
+from match_parser import RiotMatch, decode_match, parse_match, patch_from_version
+from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
 
 # TTLs (Time To Live)
 SUMMONER_TTL = timedelta(hours=1)
 MATCH_FETCH_TTL = timedelta(minutes=15)
+RANKED_TTL = timedelta(minutes=10)
+
+# Batch ingestion: concurrent Riot fetches, and matches written per transaction
+# (a participant row is ~60 params, keep batches under asyncpg's 32767 limit)
+INGEST_CONCURRENCY = 8
+INGEST_BATCH_SIZE = 25
+
+# Match-id lists per (puuid, queue), newest first
+MATCH_ID_CACHE_SIZE = 10_000
+MATCH_ID_PAGE_SIZE = 100  # Riot's max `count`
+# Riot filters `startTime` on game start, so a refresh looks back past the last
+# fetch far enough to catch games that were still being played at that time
+MATCH_ID_REFRESH_OVERLAP = timedelta(hours=2)
+
+# Profile snapshots (schemas.RiotUserProfile) in the cache backend; 2 keys per profile.
+# Past SUMMONER_TTL they are still served while a background refresh runs, and
+# past PROFILE_CACHE_MAX_AGE they are dropped.
+PROFILE_CACHE_SIZE = 50_000
+PROFILE_CACHE_MAX_AGE = timedelta(days=1)
+# A failed background refresh (e.g. renamed Riot ID) isn't retried sooner than this
+PROFILE_REVALIDATE_BACKOFF = timedelta(minutes=1)
+# puuid -> platform (la1, euw1, ...); players rarely transfer
+PLATFORM_CACHE_TTL = timedelta(days=7)
+
+# League entries served from storage; stale ones are refreshed by a background job
+RANKED_CACHE_SIZE = 50_000
+RANKED_STALE_RECHECK = timedelta(seconds=30)
+# A snapshot row is appended when any of these change
+_RANKED_STANDING = ("tier", "rank", "league_points", "wins", "losses")
+
+# Concurrent identical lookups (same Riot ID / same match) share one execution
+inflight = SingleFlight()
 
 
 # -----------------------------
@@ -30,6 +76,105 @@ def is_stale(profile: RiotUserProfile) -> bool:
     return datetime.now(timezone.utc) - last_updated > SUMMONER_TTL
 
 
+def _riot_id_key(gameName: str, tagLine: str) -> tuple:
+    return ("riot_id", gameName.strip().casefold(), tagLine.strip().casefold())
+
+
+# -----------------------------
+# Profile cache
+# -----------------------------
+_profile_cache = Cache(
+    "profiles", TypedCodec(schemas.RiotUserProfile), PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_MAX_AGE.total_seconds()
+)
+# Strong refs to stale-while-revalidate tasks (the loop only keeps weak ones)
+_revalidating: set[asyncio.Task] = set()
+_revalidated_recently = LRUCache(PROFILE_CACHE_SIZE, ttl=PROFILE_REVALIDATE_BACKOFF.total_seconds())
+_platform_cache = LRUCache(PROFILE_CACHE_SIZE * 4, ttl=PLATFORM_CACHE_TTL.total_seconds(), name="platforms")
+# routing region -> last platform resolved there; guessed for the next new player
+_platform_hint: dict[str, str] = {}
+
+
+async def cache_profile(profile: RiotUserProfile | schemas.RiotUserProfile) -> schemas.RiotUserProfile:
+    return (await cache_profiles([profile]))[0]
+
+
+async def cache_profiles(profiles: list[RiotUserProfile | schemas.RiotUserProfile]) -> list[schemas.RiotUserProfile]:
+    """Snapshot and cache profiles under both keys, with one batch read and one batch write."""
+    snapshots = [schemas.RiotUserProfile.model_validate(p) for p in profiles]
+    if not snapshots:
+        return []
+    previous = await _profile_cache.get_many(("puuid", s.puuid) for s in snapshots)
+    entries = {}
+    for snapshot in snapshots:
+        entries[("puuid", snapshot.puuid)] = snapshot
+        entries[_riot_id_key(snapshot.gameName, snapshot.tagLine)] = snapshot
+        if snapshot.region:
+            _platform_cache.set(snapshot.puuid, snapshot.region.lower())
+    # Riot ID changed: don't keep serving the old name
+    renamed = [_riot_id_key(p.gameName, p.tagLine) for p in previous.values()]
+    await _profile_cache.delete_many(key for key in renamed if key not in entries)
+    await _profile_cache.set_many(entries)
+    return snapshots
+
+
+async def invalidate_profiles(puuids: list[str]):
+    keys = [("puuid", puuid) for puuid in puuids]
+    previous = await _profile_cache.get_many(keys)
+    await _profile_cache.delete_many(keys + [_riot_id_key(p.gameName, p.tagLine) for p in previous.values()])
+
+
+async def get_profile(db: AsyncSession, puuid: str) -> schemas.RiotUserProfile | None:
+    cached = await _profile_cache.get(("puuid", puuid))
+    if cached is not None:
+        return cached
+    profile = await getSummoner(db, puuid)
+    return await cache_profile(profile) if profile else None
+
+
+async def get_profile_by_riot_id(db: AsyncSession, gameName: str, tagLine: str) -> schemas.RiotUserProfile | None:
+    cached = await _profile_cache.get(_riot_id_key(gameName, tagLine))
+    if cached is not None:
+        return cached
+    profile = await getSummoner_by_name(db, gameName, tagLine)
+    return await cache_profile(profile) if profile else None
+
+
+async def get_or_refresh_summoner(
+    db: AsyncSession,
+    gameName: str,
+    tagLine: str,
+    region: str = "americas",
+    read_db: Optional[AsyncSession] = None,
+) -> RiotUserProfile | schemas.RiotUserProfile:
+    """Cached profile if there is one (stale ones are refreshed in the background), else fetch from Riot.
+    The lookup uses `read_db` (a replica) when given; refreshes are written through `db`."""
+    profile = await get_profile_by_riot_id(read_db or db, gameName, tagLine)
+    if profile is None:
+        return await refresh_summoner(db, gameName, tagLine, region)
+    if is_stale(profile):
+        revalidate_summoner(gameName, tagLine, region)
+    return profile
+
+
+def revalidate_summoner(gameName: str, tagLine: str, region: str = "americas"):
+    key = _summoner_flight_key(gameName, tagLine, region)
+    if key in _revalidated_recently or inflight.in_flight(key):
+        return
+    _revalidated_recently.set(key, True)
+    task = asyncio.create_task(_revalidate_summoner(gameName, tagLine, region))
+    _revalidating.add(task)
+    task.add_done_callback(_revalidating.discard)
+
+
+async def _revalidate_summoner(gameName: str, tagLine: str, region: str):
+    # Own session: the request's session is closed once the response is sent
+    try:
+        async with SessionLocal() as db:
+            await refresh_summoner(db, gameName, tagLine, region, priority=PRIORITY_BACKGROUND)
+    except Exception as e:
+        logger.warning("Background refresh of %s#%s failed: %r", gameName, tagLine, e)
+
+
 # -----------------------------
 # DB CRUD (ASYNC)
 # -----------------------------
@@ -37,7 +182,7 @@ async def create_summoner(db: AsyncSession, data: RiotUserProfileCreate) -> Riot
     profile_instance = RiotUserProfile(**data.model_dump())
     db.add(profile_instance)
     await db.commit()
-    await db.refresh(profile_instance)
+    await cache_profile(profile_instance)
     return profile_instance
 
 
@@ -63,12 +208,9 @@ async def get_summoner_region_by_puuid(db: AsyncSession, puuid: str) -> str | No
         result = await db.execute(
             select(RiotUserProfile.region).where(RiotUserProfile.puuid == puuid)
         )
-        region = result.scalar_one_or_none()
-        if region:
-            print(region)
-        return region
+        return result.scalar_one_or_none()
     except Exception as e:
-        print(f"Error al consultar la DB: {e}")
+        logger.warning("Error al consultar la DB: %s", e)
         return None
 
 async def create_or_update_summoner(db: AsyncSession, data: RiotUserProfileCreate) -> RiotUserProfile:
@@ -89,315 +231,1019 @@ async def create_or_update_summoner(db: AsyncSession, data: RiotUserProfileCreat
             for key, value in data.model_dump(exclude_none=True).items():
                 setattr(profile, key, value)
 
+            # expire_on_commit=False and every column is set client-side, so no refresh needed
             await db.commit()
-            await db.refresh(profile)
 
+        await cache_profile(profile)
         return profile
 
     # no existe -> crear
     profile_instance = RiotUserProfile(**data.model_dump())
     db.add(profile_instance)
     await db.commit()
-    await db.refresh(profile_instance)
+    await cache_profile(profile_instance)
     return profile_instance
 
-async def upsert_profiles_from_match(db: AsyncSession, raw_data: dict, region: str):
-    rows = []
-    region = raw_data["metadata"]["matchId"]
+async def refresh_summoner(
+    db: AsyncSession,
+    gameName: str,
+    tagLine: str,
+    region: str = "americas",
+    priority: int = PRIORITY_INTERACTIVE,
+) -> RiotUserProfile:
+    key = _summoner_flight_key(gameName, tagLine, region)
+    return await inflight.do(key, lambda: _refresh_summoner(db, gameName, tagLine, region, priority))
+
+
+def _summoner_flight_key(gameName: str, tagLine: str, region: str) -> tuple:
+    return ("summoner", region.lower(), gameName.strip().casefold(), tagLine.strip().casefold())
+
+
+async def _refresh_summoner(db: AsyncSession, gameName: str, tagLine: str, region: str, priority: int) -> RiotUserProfile:
+    known = await get_profile_by_riot_id(db, gameName, tagLine)
+    riot_data = await fetch_summoner_from_riot(gameName, tagLine, region, priority, known=known)
+
+    profile_data = RiotUserProfileCreate(
+        puuid=riot_data["puuid"],
+        gameName=riot_data["gameName"],
+        tagLine=riot_data["tagLine"],
+        region=riot_data["region"],
+        summonerLevel=riot_data["summonerLevel"],
+        profileIcon=riot_data["profileIcon"],
+        last_updated=datetime.now(timezone.utc)
+    )
 
-    for p in raw_data["info"]["participants"]:
-        rows.append({
-            "puuid": p["puuid"],
-            "gameName": p.get("riotIdGameName"),
-            "tagLine": p.get("riotIdTagline"),
-            "region": region.split('_')[0].lower(),
-        })
+    return await create_or_update_summoner(db, profile_data)
+
+async def upsert_profiles(db: AsyncSession, rows: list[dict]) -> list[str]:
+    """Upsert profile rows without committing; returns their puuids. Callers invalidate
+    (or re-cache) those after their commit, or a concurrent reader could cache the old row."""
+    # ON CONFLICT can't touch the same row twice in one statement
+    rows = list({r["puuid"]: r for r in rows}.values())
     rows.sort(key=lambda r: r["puuid"])# This line is important to deny Deadlock Error
+    for r in rows:
+        # platform from the match id; lets a first lookup of these players skip region-by-puuid
+        if r["region"]:
+            _platform_cache.set(r["puuid"], r["region"])
     stmt = insert(RiotUserProfile).values(rows)
     stmt = stmt.on_conflict_do_update(
         index_elements=["puuid"],
-        set_={
-            "gameName": stmt.excluded.gameName,
-            "tagLine": stmt.excluded.tagLine,
-            "region": stmt.excluded.region,
-        }
+        # every column given (name/tag/region from matches; level/icon/last_updated too from Riot)
+        set_={key: stmt.excluded[key] for key in rows[0] if key != "puuid"},
     )
     await db.execute(stmt)
+    return [r["puuid"] for r in rows]
+
+
+async def get_summoners_bulk(
+    db: AsyncSession,
+    lookups: list[schemas.SummonerLookup],
+    region: str = "americas",
+    read_db: Optional[AsyncSession] = None,
+) -> list[schemas.SummonerBulkItem]:
+    """Resolve many players at once: cache, then one IN query (on `read_db` when given), then
+    concurrent Riot fetches for misses/stale ones, stored with a single upsert. Results keep the input order."""
+    def key_of(lookup: schemas.SummonerLookup) -> tuple:
+        if lookup.puuid:
+            return ("puuid", lookup.puuid)
+        return _riot_id_key(lookup.game_name, lookup.tag_line)
+
+    keys = [key_of(lookup) for lookup in lookups]
+    found: dict[tuple, schemas.RiotUserProfile] = await _profile_cache.get_many(keys)
+
+    missing = {key: lookup for key, lookup in zip(keys, lookups) if key not in found}
+    if missing:
+        puuids = [lookup.puuid for lookup in missing.values() if lookup.puuid]
+        riot_ids = [(lookup.game_name, lookup.tag_line) for lookup in missing.values() if not lookup.puuid]
+        conditions = []
+        if puuids:
+            conditions.append(RiotUserProfile.puuid.in_(puuids))
+        if riot_ids:
+            conditions.append(tuple_(RiotUserProfile.gameName, RiotUserProfile.tagLine).in_(riot_ids))
+        result = await (read_db or db).execute(select(RiotUserProfile).where(or_(*conditions)))
+        for snapshot in await cache_profiles(list(result.scalars())):
+            for key in (("puuid", snapshot.puuid), _riot_id_key(snapshot.gameName, snapshot.tagLine)):
+                if key in missing:
+                    found[key] = snapshot
+
+    # Misses, stale profiles and profiles only known from matches (no level/icon yet)
+    to_fetch = {
+        key: lookup for key, lookup in zip(keys, lookups)
+        if key not in found or is_stale(found[key]) or found[key].summonerLevel is None
+    }
+    errors: dict[tuple, str] = {}
+    if to_fetch:
+        semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+        async def fetch(key: tuple, lookup: schemas.SummonerLookup) -> dict:
+            known = found.get(key)
+            async with semaphore:
+                if lookup.puuid:
+                    return await fetch_summoner_by_puuid(lookup.puuid, region, platform=known.region if known else None)
+                return await fetch_summoner_from_riot(lookup.game_name, lookup.tag_line, region, known=known)
+
+        results = await asyncio.gather(*(fetch(k, l) for k, l in to_fetch.items()), return_exceptions=True)
+        now = datetime.now(timezone.utc)
+        rows = {}
+        for key, result in zip(to_fetch, results):
+            if isinstance(result, HTTPException):
+                errors[key] = f"{result.status_code}: {result.detail}"
+            elif isinstance(result, Exception):
+                errors[key] = str(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                rows[key] = {**result, "last_updated": now}
+        if rows:
+            await upsert_profiles(db, list(rows.values()))
+            await db.commit()
+            # re-caching after the commit replaces whatever a concurrent reader cached meanwhile
+            snapshots = await cache_profiles([schemas.RiotUserProfile.model_validate(row) for row in rows.values()])
+            found.update(zip(rows, snapshots))
+
+    items = []
+    for key in keys:
+        profile = found.get(key)
+        # a stale profile is still better than nothing when its refresh failed
+        error = errors.get(key) if profile is None else None
+        items.append(schemas.SummonerBulkItem(profile=profile, error=error))
+    return items
 
 async def save_match(
     db: AsyncSession,
     match_data: MatchCreate,
     teams: list[MatchTeamCreate],
     players: list[MatchParticipantCreate],
-) -> Matches:
-    match_id = match_data.match_id  
-
-    # ya existe?
-    result = await db.execute(select(Matches).where(Matches.match_id == match_id))
-    existing = result.scalar_one_or_none()
-    if existing:
-        return existing
-
-    # Insert match
-    match = Matches(
-        match_id=match_data.match_id,
-        platform_id=match_data.platform_id,
-        queue_id=match_data.queue_id,
-        game_mode=match_data.game_mode,
-        game_version=match_data.game_version,
-        game_start_ts=match_data.game_start_ts,
-        duration_sec=match_data.duration_sec,
+) -> bool:
+    """Store one parsed match and commit. Goes through save_matches_bulk, so a
+    concurrent writer of the same match (job worker, tracker) is skipped by
+    ON CONFLICT instead of failing; returns False when it was already stored."""
+    inserted = await save_matches_bulk(db, [(match_data, teams, players)])
+    await db.commit()
+    await invalidate_profiles([p.puuid for p in players])
+    if inserted:
+        analytics.engine.add_matches([(match_data, teams, players)])
+    return bool(inserted)
+
+
+async def save_matches_bulk(
+    db: AsyncSession,
+    matches: list[tuple[MatchCreate, list[MatchTeamCreate], list[MatchParticipantCreate]]],
+) -> list[str]:
+    """Insert many parsed matches with one multi-row statement per table.
+
+    Matches that already exist are skipped. Does not commit; returns the ids
+    that were actually inserted. The participants' profiles are upserted too, so
+    the caller invalidates their cache entries after committing.
+    """
+    if not matches:
+        return []
+
+    await upsert_profiles(db, [
+        {
+            "puuid": p.puuid,
+            "gameName": p.riot_id_name,
+            "tagLine": p.riot_id_tagline,
+            "region": m.match_id.split('_')[0].lower(),
+        }
+        for m, _, players in matches for p in players
+    ])
+
+    stmt = (
+        insert(Matches)
+        .values([m.model_dump() for m, _, _ in matches])
+        # the partition key is part of the PK; a match always has the same start time
+        .on_conflict_do_nothing(index_elements=[Matches.match_id, Matches.game_start_ts])
+        .returning(Matches.match_id)
+    )
+    inserted = set((await db.execute(stmt)).scalars())
+    if not inserted:
+        return []
+
+    team_rows = [t.model_dump() for m, teams, _ in matches if m.match_id in inserted for t in teams]
+    player_rows = [
+        {**p.model_dump(), "game_start_ts": m.game_start_ts, "queue_id": m.queue_id}
+        for m, _, players in matches if m.match_id in inserted for p in players
+    ]
+    if team_rows:
+        await db.execute(insert(MatchTeam).values(team_rows))
+    if player_rows:
+        await db.execute(insert(MatchParticipant).values(player_rows))
+    new_matches = [m for m in matches if m[0].match_id in inserted]
+    await update_rollups(db, new_matches)
+    return [m.match_id for m, _, _ in new_matches]
+
+
+async def update_rollups(
+    db: AsyncSession,
+    matches: list[tuple[MatchCreate, list[MatchTeamCreate], list[MatchParticipantCreate]]],
+):
+    # Only for matches that were actually inserted, or games get counted twice
+    await update_player_champion_stats(db, matches)
+    await update_champion_aggregates(db, matches)
+
+
+async def _add_to_rollup(db: AsyncSession, model, keys: tuple[str, ...], sums: tuple[str, ...], rows: dict[tuple, dict], extra_set: Optional[dict] = None):
+    """INSERT ... ON CONFLICT DO UPDATE adding `sums` onto existing rows."""
+    if not rows:
+        return
+    stmt = insert(model).values([rows[k] for k in sorted(rows)])  # same lock order in every transaction
+    table = model.__table__
+    set_ = {c: table.c[c] + stmt.excluded[c] for c in sums}
+    for column, fn in (extra_set or {}).items():
+        set_[column] = fn(table.c[column], stmt.excluded[column])
+    await db.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=set_))
+
+
+# Summed columns of player_champion_stats
+_PLAYER_STAT_SUMS = (
+    "games", "wins", "kills", "deaths", "assists", "gold_earned",
+    "total_damage_dealt_to_champions", "vision_score", "total_cs", "duration_sec",
+)
+
+
+async def update_player_champion_stats(
+    db: AsyncSession,
+    matches: list[tuple[MatchCreate, list[MatchTeamCreate], list[MatchParticipantCreate]]],
+):
+    """Add newly saved matches to the per-player rollup, in the caller's transaction."""
+    acc: dict[tuple, dict] = {}
+    for m, _, players in matches:
+        for p in players:
+            key = (p.puuid, m.queue_id, p.champion_id, p.individual_position or "")
+            row = acc.get(key)
+            if row is None:
+                row = acc[key] = dict(zip(("puuid", "queue_id", "champion_id", "individual_position"), key))
+                row.update({c: 0 for c in _PLAYER_STAT_SUMS}, last_game_ts=0)
+            row["games"] += 1
+            row["wins"] += int(p.win)
+            row["kills"] += p.kills
+            row["deaths"] += p.deaths
+            row["assists"] += p.assists
+            row["gold_earned"] += p.gold_earned
+            row["total_damage_dealt_to_champions"] += p.total_damage_dealt_to_champions
+            row["vision_score"] += p.vision_score
+            row["total_cs"] += p.total_minions_killed + p.neutral_minions_killed
+            row["duration_sec"] += m.duration_sec
+            row["last_game_ts"] = max(row["last_game_ts"], m.game_start_ts)
+    await _add_to_rollup(
+        db,
+        PlayerChampionStats,
+        ("puuid", "queue_id", "champion_id", "individual_position"),
+        _PLAYER_STAT_SUMS,
+        acc,
+        extra_set={"last_game_ts": func.greatest},
     )
-    db.add(match)
-   
-    await db.flush()
 
-    # Insert teams
-    db.add_all([MatchTeam(**t.model_dump()) for t in teams])
 
-    # Insert players
-    db.add_all([MatchParticipant(**p.model_dump()) for p in players])
+_CHAMPION_ROLE_SUMS = ("games", "wins", "kills", "deaths", "assists")
+
+
+async def update_champion_aggregates(
+    db: AsyncSession,
+    matches: list[tuple[MatchCreate, list[MatchTeamCreate], list[MatchParticipantCreate]]],
+):
+    """Add newly saved matches to the global champion/role, ban and match-count aggregates."""
+    roles: dict[tuple, dict] = {}
+    bans: dict[tuple, dict] = {}
+    totals: dict[tuple, dict] = {}
+    for m, teams, players in matches:
+        patch = patch_from_version(m.game_version)
+        total = totals.setdefault((patch, m.queue_id), {"patch": patch, "queue_id": m.queue_id, "matches": 0})
+        total["matches"] += 1
+
+        for p in players:
+            key = (patch, m.queue_id, p.champion_id, p.individual_position or "")
+            row = roles.get(key)
+            if row is None:
+                row = roles[key] = dict(zip(("patch", "queue_id", "champion_id", "individual_position"), key))
+                row.update({c: 0 for c in _CHAMPION_ROLE_SUMS})
+            row["games"] += 1
+            row["wins"] += int(p.win)
+            row["kills"] += p.kills
+            row["deaths"] += p.deaths
+            row["assists"] += p.assists
+
+        # championId -1 = ban saltado
+        banned = {b.get("championId") for t in teams for b in t.bans} - {None, -1}
+        for champion_id in banned:
+            key = (patch, m.queue_id, champion_id)
+            row = bans.setdefault(key, {"patch": patch, "queue_id": m.queue_id, "champion_id": champion_id, "bans": 0})
+            row["bans"] += 1
+
+    await _add_to_rollup(db, ChampionRoleStats, ("patch", "queue_id", "champion_id", "individual_position"), _CHAMPION_ROLE_SUMS, roles)
+    await _add_to_rollup(db, ChampionBanStats, ("patch", "queue_id", "champion_id"), ("bans",), bans)
+    await _add_to_rollup(db, PatchQueueTotals, ("patch", "queue_id"), ("matches",), totals)
+
+
+async def get_champion_analytics(
+    db: AsyncSession,
+    patch: Optional[str] = None,
+    queue: Optional[int] = None,
+    role: Optional[str] = None,
+    min_games: int = 1,
+) -> list[dict]:
+    """Tier-list rows (one per champion and role) read from the aggregate tables only."""
+    def scoped(stmt, model):
+        if patch is not None:
+            stmt = stmt.where(model.patch == patch)
+        if queue is not None:
+            stmt = stmt.where(model.queue_id == queue)
+        return stmt
+
+    total_matches = (await db.execute(scoped(select(func.coalesce(func.sum(PatchQueueTotals.matches), 0)), PatchQueueTotals))).scalar_one()
+    if not total_matches:
+        return []
+
+    ban_rows = await db.execute(
+        scoped(select(ChampionBanStats.champion_id, func.sum(ChampionBanStats.bans)), ChampionBanStats)
+        .group_by(ChampionBanStats.champion_id)
+    )
+    bans = dict(ban_rows.all())
+
+    crs = ChampionRoleStats
+    games = func.sum(crs.games)
+    stmt = scoped(
+        select(crs.champion_id, crs.individual_position, games, func.sum(crs.wins), func.sum(crs.kills), func.sum(crs.deaths), func.sum(crs.assists)),
+        crs,
+    )
+    if role is not None:
+        stmt = stmt.where(crs.individual_position == role.upper())
+    stmt = stmt.group_by(crs.champion_id, crs.individual_position).having(games >= min_games).order_by(games.desc())
+
+    rows = []
+    for champion_id, position, n, wins, kills, deaths, assists in (await db.execute(stmt)).all():
+        rows.append({
+            "champion_id": champion_id,
+            "role": position,
+            "games": n,
+            "win_rate": wins / n,
+            "pick_rate": n / total_matches,
+            "ban_rate": bans.get(champion_id, 0) / total_matches,
+            "avg_kills": kills / n,
+            "avg_deaths": deaths / n,
+            "avg_assists": assists / n,
+            "kda": (kills + assists) / max(deaths, 1),
+        })
+    return rows
+
+
+def encode_history_cursor(game_start_ts: int, match_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{game_start_ts}:{match_id}".encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple[int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        game_start_ts, match_id = raw.split(":", 1)
+        return int(game_start_ts), match_id
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def get_match_history(
+    db: AsyncSession,
+    puuid: str,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    queue: Optional[int] = None,
+    champion: Optional[int] = None,
+) -> schemas.MatchHistoryPage:
+    """A player's stored games, newest first.
+
+    Keyset pagination on (game_start_ts, match_id) walks ix_mp_puuid_history, so
+    any page costs the same as the first one.
+    """
+    mp = MatchParticipant
+    stmt = (
+        select(
+            mp.match_id,
+            mp.game_start_ts,
+            mp.queue_id,
+            Matches.game_mode,
+            Matches.duration_sec,
+            mp.champion_id,
+            mp.champ_level,
+            mp.individual_position,
+            mp.win,
+            mp.kills,
+            mp.deaths,
+            mp.assists,
+            (mp.total_minions_killed + mp.neutral_minions_killed).label("cs"),
+            mp.gold_earned,
+            mp.total_damage_dealt_to_champions,
+            mp.vision_score,
+            mp.kill_participation,
+            mp.item0, mp.item1, mp.item2, mp.item3, mp.item4, mp.item5, mp.item6,
+            mp.summoner1_id,
+            mp.summoner2_id,
+        )
+        .join(Matches, (Matches.match_id == mp.match_id) & (Matches.game_start_ts == mp.game_start_ts))
+        .where(mp.puuid == puuid)
+    )
+    if queue is not None:
+        stmt = stmt.where(mp.queue_id == queue)
+    if champion is not None:
+        stmt = stmt.where(mp.champion_id == champion)
+    if cursor:
+        stmt = stmt.where(tuple_(mp.game_start_ts, mp.match_id) < tuple_(*decode_history_cursor(cursor)))
+    stmt = stmt.order_by(mp.game_start_ts.desc(), mp.match_id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(stmt)).mappings().all()
+    items = [schemas.MatchHistoryRow.model_validate(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_history_cursor(last.game_start_ts, last.match_id)
+    return schemas.MatchHistoryPage(items=items, next_cursor=next_cursor)
+
+
+async def get_player_champion_stats(db: AsyncSession, puuid: str, queue: Optional[int] = None) -> list[PlayerChampionStats]:
+    stmt = select(PlayerChampionStats).where(PlayerChampionStats.puuid == puuid)
+    if queue is not None:
+        stmt = stmt.where(PlayerChampionStats.queue_id == queue)
+    result = await db.execute(stmt.order_by(PlayerChampionStats.games.desc()))
+    return list(result.scalars())
+
+
+async def rebuild_player_champion_stats(db: AsyncSession):
+    """Recompute the whole rollup from match_participants (one-off backfill)."""
+    mp = MatchParticipant
+    position = func.coalesce(mp.individual_position, literal_column("''"))
+    rollup = (
+        select(
+            mp.puuid,
+            Matches.queue_id,
+            mp.champion_id,
+            position,
+            func.count(),
+            func.count().filter(mp.win),
+            func.sum(mp.kills),
+            func.sum(mp.deaths),
+            func.sum(mp.assists),
+            func.sum(mp.gold_earned),
+            func.sum(mp.total_damage_dealt_to_champions),
+            func.sum(mp.vision_score),
+            func.sum(mp.total_minions_killed + mp.neutral_minions_killed),
+            func.sum(Matches.duration_sec),
+            func.max(Matches.game_start_ts),
+        )
+        .join(Matches, (Matches.match_id == mp.match_id) & (Matches.game_start_ts == mp.game_start_ts))
+        .group_by(mp.puuid, Matches.queue_id, mp.champion_id, position)
+    )
+    await db.execute(delete(PlayerChampionStats))
+    await db.execute(
+        insert(PlayerChampionStats).from_select(
+            ["puuid", "queue_id", "champion_id", "individual_position", *_PLAYER_STAT_SUMS, "last_game_ts"],
+            rollup,
+        )
+    )
+    await db.commit()
+
 
+async def rebuild_champion_aggregates(db: AsyncSession):
+    """Recompute champion_role_stats, champion_ban_stats and patch_queue_totals (one-off backfill)."""
+    await db.execute(delete(ChampionRoleStats))
+    await db.execute(delete(ChampionBanStats))
+    await db.execute(delete(PatchQueueTotals))
+    await db.execute(text("""
+        INSERT INTO patch_queue_totals (patch, queue_id, matches)
+        SELECT split_part(game_version, '.', 1) || '.' || split_part(game_version, '.', 2), queue_id, count(*)
+        FROM matches GROUP BY 1, 2
+    """))
+    await db.execute(text("""
+        INSERT INTO champion_role_stats (patch, queue_id, champion_id, individual_position, games, wins, kills, deaths, assists)
+        SELECT split_part(m.game_version, '.', 1) || '.' || split_part(m.game_version, '.', 2), m.queue_id,
+               mp.champion_id, coalesce(mp.individual_position, ''),
+               count(*), count(*) FILTER (WHERE mp.win), sum(mp.kills), sum(mp.deaths), sum(mp.assists)
+        FROM match_participants mp JOIN matches m ON m."matchId" = mp.match_id AND m.game_start_ts = mp.game_start_ts
+        GROUP BY 1, 2, 3, 4
+    """))
+    await db.execute(text("""
+        INSERT INTO champion_ban_stats (patch, queue_id, champion_id, bans)
+        SELECT patch, queue_id, champion_id, count(*)
+        FROM (
+            SELECT DISTINCT m."matchId",
+                   split_part(m.game_version, '.', 1) || '.' || split_part(m.game_version, '.', 2) AS patch,
+                   m.queue_id, (b ->> 'championId')::int AS champion_id
+            FROM match_teams t
+            JOIN matches m ON m."matchId" = t.match_id
+            CROSS JOIN LATERAL jsonb_array_elements(t.bans) AS b
+        ) banned
+        WHERE champion_id <> -1
+        GROUP BY 1, 2, 3
+    """))
     await db.commit()
-    await db.refresh(match)
-    return match
+
+
+async def get_stored_match(db: AsyncSession, matchId: str) -> dict | None:
+    # Finished matches never change: one query (match + teams + players) instead of Riot
+    result = await db.execute(
+        select(Matches)
+        .options(joinedload(Matches.teams), joinedload(Matches.participants))
+        .where(Matches.match_id == matchId)
+    )
+    match = result.unique().scalar_one_or_none()
+    if match is None:
+        return None
+
+    return {
+        "match": MatchCreate.model_validate(match),
+        "teams": [MatchTeamCreate.model_validate(t) for t in sorted(match.teams, key=lambda t: t.team_id)],
+        "players": [
+            MatchParticipantCreate.model_validate(p)
+            for p in sorted(match.participants, key=lambda p: p.participant_id)
+        ],
+    }
 
 
 # -----------------------------
 # RIOT API 
 # -----------------------------
 async def get_puuid(gameName: str, tagLine: str, region: str = "americas") -> str:
-    url = f"https://{region}.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{gameName}/{tagLine}"
-    headers = {"X-Riot-Token": RIOT_API_KEY}
-    async with httpx.AsyncClient() as client:
-        puuid_response = await client.get(url, headers=headers)
-        if puuid_response.status_code == 200:
-            data = puuid_response.json()
-            return data["puuid"]
-        raise Exception(f"API error: {puuid_response.status_code} - {puuid_response.text}")
-
-
-async def fetch_summoner_from_riot(gameName: str, tagLine: str, region: str = "americas") -> dict:
-    headers = {"X-Riot-Token": RIOT_API_KEY}
-
-    async with httpx.AsyncClient() as client:
-        # Account info
-        account_url = f"https://{region}.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{gameName}/{tagLine}"
-        account_response = await client.get(account_url, headers=headers)
-        if account_response.status_code != 200:
-            raise Exception(f"Account API error: {account_response.status_code} - {account_response.text}")
-
-        account_data = account_response.json()
-        puuid = account_data["puuid"]
-
-        # Summoner region
-        get_region_url = f"https://{region}.api.riotgames.com/riot/account/v1/region/by-game/lol/by-puuid/{puuid}"
-        region_response = await client.get(get_region_url, headers=headers)
-        if region_response.status_code != 200:
-            raise Exception(f"Summoner region API error: {region_response.status_code} - {region_response.text}")
-
-        summoner_region = region_response.json()["region"]
-        print(summoner_region)
-        print(f"Región obtenida: {summoner_region}")
-
-        # Profile icon + level
-        summoner_level_icon_url = f"https://{summoner_region}.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}"
-        level_icon_response = await client.get(summoner_level_icon_url, headers=headers)
-        if level_icon_response.status_code != 200:
-            raise Exception(f"Summoner API error: {level_icon_response.status_code} - {level_icon_response.text}")
-
-        summoner_level_icon_data = level_icon_response.json()
-
-        return {
-            "puuid": account_data["puuid"],
-            "gameName": account_data["gameName"],
-            "tagLine": account_data["tagLine"],
-            "region": summoner_region,
-            "summonerLevel": summoner_level_icon_data["summonerLevel"],
-            "profileIcon": summoner_level_icon_data["profileIconId"],
-        }
+    puuid_response = await riot_get(region, f"/riot/account/v1/accounts/by-riot-id/{gameName}/{tagLine}", method="account-v1.by-riot-id")
+    if puuid_response.status_code == 200:
+        data = puuid_response.json()
+        return data["puuid"]
+    raise Exception(f"API error: {puuid_response.status_code} - {puuid_response.text}")
+
+
+async def fetch_summoner_from_riot(
+    gameName: str,
+    tagLine: str,
+    region: str = "americas",
+    priority: int = PRIORITY_INTERACTIVE,
+    known: Optional[schemas.RiotUserProfile] = None,
+) -> dict:
+    # Already stored: refresh by puuid on its platform (1 round trip)
+    if known is not None:
+        data = await fetch_summoner_by_puuid(known.puuid, region, priority, platform=known.region)
+        if _riot_id_key(data["gameName"], data["tagLine"]) == _riot_id_key(gameName, tagLine):
+            return data
+        # that account was renamed; the Riot ID now belongs to someone else (or no one)
+
+    # Account info
+    account_data = await _riot_json(region, f"/riot/account/v1/accounts/by-riot-id/{gameName}/{tagLine}", "account-v1.by-riot-id", priority, "Account")
+    summoner_region, summoner_data = await _locate_summoner(account_data["puuid"], region, priority)
+    return _summoner_dict(account_data, summoner_region, summoner_data)
+
+
+async def fetch_summoner_by_puuid(puuid: str, region: str = "americas", priority: int = PRIORITY_INTERACTIVE, platform: Optional[str] = None) -> dict:
+    account_data, (summoner_region, summoner_data) = await asyncio.gather(
+        _riot_json(region, f"/riot/account/v1/accounts/by-puuid/{puuid}", "account-v1.by-puuid", priority, "Account"),
+        _locate_summoner(puuid, region, priority, platform),
+    )
+    return _summoner_dict(account_data, summoner_region, summoner_data)
+
+
+def _summoner_dict(account_data: dict, summoner_region: str, summoner_data: dict) -> dict:
+    return {
+        "puuid": account_data["puuid"],
+        "gameName": account_data["gameName"],
+        "tagLine": account_data["tagLine"],
+        "region": summoner_region,
+        "summonerLevel": summoner_data["summonerLevel"],
+        "profileIcon": summoner_data["profileIconId"],
+    }
+
+
+async def _riot_json(host: str, path: str, method: str, priority: int, label: str) -> dict:
+    response = await riot_get(host, path, method=method, priority=priority)
+    if response.status_code != 200:
+        raise Exception(f"{label} API error: {response.status_code} - {response.text}")
+    return response.json()
+
+
+async def _summoner_on(platform: str, puuid: str, priority: int) -> dict | None:
+    # Profile icon + level (host de plataforma: la1, euw1, ...). None = not on that platform
+    response = await riot_get(platform, f"/lol/summoner/v4/summoners/by-puuid/{puuid}", method="summoner-v4.by-puuid", priority=priority)
+    if response.status_code == 404:
+        return None
+    if response.status_code != 200:
+        raise Exception(f"Summoner API error: {response.status_code} - {response.text}")
+    return response.json()
+
+
+async def _region_by_puuid(region: str, puuid: str, priority: int) -> str:
+    data = await _riot_json(region, f"/riot/account/v1/region/by-game/lol/by-puuid/{puuid}", "account-v1.region-by-puuid", priority, "Summoner region")
+    platform = data["region"].lower()
+    _platform_cache.set(puuid, platform)
+    _platform_hint[region.lower()] = platform
+    return platform
+
+
+async def _locate_summoner(puuid: str, region: str, priority: int, platform: Optional[str] = None) -> tuple[str, dict]:
+    """(platform, summoner-v4 body): 1 round trip if the platform is known, at most 2 otherwise."""
+    platform = (platform or _platform_cache.get(puuid) or "").lower()
+    if platform:
+        summoner_data = await _summoner_on(platform, puuid, priority)
+        if summoner_data is not None:
+            _platform_cache.set(puuid, platform)
+            return platform, summoner_data
+        _platform_cache.pop(puuid)  # transferred to another platform
+
+    # Resolve the platform, guessing in parallel that it's the last one seen in this routing region
+    hint = _platform_hint.get(region.lower())
+    if hint and hint != platform:
+        platform, guess = await asyncio.gather(
+            _region_by_puuid(region, puuid, priority),
+            _summoner_on(hint, puuid, priority),
+            return_exceptions=True,
+        )
+        if isinstance(platform, BaseException):
+            raise platform
+        if platform == hint:
+            if isinstance(guess, BaseException):
+                raise guess
+            if guess is not None:
+                return platform, guess
+    else:
+        platform = await _region_by_puuid(region, puuid, priority)
+
+    summoner_data = await _summoner_on(platform, puuid, priority)
+    if summoner_data is None:
+        raise Exception(f"Summoner API error: 404 - no summoner for {puuid} on {platform}")
+    return platform, summoner_data
 
 # -----------------------------
 # GET MATCH DATA FROM USER
 # -----------------------------
 
 async def get_match_data(matchId:str,routingRegion:str,db:AsyncSession):
-    url = f"https://{routingRegion}.api.riotgames.com/lol/match/v5/matches/{matchId}"
-    headers = {"X-Riot-Token": RIOT_API_KEY}
-    async with httpx.AsyncClient(timeout=20) as client:
-        match_data_req = await client.get(url,headers=headers)
-        match_data = match_data_req.json()
-        if "info" not in match_data or "metadata" not in match_data:
-            raise HTTPException(status_code=502, detail={"bad_payload": match_data})
-        info = match_data["info"]
-        meta = match_data["metadata"]
-
-        filtered_data ={
-            "matchId": meta["matchId"],
-            "platformId" : info["platformId"],
-            "queueId": info["queueId"],
-            "gameMode": info["gameMode"],
-            "gameVersion": info["gameVersion"],
-            "gameStartTimestamp": info["gameStartTimestamp"],
-            "gameDuration": info["gameDuration"],
+    key = ("match", matchId.strip().upper())
+    return await inflight.do(key, lambda: _load_match_data(matchId, routingRegion, db))
+
+
+async def _load_match_data(matchId:str,routingRegion:str,db:AsyncSession):
+    stored = await get_stored_match(db, matchId)
+    if stored is not None:
+        return stored
+
+    match_data = await fetch_match_payload(matchId, routingRegion)
+    match_schema, team_schemas, players_schemas = await parse_match_payload(match_data)
+    await save_match(db, match_schema, team_schemas, players_schemas)
+
+    return {
+            "match": match_schema,
+            "teams": team_schemas,
+            "players": players_schemas
+        }
+
+
+async def fetch_match_payload(matchId: str, routingRegion: str, priority: int = PRIORITY_INTERACTIVE) -> RiotMatch:
+    match_data_req = await riot_get(routingRegion, f"/lol/match/v5/matches/{matchId}", method="match-v5.match", priority=priority)
+    if match_data_req.status_code != 200:
+        raise HTTPException(status_code=match_data_req.status_code, detail=match_data_req.text)
+    try:
+        return decode_match(match_data_req.content)
+    except ValidationError:
+        try:
+            bad_payload = match_data_req.json()
+        except ValueError:
+            bad_payload = match_data_req.text
+        raise HTTPException(status_code=502, detail={"bad_payload": bad_payload})
+
+
+async def parse_match_payload(match_data: RiotMatch) -> tuple[MatchCreate, list[MatchTeamCreate], list[MatchParticipantCreate]]:
+    return parse_match(match_data)
+
+
+async def ingest_matches(
+    db: AsyncSession,
+    puuid: str,
+    routingRegion: str,
+    match_ids: Optional[list[str]] = None,
+    count: int = 20,
+    queue: Optional[int] = None,
+) -> dict:
+    """Backfill many matches: skip stored ids, fetch the rest concurrently and
+    write them in bulk, one transaction per INGEST_BATCH_SIZE matches."""
+    if not match_ids:
+        match_ids = await fetch_get_matches(puuid=puuid, region=routingRegion, num_matches=count, queue=queue)
+    match_ids = list(dict.fromkeys(match_ids))
+
+    result = await db.execute(select(Matches.match_id).where(Matches.match_id.in_(match_ids)))
+    existing = set(result.scalars())
+    await db.commit()  # give the connection back to the pool while Riot is fetched
+    todo = [m for m in match_ids if m not in existing]
+
+    sem = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+    async def fetch(mid: str):
+        async with sem:
+            try:
+                payload = await fetch_match_payload(mid, routingRegion, priority=PRIORITY_BACKGROUND)
+                return mid, await parse_match_payload(payload), None
+            except HTTPException as e:
+                return mid, None, f"{e.status_code}: {e.detail}"
+            except Exception as e:
+                return mid, None, str(e)
+
+    ingested: list[str] = []
+    failed: dict[str, str] = {}
+    pending: list = []
+
+    async def flush():
+        if not pending:
+            return
+        try:
+            saved = set(await save_matches_bulk(db, pending))
+            await db.commit()
+            await invalidate_profiles([p.puuid for _, _, players in pending for p in players])
+            ingested.extend(m.match_id for m, _, _ in pending if m.match_id in saved)
+            analytics.engine.add_matches([m for m in pending if m[0].match_id in saved])
+        except Exception as e:
+            await db.rollback()
+            for m, _, _ in pending:
+                failed[m.match_id] = str(e)
+        pending.clear()
+
+    for next_done in asyncio.as_completed([fetch(m) for m in todo]):
+        mid, parsed, error = await next_done
+        if error is not None:
+            failed[mid] = error
+            continue
+        pending.append(parsed)
+        if len(pending) >= INGEST_BATCH_SIZE:
+            await flush()
+    await flush()
+
+    return {
+        "requested": len(match_ids),
+        "skipped": [m for m in match_ids if m in existing],
+        "ingested": ingested,
+        "failed": failed,
     }
-        match_schema = MatchCreate.model_validate(filtered_data)
-        team_schemas =  await filter_match_team(match_data)
-        players_schemas = await filter_participants_match_data(match_data)
-        await upsert_profiles_from_match(db, match_data, routingRegion)
-        await db.flush()
-        await save_match(db, match_schema, team_schemas, players_schemas)
-
-        return {
-                "match": match_schema,
-                "teams": team_schemas,
-                "players": players_schemas
-            }
-
-
-async def filter_match_team(raw_data:dict) -> list[MatchTeamCreate]:
-    info = raw_data["info"]
-    meta = raw_data["metadata"]
-    match_id = meta["matchId"]
-
-    # KDA por team desde participants
-    acc = defaultdict(lambda: {"kills": 0, "deaths": 0, "assists": 0})
-    for p in info["participants"]:
-        tid = p["teamId"]
-        acc[tid]["kills"] += p.get("kills", 0)
-        acc[tid]["deaths"] += p.get("deaths", 0)
-        acc[tid]["assists"] += p.get("assists", 0)
 
-    rows = []
-    for t in info["teams"]:
-        tid = t["teamId"]
-        obj = t["objectives"]
-
-        rows.append(MatchTeamCreate(
-            match_id=match_id,
-            team_id=tid,
-            win=bool(t.get("win", False)),
-
-            kills=acc[tid]["kills"],
-            deaths=acc[tid]["deaths"],
-            assists=acc[tid]["assists"],
-
-            baron_kills=obj["baron"]["kills"],
-            dragon_kills=obj["dragon"]["kills"],
-            herald_kills=obj["riftHerald"]["kills"],
-            tower_kills=obj["tower"]["kills"],
-            inhib_kills=obj["inhibitor"]["kills"],
-
-            bans=t.get("bans", [])
-            #Bans list are like this
-            # {
-            #   "Champion id"
-            #   "Pick Turn"
-            #} 
-        ))
-    return rows
 
-async def filter_participants_match_data(raw_data: dict) -> list[MatchParticipantCreate]:
-    participants_models = []
-
-    for p in raw_data["info"]["participants"]:
-
-        pos = p.get("individualPosition") or ""
-        pos = pos.upper()
-
-        allowed = {"TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY", "INVALID", ""}
-        if pos not in allowed:
-            pos = "INVALID"
-
-        mp = MatchParticipantCreate(
-            match_id=raw_data["metadata"]["matchId"],
-            puuid=p["puuid"],
-            riot_id_name=p["riotIdGameName"],
-            riot_id_tagline=p["riotIdTagline"],
-            participant_id=p["participantId"],
-            team_id=p["teamId"],
-            win=p["win"],
-
-            champion_id=p["championId"],
-            champ_level=p["champLevel"],
-
-            individual_position=pos,
-            team_position=(p.get("teamPosition") or "").upper(),
-
-            kills=p["kills"],
-            deaths=p["deaths"],
-            assists=p["assists"],
-            killing_sprees=p["killingSprees"],
-            double_kills=p["doubleKills"],
-            triple_kills=p["tripleKills"],
-            quadra_kills=p["quadraKills"],
-            penta_kills=p["pentaKills"],
-
-            gold_earned=p["goldEarned"],
-            gold_spent=p["goldSpent"],
-            total_minions_killed=p["totalMinionsKilled"],
-            neutral_minions_killed=p["neutralMinionsKilled"],
-
-            total_damage_dealt_to_champions=p["totalDamageDealtToChampions"],
-            physical_damage_dealt_to_champions=p["physicalDamageDealtToChampions"],
-            magic_damage_dealt_to_champions=p["magicDamageDealtToChampions"],
-            true_damage_dealt_to_champions=p["trueDamageDealtToChampions"],
-            total_damage_taken=p["totalDamageTaken"],
-            damage_self_mitigated=p["damageSelfMitigated"],
-
-            damage_dealt_to_objectives=p["damageDealtToObjectives"],
-            damage_dealt_to_turrets=p["damageDealtToTurrets"],
-            turret_takedowns=p["turretTakedowns"],
-            inhibitor_takedowns=p["inhibitorTakedowns"],
-            dragon_kills=p["dragonKills"],
-            baron_kills=p["baronKills"],
-
-            vision_score=p["visionScore"],
-            wards_placed=p["wardsPlaced"],
-            wards_killed=p["wardsKilled"],
-            detector_wards_placed=p["detectorWardsPlaced"],
-            kill_participation = p["challenges"].get("killParticipation", 0) * 100,
-
-            item0=p["item0"],
-            item1=p["item1"],
-            item2=p["item2"],
-            item3=p["item3"],
-            item4=p["item4"],
-            item5=p["item5"],
-            item6=p["item6"],
-
-            summoner1_id=p["summoner1Id"],
-            summoner2_id=p["summoner2Id"],
+@dataclass
+class MatchIdIndex:
+    ids: list[str]  # newest first
+    fetched_at: datetime
+    complete: bool  # Riot has no older ids than these
+
+
+_match_id_cache = Cache("match_ids", TypedCodec(MatchIdIndex), MATCH_ID_CACHE_SIZE)
+
+
+async def fetch_get_matches(
+    puuid: str,
+    region: str,
+    num_matches: int = 20,
+    queue: Optional[str] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    max_age: timedelta = MATCH_FETCH_TTL,
+) -> list:
+    """Newest match ids of a player. The cached list is refreshed once it is older than `max_age`."""
+    index = await _match_id_cache.get((puuid, queue))
+    if index is not None and not _match_ids_stale(index, max_age) and (len(index.ids) >= num_matches or index.complete):
+        return index.ids[:num_matches]
+    flight = ("match_ids", puuid, queue)
+    refresh = lambda: _refresh_match_ids(puuid, region, num_matches, queue, priority, max_age)
+    index = await inflight.do(flight, refresh)
+    if len(index.ids) < num_matches and not index.complete:
+        # joined a refresh for fewer ids than we need; extend once, then return what there is
+        index = await inflight.do(flight, refresh)
+    return index.ids[:num_matches]
+
+
+def _match_ids_stale(index: MatchIdIndex, max_age: timedelta = MATCH_FETCH_TTL) -> bool:
+    return datetime.now(timezone.utc) - index.fetched_at > max_age
+
+
+async def _refresh_match_ids(
+    puuid: str,
+    region: str,
+    num_matches: int,
+    queue: Optional[str],
+    priority: int = PRIORITY_INTERACTIVE,
+    max_age: timedelta = MATCH_FETCH_TTL,
+) -> MatchIdIndex:
+    key = (puuid, queue)
+    now = datetime.now(timezone.utc)
+    index = await _match_id_cache.get(key)
+
+    if index is None:
+        ids = await _fetch_match_id_pages(puuid, region, queue, start=0, count=num_matches, priority=priority)
+        index = MatchIdIndex(ids=ids, fetched_at=now, complete=len(ids) < num_matches)
+    elif _match_ids_stale(index, max_age):
+        # only what is newer than the cached head
+        since = int((index.fetched_at - MATCH_ID_REFRESH_OVERLAP).timestamp())
+        newest = index.ids[0] if index.ids else None
+        new_ids = await _fetch_match_id_pages(puuid, region, queue, start=0, start_time=since, stop_at=newest, priority=priority)
+        known = set(index.ids)
+        index = MatchIdIndex(
+            ids=[m for m in new_ids if m not in known] + index.ids,
+            fetched_at=now,
+            complete=index.complete,
         )
 
-        participants_models.append(mp)
-
-    return participants_models
+    if len(index.ids) < num_matches and not index.complete:
+        missing = num_matches - len(index.ids)
+        older = await _fetch_match_id_pages(puuid, region, queue, start=len(index.ids), count=missing, priority=priority)
+        known = set(index.ids)
+        added = [m for m in older if m not in known]
+        index = MatchIdIndex(
+            ids=index.ids + added,
+            fetched_at=index.fetched_at,
+            complete=len(older) < missing or not added,
+        )
 
-async def fetch_get_matches(puuid: str, region: str,num_matches: int = 20 , queue: Optional[str] = None) -> list:
-    url = f"https://{region}.api.riotgames.com/lol/match/v5/matches/by-puuid/{puuid}/ids"
-    headers = {"X-Riot-Token": RIOT_API_KEY}
-    params : dict = {"count": num_matches}
-    if queue is not None:
-        params["queue"] = queue
-    async with httpx.AsyncClient(timeout=20) as client:
-        summoner_matches_ids_req = await client.get(url,headers=headers,params=params)
+    await _match_id_cache.set(key, index)
+    return index
+
+
+async def _fetch_match_id_pages(
+    puuid: str,
+    region: str,
+    queue: Optional[str],
+    start: int,
+    count: Optional[int] = None,
+    start_time: Optional[int] = None,
+    stop_at: Optional[str] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> list[str]:
+    """Page through by-puuid ids until `count` ids, a short page, or `stop_at` is seen."""
+    ids: list[str] = []
+    while count is None or len(ids) < count:
+        page_size = MATCH_ID_PAGE_SIZE if count is None else min(MATCH_ID_PAGE_SIZE, count - len(ids))
+        params : dict = {"start": start + len(ids), "count": page_size}
+        if queue is not None:
+            params["queue"] = queue
+        if start_time is not None:
+            params["startTime"] = start_time
+        summoner_matches_ids_req = await riot_get(region, f"/lol/match/v5/matches/by-puuid/{puuid}/ids", method="match-v5.ids-by-puuid", params=params, priority=priority)
         if summoner_matches_ids_req.status_code != 200:
              raise Exception(f"Summoner API error: {summoner_matches_ids_req.status_code} - {summoner_matches_ids_req.text}")
-        data = summoner_matches_ids_req.json()
-        return data
+        page = summoner_matches_ids_req.json()
+        ids.extend(page)
+        if len(page) < page_size or (stop_at is not None and stop_at in page):
+            break
+    return ids
+
+
+
+async def get_summoner_entries(puuid:str,region:str = "la1", priority: int = PRIORITY_INTERACTIVE) -> list[dict]:
+    summoner_entries_request = await riot_get(region, f"/lol/league/v4/entries/by-puuid/{puuid}", method="league-v4.entries-by-puuid", priority=priority)
+    if summoner_entries_request.status_code != 200:
+         raise HTTPException(
+    status_code=summoner_entries_request.status_code,
+    detail=summoner_entries_request.text
+)
+    data = summoner_entries_request.json()
+    return data
+
+
+# -----------------------------
+# RANKED (stored league entries)
+# -----------------------------
+RankedState = tuple[datetime, list[schemas.RankedEntry]]  # (synced_at, entries)
+
+_ranked_cache = Cache("ranked", TypedCodec(RankedState), RANKED_CACHE_SIZE)
+_ranked_refresh_queued = LRUCache(RANKED_CACHE_SIZE, ttl=RANKED_TTL.total_seconds())
+
+
+def _ranked_is_stale(synced_at: datetime) -> bool:
+    return datetime.now(timezone.utc) - synced_at > RANKED_TTL
+
+
+async def get_ranked_entries(db: AsyncSession, puuid: str, region: str = "la1") -> RankedState:
+    """Stored entries; a stale answer is returned as-is and a background refresh is queued.
 
+    Only a player we never fetched waits on Riot.
+    """
+    state = await _ranked_cache.get(puuid)
+    if state is None:
+        state = await _load_ranked(db, puuid)
+    if state is None:
+        return await refresh_ranked(db, puuid, region)
+    if _ranked_is_stale(state[0]) and puuid not in _ranked_refresh_queued:
+        _ranked_refresh_queued.set(puuid, True)
+        await jobs.enqueue(db, "refresh_ranked", {"puuids": [puuid], "region": region}, dedupe_key=f"refresh_ranked:{puuid}")
+    return state
 
 
-async def get_summoner_entries(puuid:str,region:str = "la1"):
-    headers = {"X-Riot-Token": RIOT_API_KEY}
-    async with httpx.AsyncClient(timeout=20) as client:
-        url = f"https://{region}.api.riotgames.com/lol/league/v4/entries/by-puuid/{puuid}"
-        summoner_entries_request = await client.get(url,headers=headers)
-        if summoner_entries_request.status_code != 200:
-             raise HTTPException(
-        status_code=summoner_entries_request.status_code,
-        detail=summoner_entries_request.text
+async def _load_ranked(db: AsyncSession, puuid: str) -> RankedState | None:
+    synced_at = (await db.execute(
+        select(RankedSync.synced_at).where(RankedSync.puuid == puuid)
+    )).scalar_one_or_none()
+    if synced_at is None:
+        return None
+    result = await db.execute(
+        select(RankedEntry).where(RankedEntry.puuid == puuid).order_by(RankedEntry.queue_type)
     )
-        data = summoner_entries_request.json()
-        return data
\ No newline at end of file
+    state = (synced_at, [schemas.RankedEntry.model_validate(e) for e in result.scalars()])
+    await _cache_ranked(puuid, state)
+    return state
+
+
+async def _cache_ranked(puuid: str, state: RankedState):
+    # Kept until it goes stale, then re-read from the DB (shortly) so a refresh
+    # done by a worker in another process is picked up
+    remaining = RANKED_TTL - (datetime.now(timezone.utc) - state[0])
+    await _ranked_cache.set(puuid, state, ttl=max(remaining, RANKED_STALE_RECHECK).total_seconds())
+
+
+async def refresh_ranked(db: AsyncSession, puuid: str, region: str = "la1", priority: int = PRIORITY_INTERACTIVE) -> RankedState:
+    states, _ = await inflight.do(("ranked", puuid), lambda: refresh_ranked_many(db, [puuid], region, priority))
+    return states[puuid]
+
+
+async def refresh_ranked_many(
+    db: AsyncSession,
+    puuids: list[str],
+    region: str = "la1",
+    priority: int = PRIORITY_BACKGROUND,
+) -> tuple[dict[str, RankedState], dict[str, str]]:
+    """Fetch league entries for many players of one platform and store them in one transaction.
+
+    Returns (states, failed). A player whose fetch failed keeps its stored entries and is
+    reported in `failed`; if every player failed, the first error is raised instead."""
+    semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+    async def fetch(puuid: str):
+        async with semaphore:
+            return await get_summoner_entries(puuid, region, priority)
+
+    puuids = list(dict.fromkeys(puuids))
+    results = await asyncio.gather(*(fetch(p) for p in puuids), return_exceptions=True)
+    fetched: dict[str, list[dict]] = {}
+    failed: dict[str, str] = {}
+    first_error = None
+    for puuid, result in zip(puuids, results):
+        if isinstance(result, HTTPException):
+            failed[puuid] = f"{result.status_code}: {result.detail}"
+        elif isinstance(result, Exception):
+            failed[puuid] = str(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            fetched[puuid] = result
+            continue
+        first_error = first_error or result
+    if first_error is not None and not fetched:
+        raise first_error
+    if failed:
+        logger.warning("ranked refresh on %s: %s of %s players failed", region, len(failed), len(puuids))
+    return await save_ranked_entries(db, region, fetched), failed
+
+
+async def save_ranked_entries(db: AsyncSession, region: str, fetched: dict[str, list[dict]]) -> dict[str, RankedState]:
+    """Replace stored entries, append a snapshot where the standing changed, mark players synced. Commits."""
+    if not fetched:
+        return {}
+    now = datetime.now(timezone.utc)
+    puuids = sorted(fetched)  # deterministic lock order
+
+    current = {
+        (e.puuid, e.queue_type): e
+        for e in (await db.execute(select(RankedEntry).where(RankedEntry.puuid.in_(puuids)))).scalars()
+    }
+
+    rows, snapshots = [], []
+    for puuid in puuids:
+        for raw in fetched[puuid]:
+            entry = schemas.RankedEntry.model_validate({**raw, "puuid": puuid, "lastUpdated": now})
+            row = entry.model_dump()
+            rows.append(row)
+            previous = current.get((puuid, entry.queue_type))
+            if previous is None or any(getattr(previous, k) != row[k] for k in _RANKED_STANDING):
+                snapshots.append({"puuid": puuid, "queue_type": entry.queue_type, "captured_at": now, **{k: row[k] for k in _RANKED_STANDING}})
+    rows.sort(key=lambda r: (r["puuid"], r["queue_type"]))
+
+    kept = {(r["puuid"], r["queue_type"]) for r in rows}
+    gone = [key for key in current if key not in kept]
+    if gone:
+        await db.execute(delete(RankedEntry).where(tuple_(RankedEntry.puuid, RankedEntry.queue_type).in_(gone)))
+    if rows:
+        stmt = insert(RankedEntry).values(rows)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["puuid", "queue_type"],
+            set_={c: stmt.excluded[c] for c in rows[0] if c not in ("puuid", "queue_type")},
+        ))
+    if snapshots:
+        await db.execute(insert(RankedSnapshot).values(snapshots))
+
+    stmt = insert(RankedSync).values([{"puuid": p, "platform": region.lower(), "synced_at": now} for p in puuids])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=["puuid"],
+        set_={"platform": stmt.excluded.platform, "synced_at": stmt.excluded.synced_at},
+    ))
+    await db.commit()
+
+    states = {}
+    for puuid in puuids:
+        entries = [schemas.RankedEntry.model_validate(r) for r in rows if r["puuid"] == puuid]
+        states[puuid] = (now, entries)
+        _ranked_refresh_queued.pop(puuid)
+    # all synced just now: fresh for the whole RANKED_TTL
+    await _ranked_cache.set_many(states, ttl=RANKED_TTL.total_seconds())
+    return states
+
+
+async def get_ranked_history(db: AsyncSession, puuid: str, queue_type: Optional[str] = None, limit: int = 100) -> list[RankedSnapshot]:
+    stmt = select(RankedSnapshot).where(RankedSnapshot.puuid == puuid)
+    if queue_type is not None:
+        stmt = stmt.where(RankedSnapshot.queue_type == queue_type)
+    result = await db.execute(stmt.order_by(RankedSnapshot.captured_at.desc()).limit(limit))
+    return list(result.scalars())
@@ -0,0 +1,398 @@
+"""Tracked players: new matches are polled for and ingested in the background.
+
+Players are kept in one heap per routing region, ordered by when they are due.
+A player is polled again TRACKER_MIN_INTERVAL after a new match was seen, and
+each idle poll multiplies the interval by TRACKER_BACKOFF (up to
+TRACKER_MAX_INTERVAL), so the quota goes to accounts that are playing.
+
+Polls run at background priority and are paced to TRACKER_RATE_SHARE of the
+region's app rate limit, counting the match fetches their ingestion triggers.
+State is written back in batches. Players with new matches get a league-v4
+refresh job, batched per platform.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import jobs
+import services
+from db import SessionLocal
+from metrics import TRACKER_PLAYERS, TRACKER_POLL_DELAY, TRACKER_POLLS
+from models import RiotUserProfile, TrackedPlayer
+from rate_limiter import PRIORITY_BACKGROUND, rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Run the poller in this process (the API or `python worker.py`); one process per shard
+TRACKER_ENABLED = os.getenv("TRACKER_ENABLED", "0").lower() in ("1", "true", "yes")
+# "i/n": this process polls the players with crc32(puuid) % n == i
+TRACKER_SHARD = os.getenv("TRACKER_SHARD", "0/1")
+# Seconds between polls: the minimum right after a new match, times the backoff per idle poll
+TRACKER_MIN_INTERVAL = int(os.getenv("TRACKER_MIN_INTERVAL", "300"))
+TRACKER_MAX_INTERVAL = int(os.getenv("TRACKER_MAX_INTERVAL", str(6 * 3600)))
+TRACKER_BACKOFF = float(os.getenv("TRACKER_BACKOFF", "2"))
+# Share of each region's app rate limit the polls and their ingestion may use
+TRACKER_RATE_SHARE = float(os.getenv("TRACKER_RATE_SHARE", "0.25"))
+# Polls in flight per region
+TRACKER_CONCURRENCY = int(os.getenv("TRACKER_CONCURRENCY", "4"))
+# Newest match ids looked at per poll
+TRACKER_MATCH_COUNT = 20
+# Poll state is written in batches; players (un)registered by other processes show up on reload
+TRACKER_FLUSH_INTERVAL = 10.0
+TRACKER_RELOAD_INTERVAL = float(os.getenv("TRACKER_RELOAD_INTERVAL", "300"))
+# Players per league-v4 refresh job
+TRACKER_RANKED_BATCH = 50
+# Polls are spread by +-10% so players registered together drift apart
+_JITTER = 0.1
+
+
+def _parse_shard(value: str) -> tuple[int, int]:
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count or 1)
+    if not 0 <= index < count:
+        raise ValueError(f"TRACKER_SHARD must be i/n with 0 <= i < n, got {value!r}")
+    return index, count
+
+
+# -----------------------------
+# Registration
+# -----------------------------
+async def track_players(db: AsyncSession, puuids: list[str], region: str) -> list[TrackedPlayer]:
+    """Register players (or move them to another region) and commit. They are due right away."""
+    region = region.lower()
+    puuids = sorted(set(puuids))  # deterministic lock order
+    stmt = insert(TrackedPlayer).values([
+        {"puuid": puuid, "region": region, "poll_interval": TRACKER_MIN_INTERVAL} for puuid in puuids
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["puuid"],
+        set_={"region": stmt.excluded.region},
+        where=TrackedPlayer.region != stmt.excluded.region,
+    )
+    await db.execute(stmt)
+    result = await db.execute(select(TrackedPlayer).where(TrackedPlayer.puuid.in_(puuids)))
+    rows = list(result.scalars())
+    await db.commit()
+    if tracker.running:
+        for row in rows:
+            tracker.add(row.puuid, row.region, row.poll_interval, row.last_match_id)
+    return rows
+
+
+async def untrack_player(db: AsyncSession, puuid: str) -> bool:
+    result = await db.execute(delete(TrackedPlayer).where(TrackedPlayer.puuid == puuid))
+    await db.commit()
+    tracker.remove(puuid)
+    return result.rowcount > 0
+
+
+async def get_tracked_player(db: AsyncSession, puuid: str) -> TrackedPlayer | None:
+    return await db.get(TrackedPlayer, puuid)
+
+
+# -----------------------------
+# Scheduler
+# -----------------------------
+@dataclass(slots=True)
+class _Player:
+    puuid: str
+    region: str
+    interval: int
+    last_match_id: Optional[str]
+    # heap entries from before a re-registration carry an older generation and are skipped
+    generation: int = 0
+
+
+class _Budget:
+    """Paces one region's Riot calls to TRACKER_RATE_SHARE of its app limit."""
+
+    def __init__(self, region: str):
+        self.lane = rate_limiter.lane(region)
+        self._next = 0.0
+
+    def rate(self) -> float:
+        # the tightest app window, as synced from Riot's headers
+        per_second = min((count / seconds for count, seconds in self.lane.app.limits), default=1.0)
+        return max(per_second * TRACKER_RATE_SHARE, 0.001)
+
+    def charge(self, requests: int):
+        now = asyncio.get_running_loop().time()
+        self._next = max(self._next, now) + requests / self.rate()
+
+    async def take(self):
+        """Wait for this region's next slot and spend it."""
+        delay = self._next - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.charge(1)
+
+
+class Tracker:
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self.shard, self.shards = _parse_shard(TRACKER_SHARD)
+        self.running = False
+        self._players: dict[str, _Player] = {}
+        self._heaps: dict[str, list[tuple[float, int, str, int]]] = {}
+        self._wakeups: dict[str, asyncio.Event] = {}
+        self._region_tasks: dict[str, asyncio.Task] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._polls: set[asyncio.Task] = set()
+        self._dirty: dict[str, dict] = {}
+        self._ranked_due: set[str] = set()
+        self._seq = itertools.count()
+
+    def owns(self, puuid: str) -> bool:
+        return self.shards == 1 or zlib.crc32(puuid.encode()) % self.shards == self.shard
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    async def start(self):
+        self.running = True
+        await self.reload()
+        self._tasks = [asyncio.create_task(self._reload_loop()), asyncio.create_task(self._flush_loop())]
+        logger.info("tracker: %s players (shard %s/%s)", len(self._players), self.shard, self.shards)
+
+    async def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        tasks = [*self._tasks, *self._region_tasks.values(), *self._polls]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks, self._region_tasks = [], {}
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("tracker: final flush failed")
+
+    # -----------------------------
+    # Heap
+    # -----------------------------
+    def add(self, puuid: str, region: str, interval: int, last_match_id: Optional[str], due_in: float = 0.0):
+        """Schedule a player (again); replaces any earlier schedule for it."""
+        if not self.owns(puuid):
+            return
+        previous = self._players.get(puuid)
+        if previous is not None and previous.region != region:
+            TRACKER_PLAYERS.labels(previous.region).dec()
+        if previous is None or previous.region != region:
+            TRACKER_PLAYERS.labels(region).inc()
+        player = _Player(puuid, region, interval, last_match_id, previous.generation + 1 if previous else 0)
+        self._players[puuid] = player
+        self._push(player, due_in)
+
+    def remove(self, puuid: str):
+        player = self._players.pop(puuid, None)
+        if player is not None:
+            TRACKER_PLAYERS.labels(player.region).dec()
+        self._dirty.pop(puuid, None)
+        self._ranked_due.discard(puuid)
+
+    def _push(self, player: _Player, due_in: float):
+        heap = self._heaps.setdefault(player.region, [])
+        due = asyncio.get_running_loop().time() + max(due_in, 0.0)
+        entry = (due, next(self._seq), player.puuid, player.generation)
+        heapq.heappush(heap, entry)
+        if player.region not in self._region_tasks and self.running:
+            self._wakeups[player.region] = asyncio.Event()
+            self._region_tasks[player.region] = asyncio.create_task(self._run_region(player.region))
+        elif heap[0] is entry and player.region in self._wakeups:
+            # earlier than what the region loop sleeps on
+            self._wakeups[player.region].set()
+
+    async def _run_region(self, region: str):
+        heap = self._heaps[region]
+        wakeup = self._wakeups[region]
+        budget = _Budget(region)
+        slots = asyncio.Semaphore(TRACKER_CONCURRENCY)
+        loop = asyncio.get_running_loop()
+        while True:
+            wakeup.clear()
+            if not heap:
+                await wakeup.wait()
+                continue
+            due, _, puuid, generation = heap[0]
+            delay = due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(heap)
+            player = self._players.get(puuid)
+            if player is None or player.generation != generation or player.region != region:
+                continue  # removed or rescheduled since
+            await slots.acquire()
+            await budget.take()
+            TRACKER_POLL_DELAY.labels(region).observe(max(loop.time() - due, 0.0))
+            task = asyncio.create_task(self._poll(player, budget))
+            self._polls.add(task)
+
+            def done(task: asyncio.Task):
+                slots.release()
+                self._polls.discard(task)
+
+            task.add_done_callback(done)
+
+    # -----------------------------
+    # Polling
+    # -----------------------------
+    async def _poll(self, player: _Player, budget: _Budget):
+        now = datetime.now(timezone.utc)
+        new_ids: list[str] = []
+        last_match_id = player.last_match_id
+        result = "idle"
+        try:
+            # max_age 0: always ask Riot; against the cached list that is a single startTime page
+            ids = await services.fetch_get_matches(
+                player.puuid, player.region, TRACKER_MATCH_COUNT,
+                priority=PRIORITY_BACKGROUND, max_age=timedelta(0),
+            )
+            new_ids = list(itertools.takewhile(lambda m: m != player.last_match_id, ids))
+            if new_ids:
+                result = "new"
+                budget.charge(len(new_ids))
+                async with self.session_factory() as db:
+                    ingested = await services.ingest_matches(db, player.puuid, player.region, match_ids=new_ids)
+                if ingested["failed"]:
+                    # keep the old head, so the next (fast) poll retries them
+                    logger.warning("tracker: %s: %s of %s new matches failed", player.puuid, len(ingested["failed"]), len(new_ids))
+                else:
+                    last_match_id = ids[0]
+        except HTTPException as e:
+            result = "error"
+            logger.warning("tracker: poll of %s failed: %s %s", player.puuid, e.status_code, e.detail)
+        except Exception as e:
+            result = "error"
+            logger.warning("tracker: poll of %s failed: %r", player.puuid, e)
+        TRACKER_POLLS.labels(player.region, result).inc()
+
+        if self._players.get(player.puuid) is not player:
+            return  # removed or re-registered while polling
+        if result == "new":
+            interval = TRACKER_MIN_INTERVAL
+            self._ranked_due.add(player.puuid)
+        else:
+            interval = min(int(player.interval * TRACKER_BACKOFF), TRACKER_MAX_INTERVAL)
+        interval = max(interval, TRACKER_MIN_INTERVAL)
+        due_in = interval * random.uniform(1 - _JITTER, 1 + _JITTER)
+        player.interval = interval
+        player.last_match_id = last_match_id
+        self._push(player, due_in)
+        # an unflushed earlier poll may have seen the new match
+        seen = now if result == "new" else self._dirty.get(player.puuid, {}).get("b_seen")
+        self._dirty[player.puuid] = {
+            "b_puuid": player.puuid,
+            "b_interval": interval,
+            "b_next": now + timedelta(seconds=due_in),
+            "b_polled": now,
+            "b_last_match": last_match_id,
+            "b_seen": seen,
+        }
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+    async def reload(self):
+        """Sync with tracked_players: schedule new players, drop unregistered ones."""
+        columns = (
+            TrackedPlayer.puuid, TrackedPlayer.region, TrackedPlayer.poll_interval,
+            TrackedPlayer.next_poll_at, TrackedPlayer.last_match_id,
+        )
+        async with self.session_factory() as db:
+            rows = [row for row in (await db.execute(select(*columns))).all() if self.owns(row.puuid)]
+        now = datetime.now(timezone.utc)
+        seen = set()
+        for row in rows:
+            seen.add(row.puuid)
+            known = self._players.get(row.puuid)
+            if known is not None and known.region == row.region:
+                continue  # our in-memory state is newer
+            due_in = (row.next_poll_at - now).total_seconds()
+            self.add(row.puuid, row.region.lower(), row.poll_interval, row.last_match_id, due_in)
+        for puuid in [p for p in self._players if p not in seen]:
+            self.remove(puuid)
+
+    async def flush(self):
+        """Write back poll state and queue league-v4 refreshes for players with new matches."""
+        dirty, self._dirty = list(self._dirty.values()), {}
+        ranked_due, self._ranked_due = sorted(self._ranked_due), set()
+        if not dirty and not ranked_due:
+            return
+        try:
+            await self._write(dirty, ranked_due)
+        except BaseException:
+            # retried on the next flush, unless a newer poll replaced them
+            for row in dirty:
+                self._dirty.setdefault(row["b_puuid"], row)
+            self._ranked_due.update(ranked_due)
+            raise
+
+    async def _write(self, dirty: list[dict], ranked_due: list[str]):
+        async with self.session_factory() as db:
+            if dirty:
+                dirty.sort(key=lambda row: row["b_puuid"])  # deterministic lock order
+                table = TrackedPlayer.__table__
+                stmt = (
+                    update(table)
+                    .where(table.c.puuid == bindparam("b_puuid"))
+                    .values(
+                        poll_interval=bindparam("b_interval"),
+                        next_poll_at=bindparam("b_next"),
+                        last_polled_at=bindparam("b_polled"),
+                        last_match_id=bindparam("b_last_match"),
+                        last_match_seen_at=func.coalesce(bindparam("b_seen"), table.c.last_match_seen_at),
+                    )
+                )
+                await db.execute(stmt, dirty)
+                await db.commit()
+            if ranked_due:
+                await self._queue_ranked(db, ranked_due)
+
+    async def _queue_ranked(self, db: AsyncSession, puuids: list[str]):
+        # the match upsert stored every participant's platform
+        result = await db.execute(
+            select(RiotUserProfile.puuid, RiotUserProfile.region).where(RiotUserProfile.puuid.in_(puuids))
+        )
+        by_platform: dict[str, list[str]] = {}
+        for puuid, platform in result.all():
+            if platform:
+                by_platform.setdefault(platform.lower(), []).append(puuid)
+        for platform, members in by_platform.items():
+            for i in range(0, len(members), TRACKER_RANKED_BATCH):
+                await jobs.enqueue(db, "refresh_ranked", {"puuids": members[i:i + TRACKER_RANKED_BATCH], "region": platform})
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(TRACKER_RELOAD_INTERVAL)
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("tracker: reload failed")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(TRACKER_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("tracker: flush failed")
+
+
+tracker = Tracker()
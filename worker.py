@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Any, Awaitable, Callable
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+import jobs
+import partitions
+import services
+from db import SessionLocal, engine
+from rate_limiter import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+# Concurrent jobs per process (0 disables the in-app worker; run `python worker.py` instead)
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+WORKER_MAINTENANCE_INTERVAL = 60.0
+# On shutdown, running jobs get this long to finish before being cancelled
+WORKER_SHUTDOWN_GRACE = 10.0
+
+JobHandler = Callable[[AsyncSession, dict], Awaitable[Any]]
+handlers: dict[str, JobHandler] = {}
+
+
+def job_handler(kind: str):
+    def register(fn: JobHandler) -> JobHandler:
+        handlers[kind] = fn
+        return fn
+    return register
+
+
+# -----------------------------
+# Job kinds
+# -----------------------------
+@job_handler("refresh_summoner")
+async def refresh_summoner(db: AsyncSession, payload: dict):
+    profile = await services.refresh_summoner(
+        db,
+        payload["gameName"],
+        payload["tagLine"],
+        payload.get("region", "americas"),
+        priority=PRIORITY_BACKGROUND,
+    )
+    return {"puuid": profile.puuid}
+
+
+@job_handler("ingest_matches")
+async def ingest_matches(db: AsyncSession, payload: dict):
+    result = await services.ingest_matches(
+        db,
+        puuid=payload["puuid"],
+        routingRegion=payload["region"],
+        match_ids=payload.get("match_ids"),
+        count=payload.get("count", 20),
+        queue=payload.get("queue"),
+    )
+    if result["failed"] and not result["ingested"]:
+        raise RuntimeError(f"every match failed: {result['failed']}")
+    return result
+
+
+@job_handler("refresh_ranked")
+async def refresh_ranked(db: AsyncSession, payload: dict):
+    states, failed = await services.refresh_ranked_many(
+        db,
+        payload["puuids"],
+        payload.get("region", "la1"),
+        priority=PRIORITY_BACKGROUND,
+    )
+    return {"refreshed": len(states), "failed": failed}
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+class JobWorker:
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, session_factory=SessionLocal):
+        self.concurrency = concurrency
+        self.session_factory = session_factory
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        self._stopping.clear()
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._maintenance()))
+
+    async def stop(self):
+        self._stopping.set()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=WORKER_SHUTDOWN_GRACE)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, slot: int):
+        name = f"{self.worker_id}/{slot}"
+        while not self._stopping.is_set():
+            try:
+                ran = await self.run_once(name)
+            except Exception:
+                logger.exception("worker %s: could not claim a job", name)
+                ran = False
+            if not ran:
+                await self._sleep(WORKER_POLL_INTERVAL)
+
+    async def run_once(self, name: str) -> bool:
+        """Claim and run one job. Returns False when the queue is empty."""
+        async with self.session_factory() as db:
+            job = await jobs.claim_job(db, name)
+            if job is None:
+                return False
+
+            handler = handlers.get(job.kind)
+            try:
+                if handler is None:
+                    raise RuntimeError(f"no handler for job kind {job.kind!r}")
+                async with self.session_factory() as work_db:
+                    result = await handler(work_db, job.payload)
+            except asyncio.CancelledError:
+                # left as running; requeue_expired picks it up after the lease
+                raise
+            except HTTPException as e:
+                logger.warning("job %s (%s) failed: %s %s", job.id, job.kind, e.status_code, e.detail)
+                owned = await jobs.fail_job(db, job, f"{e.status_code}: {e.detail}")
+            except Exception as e:
+                logger.exception("job %s (%s) failed", job.id, job.kind)
+                owned = await jobs.fail_job(db, job, repr(e))
+            else:
+                owned = await jobs.complete_job(db, job, result)
+            if not owned:
+                # the lease expired mid-run; whoever holds the job now decides its outcome
+                logger.warning("job %s (%s): lease lost by %s, outcome dropped", job.id, job.kind, name)
+            return True
+
+    async def _maintenance(self):
+        partitions_checked_at = None
+        while not self._stopping.is_set():
+            try:
+                async with self.session_factory() as db:
+                    requeued = await jobs.requeue_expired(db)
+                if requeued:
+                    logger.warning("requeued %s jobs with an expired lease", requeued)
+            except Exception:
+                logger.exception("job maintenance failed")
+            now = asyncio.get_running_loop().time()
+            if partitions_checked_at is None or now - partitions_checked_at >= partitions.PARTITION_MAINTENANCE_INTERVAL:
+                partitions_checked_at = now
+                try:
+                    changed = await partitions.maintain(engine)
+                    if changed["created"] or changed["detached"]:
+                        logger.info("partitions created: %s, detached: %s", changed["created"], changed["detached"])
+                except Exception:
+                    logger.exception("partition maintenance failed")
+            await self._sleep(WORKER_MAINTENANCE_INTERVAL)
+
+
+async def main():
+    from riot_client import riot_clients
+    from cache import close_backend
+    from tracker import TRACKER_ENABLED, tracker
+
+    logging.basicConfig(level=logging.INFO)
+    await partitions.require_partitioned()
+    await riot_clients.open()
+    worker = JobWorker(concurrency=max(WORKER_CONCURRENCY, 1))
+    await worker.start()
+    if TRACKER_ENABLED:
+        await tracker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await tracker.stop()
+        await worker.stop()
+        await riot_clients.aclose()
+        await close_backend()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass